@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: conexiones persistentes frente a una conexión nueva por operación.
+
+Mide la latencia por llamada de una lectura (`obtener_api_key`) y una escritura
+(`guardar_api_key`) con el `DatabaseManager` actual y con una variante que abre y
+cierra una conexión en cada operación, como hacía antes. Ambos gestores se crean sin
+caché de usuarios, para que las lecturas lleguen siempre a SQLite.
+
+Uso:
+    python -m benchmarks.bench_db_conexiones [repeticiones]
+"""
+
+import contextlib
+import sqlite3
+import sys
+import tempfile
+import timeit
+from collections.abc import Iterator
+from functools import partial
+from pathlib import Path
+
+from bot.db_manager import DatabaseManager
+
+
+class ConexionPorOperacion(DatabaseManager):
+    """
+    Gestor que abre una conexión nueva en cada operación (comportamiento anterior).
+    """
+
+    @contextlib.contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _leer(self) -> Iterator[sqlite3.Connection]:
+        with self._conectar() as conn:
+            yield conn
+
+
+def medir(dbm: DatabaseManager, repeticiones: int) -> tuple[float, float]:
+    dbm.agregar_usuario("1", "bench")
+    dbm.guardar_api_key("1", "KEY")
+    lectura = timeit.timeit(partial(dbm.obtener_api_key, "1"), number=repeticiones) / repeticiones
+    escritura = timeit.timeit(partial(dbm.guardar_api_key, "1", "KEY"), number=repeticiones) / repeticiones
+    return lectura, escritura
+
+
+def main() -> None:
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as directorio:
+        antes = ConexionPorOperacion(str(Path(directorio) / "antes.db"), cache_usuarios=0)
+        despues = DatabaseManager(str(Path(directorio) / "despues.db"), cache_usuarios=0)
+        for nombre, dbm in (("conexión por operación", antes), ("conexiones persistentes", despues)):
+            lectura, escritura = medir(dbm, repeticiones)
+            print(f"{nombre:<24} lectura={lectura * 1e6:>8.1f} µs escritura={escritura * 1e6:>8.1f} µs")
+        despues.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Micro-benchmark: reparto de un precio con el índice de umbrales frente al recorrido lineal.
+
+Mide, para un símbolo con muchos suscriptores vencidos a la vez, el coste por precio de
+`seguimiento.repartir_precio`, que solo evalúa las suscripciones que da el índice, y el
+de la misma función con un índice que devuelve siempre todas, que equivale a recorrerlas
+una a una como antes de existir el índice. La base de datos y la cola de envíos se
+sustituyen por objetos que no hacen nada, para medir solo el reparto.
+
+Uso:
+    python -m benchmarks.bench_indice_umbrales [suscriptores] [repeticiones]
+"""
+
+import random
+import sys
+import timeit
+from functools import partial
+from unittest import mock
+
+from bot import seguimiento
+from bot.get_price import Cotizacion
+from bot.indice_umbrales import IndiceUmbrales
+from bot.planificador import Planificador, Suscripcion
+
+
+class Nada:
+    """
+    Sustituto de la base de datos y de la cola de envíos: acepta cualquier llamada.
+    """
+
+    def __getattr__(self, nombre: str) -> object:
+        return lambda *args, **kwargs: True
+
+
+def generar(planificador: Planificador, suscriptores: int) -> dict[str, Suscripcion]:
+    """
+    Da de alta suscripciones a AAPL con rangos aleatorios que contienen el precio de referencia (100).
+
+    Args:
+        planificador (Planificador): Planificador en el que se programan.
+        suscriptores (int): Número de suscripciones.
+
+    Returns:
+        dict[str, Suscripcion]: Suscripciones por chat_id, todas vencidas.
+    """
+    rnd = random.Random(42)
+    return {
+        str(i): planificador.programar(str(i), "AAPL", 1, "Apple", rnd.uniform(50, 99), rnd.uniform(101, 150))
+        for i in range(suscriptores)
+    }
+
+
+class SinIndice(IndiceUmbrales):
+    """
+    Índice que da todas las suscripciones por evaluar, sin coste de búsqueda.
+    """
+
+    def __init__(self, todas: set[str]) -> None:
+        super().__init__()
+        self.todas = todas
+
+    def por_evaluar(self, symbol: str, precio: float) -> set[str]:
+        return self.todas
+
+
+def repartir(
+    planificador: Planificador, indice: IndiceUmbrales, cotizacion: Cotizacion, suscripciones: dict[str, Suscripcion]
+) -> None:
+    planificador.indice = indice
+    seguimiento.repartir_precio("AAPL", cotizacion, suscripciones)
+
+
+def medir(funcion: partial[None], repeticiones: int) -> float:
+    return timeit.timeit(funcion, number=repeticiones) / repeticiones
+
+
+def main() -> None:
+    suscriptores = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    planificador = Planificador()
+    suscripciones = generar(planificador, suscriptores)
+    indice, sin_indice = planificador.indice, SinIndice(set(suscripciones))
+
+    with mock.patch.multiple(seguimiento, planificador=planificador, db=Nada(), cola_envios=Nada()):
+        comparar(planificador, indice, sin_indice, suscripciones, repeticiones)
+
+
+def comparar(
+    planificador: Planificador,
+    indice: IndiceUmbrales,
+    sin_indice: SinIndice,
+    suscripciones: dict[str, Suscripcion],
+    repeticiones: int,
+) -> None:
+    # Precio estable, movimiento moderado y desplome (todos fuera del rango)
+    for precio in (100.0, 97.0, 40.0):
+        cotizacion: Cotizacion = {"precio": precio, "nombre": "Apple", "error": None}
+        # La primera llamada deja los estados de alerta como quedan con ese precio
+        seguimiento.repartir_precio("AAPL", cotizacion, suscripciones)
+        evaluadas = len(indice.por_evaluar("AAPL", precio))
+        t_lineal = medir(partial(repartir, planificador, sin_indice, cotizacion, suscripciones), repeticiones)
+        t_indice = medir(partial(repartir, planificador, indice, cotizacion, suscripciones), repeticiones)
+        print(
+            f"precio={precio:>6.1f} evaluadas={evaluadas:>6} "
+            f"lineal={t_lineal * 1e6:>9.1f} µs índice={t_indice * 1e6:>9.1f} µs x{t_lineal / t_indice:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
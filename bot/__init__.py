@@ -5,7 +5,19 @@ Este paquete contiene toda la lógica principal del proyecto PriceTracker.
 
 Módulos incluidos:
 - `db_manager`: Acceso y gestión de la base de datos SQLite.
+- `exportacion`: Exportación a CSV (opcionalmente gzip) en streaming, repartida en partes que caben en Telegram.
+- `migraciones`: Migraciones versionadas del esquema (tabla `schema_version`) e índices.
+- `velas`: Velas OHLC de 1 minuto, 1 hora y 1 día y elección de la resolución de cada consulta.
 - `get_price`: Consulta de precios mediante la API de TwelveData.
+- `cache_precios`: Caché compartida de cotizaciones con TTL y stale-while-revalidate.
+- `cache_lru`: Caché LRU de lectura con invalidación, para API keys y suscripciones.
+- `single_flight`: Coalescencia de consultas concurrentes a un mismo recurso.
+- `limitador`: Limitador de créditos de TwelveData por API key (token bucket).
+- `resiliencia`: Reintentos con backoff y circuit breaker para proveedores externos.
+- `planificador`: Cola de prioridad de suscripciones ordenada por próxima revisión.
+- `alertas`: Estados de alerta con histéresis y enfriamiento para evitar avisos repetidos.
+- `indice_umbrales`: Índice ordenado de límites de alerta por símbolo para encontrar los fuera de rango.
+- `envios`: Cola de salida de mensajes de Telegram con límites de ritmo y fusión por chat.
 - `seguimiento`: Lógica de comprobación periódica y envío de alertas.
 - `telegram_bot`: Comandos y flujo de interacción con usuarios en Telegram.
 - `grafico`: Generación de gráficos de evolución de precios.
@@ -0,0 +1,71 @@
+"""
+Módulo: alertas.py
+
+Máquina de estados de las alertas de precio de cada suscripción.
+
+Cada suscripción está en uno de tres estados según su precio y sus límites:
+`dentro` del rango, `bajo` el límite inferior o `sobre` el límite superior.
+Solo se envía una alerta al cambiar de estado o, si el precio sigue fuera del rango,
+cuando ha pasado el periodo de enfriamiento desde la anterior.
+
+Para no alternar entre estados cuando el precio oscila alrededor de un límite, volver
+a `dentro` exige superar una banda de histéresis (una fracción del límite).
+"""
+
+import os
+
+DENTRO = "dentro"
+BAJO = "bajo"
+SOBRE = "sobre"
+
+# Fracción del límite que el precio debe recuperar para volver a considerarse dentro del rango
+HISTERESIS = float(os.getenv("ALERTAS_HISTERESIS", "0.01"))
+
+# Segundos mínimos entre dos alertas seguidas de una suscripción que sigue fuera del rango
+ENFRIAMIENTO = float(os.getenv("ALERTAS_ENFRIAMIENTO", "3600"))
+
+
+def clasificar(precio: float, limite_inf: float, limite_sup: float, estado_previo: str) -> str:
+    """
+    Calcula el estado de una suscripción para un precio, aplicando la histéresis.
+
+    Args:
+        precio (float): Precio actual.
+        limite_inf (float): Límite inferior de alerta.
+        limite_sup (float): Límite superior de alerta.
+        estado_previo (str): Estado anterior de la suscripción.
+
+    Returns:
+        str: "dentro", "bajo" o "sobre".
+    """
+    if precio < limite_inf:
+        return BAJO
+    if precio > limite_sup:
+        return SOBRE
+    # Dentro del rango, pero aún sin salir de la banda de histéresis del límite que rompió
+    if estado_previo == BAJO and precio < limite_inf + abs(limite_inf) * HISTERESIS:
+        return BAJO
+    if estado_previo == SOBRE and precio > limite_sup - abs(limite_sup) * HISTERESIS:
+        return SOBRE
+    return DENTRO
+
+
+def debe_alertar(estado_previo: str, estado: str, ultima_alerta: int | None, ahora: float) -> bool:
+    """
+    Decide si hay que enviar una alerta.
+
+    Args:
+        estado_previo (str): Estado anterior de la suscripción.
+        estado (str): Estado actual (ver `clasificar`).
+        ultima_alerta (int | None): Instante epoch de la última alerta enviada en este estado.
+        ahora (float): Instante actual (epoch).
+
+    Returns:
+        bool: True si el precio acaba de salir del rango (o ha cambiado de lado) o si
+        sigue fuera y ha vencido el enfriamiento.
+    """
+    if estado == DENTRO:
+        return False
+    if estado != estado_previo or ultima_alerta is None:
+        return True
+    return ahora - ultima_alerta >= ENFRIAMIENTO
@@ -0,0 +1,155 @@
+"""
+Módulo: cache_lru.py
+
+Caché LRU de lectura (read-through) para datos que se leen mucho más de lo que cambian.
+
+`obtener()` devuelve el valor guardado o lo carga con la función indicada y lo guarda.
+Quien modifica el dato en su origen llama a `invalidar()` después de escribirlo. Una
+carga que empezó antes de una invalidación no guarda su resultado, porque puede haber
+leído el valor anterior. Es segura entre hilos.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+
+class CacheLRU[K, V]:
+    """
+    Caché acotada con desalojo del elemento usado hace más tiempo y contadores de aciertos.
+    """
+
+    def __init__(self, max_entradas: int = 10000) -> None:
+        """
+        Inicializa una caché vacía.
+
+        Args:
+            max_entradas (int, optional): Número máximo de claves almacenadas. Con 0 no guarda nada.
+        """
+        self.max_entradas = max_entradas
+        self._entradas: OrderedDict[K, V] = OrderedDict()
+        self._cerrojo = threading.Lock()
+        # Aumenta con cada invalidación: invalida las cargas que estaban en curso
+        self._generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.invalidaciones = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def obtener(self, clave: K, cargar: Callable[[], V]) -> V:
+        """
+        Devuelve el valor de una clave, cargándolo si no está en la caché.
+
+        Args:
+            clave (K): Clave buscada.
+            cargar (Callable[[], V]): Lee el valor de su origen si no está guardado.
+
+        Returns:
+            V: Valor de la clave.
+        """
+        with self._cerrojo:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+            self.fallos += 1
+            generacion = self._generacion
+        valor = cargar()
+        with self._cerrojo:
+            if generacion == self._generacion:
+                self._guardar(clave, valor)
+        return valor
+
+    def consultar(self, clave: K) -> tuple[bool, V | None]:
+        """
+        Busca una clave sin cargarla, contando el acierto o el fallo.
+
+        Args:
+            clave (K): Clave buscada.
+
+        Returns:
+            tuple[bool, V | None]: (encontrada, valor).
+        """
+        with self._cerrojo:
+            if clave not in self._entradas:
+                self.fallos += 1
+                return False, None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return True, self._entradas[clave]
+
+    def generacion(self) -> int:
+        """
+        Devuelve la generación actual, para pasarla a `guardar()` tras una carga externa.
+
+        Returns:
+            int: Número de invalidaciones hechas hasta ahora.
+        """
+        with self._cerrojo:
+            return self._generacion
+
+    def guardar(self, clave: K, valor: V, generacion: int) -> None:
+        """
+        Guarda un valor cargado fuera de `obtener()`, salvo que haya habido una invalidación
+        desde que se empezó a cargar.
+
+        Args:
+            clave (K): Clave del valor.
+            valor (V): Valor leído del origen.
+            generacion (int): Resultado de `generacion()` antes de la carga.
+        """
+        with self._cerrojo:
+            if generacion == self._generacion:
+                self._guardar(clave, valor)
+
+    def _guardar(self, clave: K, valor: V) -> None:
+        if not self.max_entradas:
+            return
+        self._entradas[clave] = valor
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.desalojos += 1
+
+    def invalidar(self, clave: K) -> None:
+        """
+        Descarta el valor guardado de una clave tras modificarlo en su origen.
+
+        Args:
+            clave (K): Clave modificada.
+        """
+        with self._cerrojo:
+            self._entradas.pop(clave, None)
+            self._generacion += 1
+            self.invalidaciones += 1
+
+    def limpiar(self) -> None:
+        """
+        Vacía la caché y reinicia los contadores.
+        """
+        with self._cerrojo:
+            self._entradas.clear()
+            self._generacion += 1
+            self.aciertos = self.fallos = self.desalojos = self.invalidaciones = 0
+
+    def estadisticas(self) -> dict[str, int | float]:
+        """
+        Devuelve los contadores de uso de la caché.
+
+        Returns:
+            dict[str, int | float]: Aciertos, fallos, tasa de aciertos (0 a 1), desalojos,
+            invalidaciones y número de entradas.
+        """
+        with self._cerrojo:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+                "desalojos": self.desalojos,
+                "invalidaciones": self.invalidaciones,
+                "entradas": len(self._entradas),
+            }
@@ -0,0 +1,236 @@
+"""
+Módulo: cache_precios.py
+
+Caché en memoria de cotizaciones compartida entre todos los usuarios del bot.
+
+Las entradas se indexan por símbolo y tienen tres estados según su antigüedad:
+- Frescas (menos de `ttl` segundos): se devuelven sin consultar la API.
+- Obsoletas (hasta `ttl + max_obsoleto`): se devuelven al momento marcadas como
+  obsoletas y se lanza un refresco en segundo plano (stale-while-revalidate).
+- Caducadas: se consultan de nuevo a la API.
+
+Si la API falla, se sirve el último precio conocido marcado como obsoleto.
+El tamaño está acotado y se desaloja la entrada usada hace más tiempo (LRU).
+
+Las consultas pasan por una capa single-flight: si varias corrutinas piden a la vez
+el mismo símbolo con la misma API key, todas comparten una única petición a la API. Con
+otra clave se consulta aparte, porque el error de una clave (inválida, sin créditos) no
+es el resultado de la otra.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from bot.get_price import Cotizacion, fetch_stock_prices
+from bot.single_flight import SingleFlight
+
+
+class CachePrecios:
+    """
+    Caché LRU de cotizaciones con TTL y stale-while-revalidate.
+
+    Expone contadores de aciertos, fallos y desalojos para poder dimensionarla.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        max_obsoleto: float = 900.0,
+        max_entradas: int = 5000,
+        reloj: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Inicializa una caché vacía.
+
+        Args:
+            ttl (float, optional): Segundos durante los que una cotización se considera fresca.
+            max_obsoleto (float, optional): Segundos extra durante los que se sirve obsoleta mientras se refresca.
+            max_entradas (int, optional): Número máximo de símbolos almacenados.
+            reloj (Callable[[], float], optional): Fuente de tiempo (inyectable en tests).
+        """
+        self.ttl = ttl
+        self.max_obsoleto = max_obsoleto
+        self.max_entradas = max_entradas
+        self._reloj = reloj
+        self._entradas: OrderedDict[str, tuple[Cotizacion, float]] = OrderedDict()
+        self._refrescando: set[str] = set()
+        self._tareas: set[asyncio.Task[None]] = set()
+        # Por (symbol, api_key)
+        self._vuelos: SingleFlight[tuple[str, str], Cotizacion] = SingleFlight()
+        self.aciertos = 0
+        self.aciertos_obsoletos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.respaldos = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def estadisticas(self) -> dict[str, int]:
+        """
+        Devuelve los contadores de uso de la caché.
+
+        Returns:
+            dict[str, int]: Aciertos, aciertos obsoletos, fallos, desalojos, respuestas de
+            respaldo (API caída), consultas coalescidas y número de entradas.
+        """
+        return {
+            "aciertos": self.aciertos,
+            "aciertos_obsoletos": self.aciertos_obsoletos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "respaldos": self.respaldos,
+            "coalescidas": self._vuelos.coalescidas,
+            "entradas": len(self._entradas),
+        }
+
+    def limpiar(self) -> None:
+        """
+        Vacía la caché y reinicia los contadores.
+        """
+        self._entradas.clear()
+        self.aciertos = self.aciertos_obsoletos = self.fallos = self.desalojos = self.respaldos = 0
+
+    def guardar(self, symbol: str, cotizacion: Cotizacion) -> None:
+        """
+        Almacena una cotización válida, desalojando la menos usada si se supera el tamaño.
+
+        Args:
+            symbol (str): Símbolo bursátil.
+            cotizacion (Cotizacion): Resultado sin error devuelto por la API.
+        """
+        self._entradas[symbol] = (cotizacion, self._reloj())
+        self._entradas.move_to_end(symbol)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.desalojos += 1
+
+    async def obtener(self, symbol: str, api_key: str, permitir_obsoleto: bool = True) -> Cotizacion:
+        """
+        Devuelve la cotización de un símbolo, consultando la API solo si es necesario.
+
+        Args:
+            symbol (str): Símbolo bursátil.
+            api_key (str): Clave de API con la que consultar si no hay dato en caché.
+            permitir_obsoleto (bool, optional): Si es False, una entrada obsoleta se trata como fallo.
+
+        Returns:
+            Cotizacion: Resultado con la clave adicional "obsoleto".
+        """
+        resultados = await self.obtener_varias([symbol], api_key, permitir_obsoleto)
+        return resultados[symbol]
+
+    async def obtener_varias(
+        self, symbols: list[str], api_key: str, permitir_obsoleto: bool = True
+    ) -> dict[str, Cotizacion]:
+        """
+        Devuelve las cotizaciones de varios símbolos, agrupando los fallos en una consulta por lote.
+
+        Args:
+            symbols (list[str]): Símbolos bursátiles.
+            api_key (str): Clave de API con la que consultar los fallos.
+            permitir_obsoleto (bool, optional): Si es False, una entrada obsoleta se trata como fallo.
+
+        Returns:
+            dict[str, Cotizacion]: Resultado por símbolo con la clave adicional "obsoleto".
+        """
+        ahora = self._reloj()
+        resultados: dict[str, Cotizacion] = {}
+        pendientes: list[str] = []
+        a_refrescar: list[str] = []
+
+        for symbol in dict.fromkeys(symbols):
+            entrada = self._entradas.get(symbol)
+            edad = ahora - entrada[1] if entrada is not None else float("inf")
+            if entrada is not None and edad <= self.ttl:
+                self.aciertos += 1
+                self._entradas.move_to_end(symbol)
+                resultados[symbol] = {**entrada[0], "obsoleto": False}
+            elif entrada is not None and permitir_obsoleto and edad <= self.ttl + self.max_obsoleto:
+                self.aciertos_obsoletos += 1
+                self._entradas.move_to_end(symbol)
+                resultados[symbol] = {**entrada[0], "obsoleto": True}
+                a_refrescar.append(symbol)
+            else:
+                self.fallos += 1
+                pendientes.append(symbol)
+
+        if a_refrescar:
+            self._refrescar_en_segundo_plano(a_refrescar, api_key)
+
+        if pendientes:
+            resultados.update(await self._consultar(pendientes, api_key))
+
+        return resultados
+
+    async def _consultar(self, symbols: list[str], api_key: str) -> dict[str, Cotizacion]:
+        """
+        Consulta la API, guarda los aciertos y usa el último precio conocido para los errores.
+
+        Los símbolos que ya se están consultando con la misma API key no generan una nueva
+        petición: se espera al resultado de la consulta en vuelo.
+
+        Args:
+            symbols (list[str]): Símbolos a consultar.
+            api_key (str): Clave de API de Twelve Data.
+
+        Returns:
+            dict[str, Cotizacion]: Resultado por símbolo.
+        """
+
+        async def consultar(pendientes: list[tuple[str, str]]) -> dict[tuple[str, str], Cotizacion]:
+            datos = await fetch_stock_prices([symbol for symbol, _ in pendientes], api_key)
+            return {(symbol, api_key): data for symbol, data in datos.items()}
+
+        datos = await self._vuelos.ejecutar_lote([(symbol, api_key) for symbol in symbols], consultar)
+        resultados: dict[str, Cotizacion] = {}
+        for symbol in symbols:
+            data = datos[(symbol, api_key)]
+            if not data["error"] and data["precio"] is not None:
+                self.guardar(symbol, data)
+                resultados[symbol] = {**data, "obsoleto": False}
+            elif symbol in self._entradas:
+                # La API ha fallado: mejor un precio antiguo que ninguno
+                self.respaldos += 1
+                logging.warning(f"Sirviendo precio en caché para {symbol} tras error: {data['error']}")
+                resultados[symbol] = {**self._entradas[symbol][0], "obsoleto": True}
+            else:
+                resultados[symbol] = {**data, "obsoleto": False}
+        return resultados
+
+    def _refrescar_en_segundo_plano(self, symbols: list[str], api_key: str) -> None:
+        """
+        Lanza una tarea que refresca los símbolos obsoletos que no se estén refrescando ya.
+
+        Args:
+            symbols (list[str]): Símbolos obsoletos.
+            api_key (str): Clave de API de Twelve Data.
+        """
+        nuevos = [s for s in symbols if s not in self._refrescando]
+        if not nuevos:
+            return
+        self._refrescando.update(nuevos)
+
+        async def refrescar() -> None:
+            try:
+                await self._consultar(nuevos, api_key)
+            except Exception as e:
+                logging.error(f"Error al refrescar la caché de precios: {e}")
+            finally:
+                self._refrescando.difference_update(nuevos)
+
+        tarea = asyncio.create_task(refrescar())
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+
+# Caché compartida por todo el bot
+cache_precios = CachePrecios(
+    ttl=float(os.getenv("PRECIOS_CACHE_TTL", "60")),
+    max_obsoleto=float(os.getenv("PRECIOS_CACHE_MAX_OBSOLETO", "900")),
+    max_entradas=int(os.getenv("PRECIOS_CACHE_MAX_ENTRADAS", "5000")),
+)
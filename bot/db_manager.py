@@ -4,12 +4,126 @@ Módulo: db_manager.py
 Este módulo implementa el gestor de base de datos SQLite para el proyecto PriceTracker.
 Permite gestionar usuarios, API keys, productos seguidos, historial de precios y exportación a CSV.
 Compatible con bots de Telegram y preparado para documentación técnica automática.
+
+Las conexiones son de larga duración: una única conexión de escritura, protegida por un
+cerrojo, y un pequeño grupo de conexiones de solo lectura que se reutilizan. Así cada
+operación se ahorra abrir el fichero y volver a leer el esquema, y conserva la caché de
+sentencias preparadas de su conexión. `cerrar()` las libera al apagar el bot.
+
+Cada conexión se configura al abrirse con un perfil de almacenamiento (ver `PERFILES`).
+El perfil por defecto usa WAL, de modo que las escrituras del seguimiento no bloquean las
+lecturas de `/historial` o las exportaciones, y `synchronous=NORMAL`, que no hace fsync en
+cada commit (solo en los checkpoints).
+
+El historial de precios no se guarda por usuario: cada precio que consulta el seguimiento
+se guarda una sola vez en `precios_mercado`, y el historial de un usuario son los precios
+de mercado de los periodos en que siguió cada símbolo (`periodos_seguimiento`) más sus
+capturas manuales con `/guardar` (`capturas_manuales`). La vista `historial_precios`
+reproduce la tabla antigua para consultas externas.
+
+Los precios de mercado se acumulan además en velas OHLC de 1 minuto, 1 hora y 1 día
+(ver `bot.velas`). Los gráficos, las exportaciones y el recálculo de las estadísticas
+leen la resolución más gruesa que responde a cada consulta, y `aplicar_retencion()` purga
+los precios sueltos y las velas de minuto más antiguos que `RETENCION`.
+
+`estadisticas_capturas` guarda por usuario y símbolo el número de capturas manuales, su
+suma, la suma de sus cuadrados y sus extremos; un trigger de `bot.migraciones` la actualiza
+con cada `/guardar`. Los precios de mercado no se acumulan por usuario, porque cada precio
+costaría una escritura por seguidor: `/media` suma a esa fila las velas de los periodos de
+seguimiento, que también guardan la suma de cuadrados.
+
+Las API keys y las suscripciones de cada usuario, que consultan casi todos los comandos,
+se guardan en cachés LRU en memoria (ver `bot.cache_lru`) que se invalidan al modificarlas
+desde este gestor. Se asume que ningún otro proceso las modifica mientras el bot funciona.
+
+Con durabilidad "agrupada" los precios del historial se acumulan en memoria y se escriben
+juntos (`executemany` en una sola transacción) cada `lote_historial` filas o cada
+`espera_historial` segundos, lo que ocurra antes. Las lecturas del historial de este mismo
+proceso vuelcan antes lo pendiente, así que siempre ven sus propias escrituras; otros
+procesos las ven como mucho `espera_historial` segundos tarde. Con durabilidad "inmediata"
+cada precio se escribe en su propia transacción.
 """
 
+import contextlib
+import heapq
+import logging
+import math
 import os
+import queue
 import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from operator import itemgetter
 from typing import cast
 
+from bot import velas
+from bot.cache_lru import CacheLRU
+from bot.migraciones import RESUMIR_CAPTURAS, migrar
+
+# Variables por consulta en las búsquedas con IN (SQLite admite 999 en versiones antiguas)
+MAX_VARIABLES = 500
+
+# Conexiones de solo lectura que se mantienen abiertas para reutilizarlas
+LECTORES = int(os.getenv("DB_LECTORES", "4"))
+
+# Sentencias preparadas que guarda cada conexión
+CACHE_SENTENCIAS = int(os.getenv("DB_CACHE_SENTENCIAS", "256"))
+
+# Usuarios cuyas API keys y suscripciones se conservan en memoria
+CACHE_USUARIOS = int(os.getenv("DB_CACHE_USUARIOS", "10000"))
+
+# Perfiles de almacenamiento: PRAGMAs que se aplican (en este orden) a cada conexión al abrirla
+PERFILES: dict[str, dict[str, str | int]] = {
+    # Lectores y escritor concurrentes; un corte de luz puede perder los últimos commits, no corromper
+    "rendimiento": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "temp_store": "MEMORY",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # En KiB cuando es negativo: 64 MiB
+        "busy_timeout": 5000,
+    },
+    # Comportamiento clásico de SQLite: diario de rollback y fsync en cada commit
+    "seguro": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "temp_store": "DEFAULT",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "busy_timeout": 5000,
+    },
+}
+
+PERFIL = os.getenv("DB_PERFIL", "rendimiento")
+
+# Escritura del historial de precios: "agrupada" (por lotes) o "inmediata" (una transacción por precio)
+DURABILIDAD = os.getenv("DB_DURABILIDAD", "agrupada")
+DURABILIDADES = ("agrupada", "inmediata")
+
+# Filas pendientes que fuerzan un volcado y tiempo máximo (s) que una fila espera en memoria
+LOTE_HISTORIAL = int(os.getenv("DB_LOTE_HISTORIAL", "500"))
+ESPERA_HISTORIAL = float(os.getenv("DB_ESPERA_HISTORIAL_MS", "1000")) / 1000
+
+# Días que se conservan los precios de mercado sueltos y las velas de minuto (las de hora y día, siempre)
+RETENCION: dict[int, float] = {
+    velas.TICKS: float(os.getenv("DB_RETENCION_TICKS_DIAS", "30")),
+    velas.MINUTO: float(os.getenv("DB_RETENCION_MINUTOS_DIAS", "365")),
+}
+
+# Puntos como máximo de la serie de un gráfico
+MAX_PUNTOS_SERIE = 200
+
+# (symbol, intervalo_min, nombre_empresa, limite_inferior, limite_superior)
+type Producto = tuple[str, int, str, float, float]
+
+# (num, suma, suma_cuadrados, minimo, maximo)
+type Resumen = tuple[int, float, float, float, float]
+
+
+def _ahora() -> str:
+    return velas.a_fecha(int(time.time()))
+
 
 class DatabaseManager:
     """
@@ -19,13 +133,50 @@ class DatabaseManager:
     centralizando la lógica de acceso a la base de datos para el bot PriceTracker.
     """
 
-    def __init__(self, db_path: str = "data/basedatos.db") -> None:
+    def __init__(
+        self,
+        db_path: str = "data/basedatos.db",
+        lectores: int = LECTORES,
+        perfil: str = PERFIL,
+        pragmas: dict[str, str | int] | None = None,
+        durabilidad: str = DURABILIDAD,
+        lote_historial: int = LOTE_HISTORIAL,
+        espera_historial: float = ESPERA_HISTORIAL,
+        retencion: dict[int, float] | None = None,
+        cache_usuarios: int = CACHE_USUARIOS,
+    ) -> None:
         """
         Inicializa el gestor de base de datos, creando las tablas necesarias si no existen.
 
         Args:
             db_path (str, optional): Ruta del archivo SQLite. Por defecto 'basedatos.db'.
+            lectores (int, optional): Conexiones de lectura que se conservan abiertas. Una base
+                en memoria solo existe en su conexión, así que en ese caso se lee por la de escritura.
+            perfil (str, optional): Nombre del perfil de almacenamiento (ver `PERFILES`).
+            pragmas (dict[str, str | int] | None, optional): PRAGMAs que sustituyen a los del perfil.
+            durabilidad (str, optional): "agrupada" o "inmediata" (escritura del historial de precios).
+            lote_historial (int, optional): Precios pendientes que fuerzan un volcado.
+            espera_historial (float, optional): Segundos máximos que un precio espera a escribirse.
+            retencion (dict[int, float] | None, optional): Días que se conserva cada nivel del
+                historial de mercado (ver `RETENCION`). Las velas de día no se purgan.
+            cache_usuarios (int, optional): Usuarios cuyas API keys y suscripciones se guardan
+                en memoria (0 las desactiva).
+
+        Raises:
+            ValueError: Si el perfil, alguno de los PRAGMAs, la durabilidad o algún nivel de retención no existe.
         """
+        if durabilidad not in DURABILIDADES:
+            raise ValueError(f"Durabilidad desconocida: {durabilidad}")
+        if perfil not in PERFILES:
+            raise ValueError(f"Perfil de base de datos desconocido: {perfil}")
+        self.pragmas = {**PERFILES[perfil], **(pragmas or {})}
+        desconocidos = self.pragmas.keys() - PERFILES[perfil].keys()
+        if desconocidos:
+            raise ValueError(f"PRAGMAs no admitidos: {', '.join(sorted(desconocidos))}")
+        self.retencion = dict(RETENCION if retencion is None else retencion)
+        if not self.retencion.keys() <= {velas.TICKS, velas.MINUTO, velas.HORA}:
+            raise ValueError(f"Niveles de retención no admitidos: {sorted(self.retencion)}")
+
         self.db_path = db_path
         # Solo intentamos crear el directorio si es una ruta real y no una base en memoria
         if db_path != ":memory:":
@@ -33,57 +184,118 @@ class DatabaseManager:
             if dir_name:
                 os.makedirs(dir_name, exist_ok=True)
 
+        self.max_lectores = 0 if db_path == ":memory:" else lectores
+        self._escritor: sqlite3.Connection | None = None
+        self._cerrojo_escritura = threading.RLock()
+        self._lectores: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+
+        self.durabilidad = durabilidad
+        self.lote_historial = lote_historial
+        self.espera_historial = espera_historial
+        # (chat_id, symbol, precio, timestamp); chat_id None para los precios de mercado
+        self._precios_pendientes: list[tuple[str | None, str, float, str]] = []
+        self._cerrojo_pendientes = threading.Lock()
+        self._temporizador: threading.Timer | None = None
+
+        self._cache_api_keys: CacheLRU[str, str | None] = CacheLRU(cache_usuarios)
+        self._cache_productos: CacheLRU[str, tuple[Producto, ...]] = CacheLRU(cache_usuarios)
+
         self._crear_tablas()
 
-    def _conectar(self) -> sqlite3.Connection:
+    def _abrir(self) -> sqlite3.Connection:
         """
-        Abre una nueva conexión a la base de datos SQLite.
+        Abre una conexión que puede usarse desde cualquier hilo (el acceso se serializa aquí)
+        y le aplica los PRAGMAs del perfil de almacenamiento.
 
         Returns:
             sqlite3.Connection: Objeto de conexión a la base de datos.
         """
-        return sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=CACHE_SENTENCIAS)
+        for pragma, valor in self.pragmas.items():
+            # Los PRAGMA no admiten parámetros; nombres y valores vienen de `PERFILES` o del código
+            conn.execute(f"PRAGMA {pragma} = {valor}")
+        return conn
+
+    @contextlib.contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        """
+        Presta en exclusiva la conexión de escritura, abriéndola la primera vez.
+
+        Al salir se confirma la transacción, o se deshace si hubo una excepción.
+
+        Yields:
+            sqlite3.Connection: Conexión de escritura.
+        """
+        with self._cerrojo_escritura:
+            if self._escritor is None:
+                self._escritor = self._abrir()
+            with self._escritor as conn:
+                yield conn
+
+    @contextlib.contextmanager
+    def _leer(self) -> Iterator[sqlite3.Connection]:
+        """
+        Presta una conexión de solo lectura del grupo.
+
+        Si todas están en uso se abre una más, que se cierra al devolverla si el grupo ya
+        está completo; así una lectura nunca espera a otra.
+
+        Yields:
+            sqlite3.Connection: Conexión de lectura.
+        """
+        if not self.max_lectores:
+            with self._conectar() as conn:
+                yield conn
+            return
+
+        try:
+            conn = self._lectores.get_nowait()
+        except queue.Empty:
+            conn = self._abrir()
+            conn.execute("PRAGMA query_only = ON")
+        try:
+            yield conn
+        finally:
+            if self._lectores.qsize() < self.max_lectores:
+                self._lectores.put_nowait(conn)
+            else:
+                conn.close()
+
+    def cerrar(self) -> None:
+        """
+        Cierra todas las conexiones abiertas. Se llama al apagar el bot.
+
+        Antes escribe los precios pendientes. Si después se vuelve a usar el gestor, las
+        conexiones se reabren (una base en memoria se pierde al cerrarla).
+        """
+        with self._cerrojo_escritura:
+            try:
+                self.volcar_precios()
+            finally:
+                if self._escritor is not None:
+                    self._escritor.close()
+                    self._escritor = None
+        while True:
+            try:
+                self._lectores.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def estadisticas_cache(self) -> dict[str, dict[str, int | float]]:
+        """
+        Devuelve los contadores de las cachés de API keys y de suscripciones.
+
+        Returns:
+            dict[str, dict[str, int | float]]: Contadores de cada caché (ver `CacheLRU.estadisticas`).
+        """
+        return {"api_keys": self._cache_api_keys.estadisticas(), "suscripciones": self._cache_productos.estadisticas()}
 
     def _crear_tablas(self) -> None:
         """
-        Crea las tablas principales (usuarios, productos_seguidos, historial_precios) si no existen.
+        Crea o actualiza el esquema aplicando las migraciones pendientes (ver `bot.migraciones`).
         """
         with self._conectar() as conn:
-            cursor = conn.cursor()
-            # Tabla de usuarios (incluye API Key)
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT UNIQUE NOT NULL,
-                username TEXT,
-                fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                api_key TEXT
-            );
-            """)
-            # Tabla de productos seguidos
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS productos_seguidos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT NOT NULL,
-                symbol TEXT NOT NULL,
-                nombre_empresa TEXT,
-                intervalo_min INTEGER DEFAULT 15,
-                limite_inferior REAL,
-                limite_superior REAL,
-                UNIQUE(chat_id, symbol)
-            );
-            """)
-            # Tabla de historial de precios
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historial_precios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT NOT NULL,
-                symbol TEXT NOT NULL,
-                precio REAL NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            );
-            """)
-            conn.commit()
+            migrar(conn)
 
     # ================== GESTIÓN DE USUARIOS Y API KEY ==================
 
@@ -123,22 +335,70 @@ class DatabaseManager:
                 (api_key, chat_id),
             )
             conn.commit()
+        self._cache_api_keys.invalidar(chat_id)
 
     def obtener_api_key(self, chat_id: str) -> str | None:
         """
         Recupera la API Key de un usuario.
 
+        Se sirve de la caché mientras no cambie; solo la primera consulta lee la base de datos.
+
         Args:
             chat_id (str): ID de usuario de Telegram.
 
         Returns:
             Optional[str]: API Key si existe, None en caso contrario.
         """
-        with self._conectar() as conn:
+
+        def leer() -> str | None:
+            with self._leer() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT api_key FROM usuarios WHERE chat_id = ?", (chat_id,))
+                result = cursor.fetchone()
+                return cast(str | None, result[0]) if result else None
+
+        return self._cache_api_keys.obtener(chat_id, leer)
+
+    def obtener_api_keys(self, chat_ids: Iterable[str]) -> dict[str, str]:
+        """
+        Recupera en bloque las API Keys de varios usuarios.
+
+        Las que están en la caché no se consultan; las leídas se añaden a ella.
+
+        Args:
+            chat_ids (Iterable[str]): IDs de usuario de Telegram.
+
+        Returns:
+            dict[str, str]: API Key por chat_id. Los usuarios sin clave no aparecen.
+        """
+        claves: dict[str, str] = {}
+        ids: list[str] = []
+        for chat_id in dict.fromkeys(chat_ids):
+            encontrada, api_key = self._cache_api_keys.consultar(chat_id)
+            if not encontrada:
+                ids.append(chat_id)
+            elif api_key:
+                claves[chat_id] = api_key
+        if not ids:
+            return claves
+
+        generacion = self._cache_api_keys.generacion()
+        leidas: dict[str, str] = {}
+        with self._leer() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT api_key FROM usuarios WHERE chat_id = ?", (chat_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            for i in range(0, len(ids), MAX_VARIABLES):
+                lote = ids[i : i + MAX_VARIABLES]
+                cursor.execute(
+                    f"""
+                    SELECT chat_id, api_key FROM usuarios
+                    WHERE chat_id IN ({", ".join("?" * len(lote))}) AND api_key IS NOT NULL AND api_key != ''
+                    """,
+                    lote,
+                )
+                leidas.update(cursor.fetchall())
+        for chat_id, api_key in leidas.items():
+            self._cache_api_keys.guardar(chat_id, api_key, generacion)
+        return claves | leidas
 
     def obtener_usuarios(self) -> list[str]:
         """
@@ -147,7 +407,7 @@ class DatabaseManager:
         Returns:
             List[str]: Lista de chat_id de Telegram.
         """
-        with self._conectar() as conn:
+        with self._leer() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT chat_id FROM usuarios")
             return [row[0] for row in cursor.fetchall()]
@@ -184,29 +444,98 @@ class DatabaseManager:
                 """,
                 (chat_id, symbol, nombre_empresa, intervalo, limite_inf, limite_sup),
             )
+            # Con límites nuevos el estado de alerta vuelve a empezar, como en memoria (ver `planificador.programar`)
+            cursor.execute(
+                """
+                DELETE FROM estado_alertas
+                WHERE chat_id = ? AND symbol = ?
+                """,
+                (chat_id, symbol),
+            )
+            # Abre un periodo de seguimiento si no hay ya uno abierto (actualizar límites no lo corta)
+            cursor.execute(
+                """
+                INSERT INTO periodos_seguimiento (chat_id, symbol, desde)
+                SELECT ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM periodos_seguimiento WHERE chat_id = ? AND symbol = ? AND hasta IS NULL
+                )
+                ON CONFLICT (chat_id, symbol, desde) DO UPDATE SET hasta = NULL
+                """,
+                (chat_id, symbol, _ahora(), chat_id, symbol),
+            )
             conn.commit()
+        self._cache_productos.invalidar(chat_id)
 
-    def obtener_productos(self, chat_id: str) -> list[tuple[str, int, str, float, float]]:
+    def obtener_productos(self, chat_id: str) -> list[Producto]:
         """
         Obtiene la lista de acciones seguidas por un usuario.
 
+        Se sirve de la caché mientras el usuario no añada ni deje ninguna acción.
+
         Args:
             chat_id (str): ID de usuario de Telegram.
 
         Returns:
             List[Tuple[str, int, str, float, float]]: Lista de tuplas con información de acciones seguidas.
         """
-        with self._conectar() as conn:
+
+        def leer() -> tuple[Producto, ...]:
+            with self._leer() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT symbol, intervalo_min, nombre_empresa, limite_inferior, limite_superior
+                    FROM productos_seguidos
+                    WHERE chat_id = ?
+                    """,
+                    (chat_id,),
+                )
+                return tuple(cursor.fetchall())
+
+        return list(self._cache_productos.obtener(chat_id, leer))
+
+    def obtener_simbolos_seguidos(self, chat_id: str) -> frozenset[str]:
+        """
+        Devuelve los símbolos que sigue un usuario (desde la caché de suscripciones).
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+
+        Returns:
+            frozenset[str]: Tickers seguidos.
+        """
+        return frozenset(producto[0] for producto in self.obtener_productos(chat_id))
+
+    def iterar_suscripciones_activas(self, tamano_lote: int = 500) -> Iterator[tuple[str, str, int, str, float, float, str]]:
+        """
+        Recorre todas las suscripciones cuyo usuario tiene API Key, junto con esa clave.
+
+        Es una única consulta (JOIN por los índices únicos de `usuarios.chat_id` y
+        `productos_seguidos(chat_id, symbol)`) leída por lotes con `fetchmany`, de modo
+        que no se cargan todas las filas en memoria a la vez. Los usuarios sin clave o
+        sin suscripciones se descartan en la propia consulta.
+
+        Args:
+            tamano_lote (int, optional): Filas leídas en cada `fetchmany`. Default 500.
+
+        Yields:
+            tuple[str, str, int, str, float, float, str]: (chat_id, symbol, intervalo_min,
+            nombre_empresa, limite_inferior, limite_superior, api_key).
+        """
+        with self._leer() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                SELECT symbol, intervalo_min, nombre_empresa, limite_inferior, limite_superior
-                FROM productos_seguidos
-                WHERE chat_id = ?
-                """,
-                (chat_id,),
+                SELECT p.chat_id, p.symbol, p.intervalo_min, p.nombre_empresa,
+                       p.limite_inferior, p.limite_superior, u.api_key
+                FROM productos_seguidos AS p
+                JOIN usuarios AS u ON u.chat_id = p.chat_id
+                WHERE u.api_key IS NOT NULL AND u.api_key != ''
+                """
             )
-            return cursor.fetchall()
+            while filas := cursor.fetchmany(tamano_lote):
+                yield from filas
 
     def eliminar_producto(self, chat_id: str, symbol: str) -> None:
         """
@@ -225,7 +554,30 @@ class DatabaseManager:
                 """,
                 (chat_id, symbol),
             )
+            cursor.execute(
+                """
+                DELETE FROM estado_seguimiento
+                WHERE chat_id = ? AND symbol = ?
+                """,
+                (chat_id, symbol),
+            )
+            cursor.execute(
+                """
+                DELETE FROM estado_alertas
+                WHERE chat_id = ? AND symbol = ?
+                """,
+                (chat_id, symbol),
+            )
+            # El historial visto hasta ahora se conserva: solo se cierra el periodo
+            cursor.execute(
+                """
+                UPDATE periodos_seguimiento SET hasta = ?
+                WHERE chat_id = ? AND symbol = ? AND hasta IS NULL
+                """,
+                (_ahora(), chat_id, symbol),
+            )
             conn.commit()
+        self._cache_productos.invalidar(chat_id)
 
     def obtener_limites(self, chat_id: str, symbol: str) -> tuple[float, float] | None:
         """
@@ -238,7 +590,7 @@ class DatabaseManager:
         Returns:
             Tuple[float, float]: Límite inferior y superior configurados.
         """
-        with self._conectar() as conn:
+        with self._leer() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -253,28 +605,171 @@ class DatabaseManager:
                 return None
             return cast(tuple[float, float], resultado)
 
+    # ================== ESTADO DEL PLANIFICADOR ==================
+
+    def guardar_revisiones(self, revisiones: list[tuple[str, str, float, float]]) -> None:
+        """
+        Guarda la última y la próxima revisión de varias suscripciones en una sola transacción.
+
+        Args:
+            revisiones (list[tuple[str, str, float, float]]): Tuplas (chat_id, symbol,
+                ultima_revision, proxima_revision) con instantes epoch.
+        """
+        with self._conectar() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO estado_seguimiento (chat_id, symbol, ultima_revision, proxima_revision)
+                VALUES (?, ?, ?, ?)
+                """,
+                revisiones,
+            )
+            conn.commit()
+
+    def obtener_revisiones(self) -> dict[tuple[str, str], tuple[float | None, float]]:
+        """
+        Recupera el estado guardado del planificador.
+
+        Returns:
+            dict[tuple[str, str], tuple[float | None, float]]: Última y próxima revisión por (chat_id, symbol).
+        """
+        with self._leer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT chat_id, symbol, ultima_revision, proxima_revision FROM estado_seguimiento")
+            return {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+    def guardar_estados_alerta(self, estados: list[tuple[str, str, str, int | None]]) -> None:
+        """
+        Guarda el estado de alerta de varias suscripciones en una sola transacción.
+
+        Args:
+            estados (list[tuple[str, str, str, int | None]]): Tuplas (chat_id, symbol, estado,
+                ultima_alerta) con la última alerta como instante epoch.
+        """
+        with self._conectar() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT OR REPLACE INTO estado_alertas (chat_id, symbol, estado, ultima_alerta)
+                VALUES (?, ?, ?, ?)
+                """,
+                estados,
+            )
+            conn.commit()
+
+    def obtener_estados_alerta(self) -> dict[tuple[str, str], tuple[str, int | None]]:
+        """
+        Recupera el estado de alerta guardado de todas las suscripciones.
+
+        Returns:
+            dict[tuple[str, str], tuple[str, int | None]]: Estado y última alerta por (chat_id, symbol).
+        """
+        with self._leer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT chat_id, symbol, estado, ultima_alerta FROM estado_alertas")
+            return {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
     # ================== GESTIÓN DEL HISTORIAL DE PRECIOS ==================
 
     def guardar_precio(self, chat_id: str, symbol: str, precio: float) -> None:
         """
-        Guarda un nuevo precio para una acción seguida en el historial del usuario.
+        Guarda un precio en el historial de un único usuario (captura manual, `/guardar`).
+
+        Con durabilidad "agrupada" el precio queda pendiente hasta el siguiente volcado
+        (ver `volcar_precios`); la fecha registrada es la de esta llamada.
 
         Args:
             chat_id (str): ID de usuario de Telegram.
             symbol (str): Ticker de la acción.
             precio (float): Precio registrado.
         """
+        self._guardar((chat_id, symbol, precio, _ahora()))
+
+    def guardar_precio_mercado(self, symbol: str, precio: float) -> None:
+        """
+        Guarda una sola vez un precio consultado por el seguimiento.
+
+        Aparece en el historial de todos los usuarios que siguen el símbolo en ese momento.
+        Si ya hay un precio del símbolo en el mismo segundo, se ignora.
+
+        Args:
+            symbol (str): Ticker de la acción.
+            precio (float): Precio registrado.
+        """
+        self._guardar((None, symbol, precio, _ahora()))
+
+    def _guardar(self, fila: tuple[str | None, str, float, str]) -> None:
+        if self.durabilidad == "inmediata":
+            self._insertar_precios([fila])
+            return
+
+        with self._cerrojo_pendientes:
+            self._precios_pendientes.append(fila)
+            lleno = len(self._precios_pendientes) >= self.lote_historial
+            if not lleno and self._temporizador is None:
+                self._temporizador = threading.Timer(self.espera_historial, self._volcar_por_tiempo)
+                self._temporizador.daemon = True
+                self._temporizador.start()
+        if lleno:
+            self.volcar_precios()
+
+    def _insertar_precios(self, filas: list[tuple[str | None, str, float, str]]) -> None:
         with self._conectar() as conn:
             cursor = conn.cursor()
-            cursor.execute(
+            cursor.executemany(
                 """
-                INSERT INTO historial_precios (chat_id, symbol, precio)
+                INSERT OR IGNORE INTO precios_mercado (symbol, precio, timestamp)
                 VALUES (?, ?, ?)
                 """,
-                (chat_id, symbol, precio),
+                [fila[1:] for fila in filas if fila[0] is None],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO capturas_manuales (chat_id, symbol, precio, timestamp)
+                VALUES (?, ?, ?, ?)
+                """,
+                [fila for fila in filas if fila[0] is not None],
             )
             conn.commit()
 
+    def volcar_precios(self) -> int:
+        """
+        Escribe en una sola transacción todos los precios pendientes.
+
+        Si la escritura falla, los precios vuelven a quedar pendientes y se propaga el error.
+
+        Returns:
+            int: Número de precios escritos.
+        """
+        with self._cerrojo_escritura:
+            with self._cerrojo_pendientes:
+                filas, self._precios_pendientes = self._precios_pendientes, []
+                if self._temporizador is not None:
+                    self._temporizador.cancel()
+                    self._temporizador = None
+            if not filas:
+                return 0
+            try:
+                self._insertar_precios(filas)
+            except Exception:
+                with self._cerrojo_pendientes:
+                    self._precios_pendientes[:0] = filas
+                raise
+        return len(filas)
+
+    def _volcar_por_tiempo(self) -> None:
+        try:
+            self.volcar_precios()
+        except Exception as e:
+            logging.error(f"Error al volcar el historial de precios: {e}")
+
+    def _ver_pendientes(self) -> None:
+        """
+        Vuelca los precios pendientes para que la lectura siguiente los vea.
+        """
+        if self._precios_pendientes:
+            self.volcar_precios()
+
     def obtener_historial(self, chat_id: str, symbol: str) -> list[tuple[float, str]]:
         """
         Recupera el historial de precios recientes para una acción de un usuario.
@@ -286,16 +781,37 @@ class DatabaseManager:
         Returns:
             List[Tuple[float, str]]: Lista de tuplas (precio, timestamp), ordenados por fecha descendente.
         """
-        with self._conectar() as conn:
+        self._ver_pendientes()
+        with self._leer() as conn:
             cursor = conn.cursor()
+            # Cada rama recorre su índice hacia atrás y se detiene en los 10 más recientes
             cursor.execute(
                 """
-                SELECT precio, timestamp FROM historial_precios
-                WHERE chat_id = ? AND symbol = ?
-                ORDER BY id DESC
+                SELECT precio, timestamp FROM (
+                    SELECT m.precio, m.timestamp FROM precios_mercado AS m
+                    WHERE m.symbol = :symbol
+                      AND m.timestamp >= (
+                          SELECT MIN(desde) FROM periodos_seguimiento WHERE chat_id = :chat_id AND symbol = :symbol
+                      )
+                      AND EXISTS (
+                          SELECT 1 FROM periodos_seguimiento AS p
+                          WHERE p.chat_id = :chat_id AND p.symbol = :symbol
+                            AND m.timestamp >= p.desde AND (p.hasta IS NULL OR m.timestamp < p.hasta)
+                      )
+                    ORDER BY m.timestamp DESC
+                    LIMIT 10
+                )
+                UNION ALL
+                SELECT precio, timestamp FROM (
+                    SELECT precio, timestamp FROM capturas_manuales
+                    WHERE chat_id = :chat_id AND symbol = :symbol
+                    ORDER BY timestamp DESC
+                    LIMIT 10
+                )
+                ORDER BY timestamp DESC
                 LIMIT 10
                 """,
-                (chat_id, symbol),
+                {"chat_id": chat_id, "symbol": symbol},
             )
             return cursor.fetchall()
 
@@ -303,87 +819,443 @@ class DatabaseManager:
         """
         Borra todo el historial de precios para una acción de un usuario.
 
+        Los precios de mercado son compartidos y no se borran: se eliminan las capturas
+        manuales del usuario y sus periodos de seguimiento pasados, y el actual (si lo
+        sigue) vuelve a empezar ahora.
+
         Args:
             chat_id (str): ID de usuario de Telegram.
             symbol (str): Ticker de la acción.
         """
+        self._ver_pendientes()
         with self._conectar() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                DELETE FROM historial_precios
+                DELETE FROM capturas_manuales
+                WHERE chat_id = ? AND symbol = ?
+                """,
+                (chat_id, symbol),
+            )
+            cursor.execute(
+                """
+                DELETE FROM periodos_seguimiento
+                WHERE chat_id = ? AND symbol = ? AND hasta IS NOT NULL
+                """,
+                (chat_id, symbol),
+            )
+            cursor.execute(
+                """
+                UPDATE periodos_seguimiento SET desde = ?
+                WHERE chat_id = ? AND symbol = ? AND hasta IS NULL
+                """,
+                (_ahora(), chat_id, symbol),
+            )
+            cursor.execute(
+                """
+                DELETE FROM estadisticas_capturas
                 WHERE chat_id = ? AND symbol = ?
                 """,
                 (chat_id, symbol),
             )
             conn.commit()
 
-    def obtener_estadisticas(self, chat_id: str, symbol: str) -> tuple[float, float, float] | None:
+    def _cortes(self) -> dict[int, int]:
+        """
+        Devuelve, por nivel del historial de mercado, desde cuándo se conservan sus datos.
+        """
+        return velas.cortes_retencion(velas.a_segundos(_ahora()), self.retencion)
+
+    def _periodos(self, cursor: sqlite3.Cursor, chat_id: str, symbol: str | None) -> dict[str, list[tuple[int, int]]]:
+        """
+        Recupera los periodos de seguimiento de un usuario en segundos epoch.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor de lectura.
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str | None): Ticker de la acción, o None para todos.
+
+        Returns:
+            dict[str, list[tuple[int, int]]]: Intervalos [desde, hasta) por símbolo. Los
+            periodos abiertos llegan hasta el segundo actual incluido.
+        """
+        if symbol:
+            cursor.execute(
+                "SELECT symbol, desde, hasta FROM periodos_seguimiento WHERE chat_id = ? AND symbol = ?",
+                (chat_id, symbol),
+            )
+        else:
+            cursor.execute("SELECT symbol, desde, hasta FROM periodos_seguimiento WHERE chat_id = ?", (chat_id,))
+        ahora = velas.a_segundos(_ahora()) + 1
+        periodos: dict[str, list[tuple[int, int]]] = {}
+        for simbolo, desde, hasta in cursor.fetchall():
+            periodos.setdefault(simbolo, []).append((velas.a_segundos(desde), velas.a_segundos(hasta) if hasta else ahora))
+        return periodos
+
+    def _paginar_tramos(
+        self, symbol: str, tramos: list[velas.Tramo], tamano_pagina: int = 500
+    ) -> Iterator[tuple[str, float, str]]:
+        """
+        Recorre por orden de fecha los precios de mercado de un símbolo en unos tramos del historial.
+
+        De los tramos de velas se toma el cierre de cada vela con la fecha de ese precio. Se
+        lee por páginas: cada consulta continúa desde la última fila de la anterior.
+
+        Yields:
+            tuple[str, float, str]: (symbol, precio, fecha).
+        """
+        for nivel, desde, hasta in tramos:
+            while desde < hasta:
+                with self._leer() as conn:
+                    cursor = conn.cursor()
+                    if nivel == velas.TICKS:
+                        cursor.execute(
+                            """
+                            SELECT symbol, precio, timestamp, timestamp FROM precios_mercado
+                            WHERE symbol = ? AND timestamp >= ? AND timestamp < ?
+                            ORDER BY timestamp
+                            LIMIT ?
+                            """,
+                            (symbol, velas.a_fecha(desde), velas.a_fecha(hasta), tamano_pagina),
+                        )
+                    else:
+                        cursor.execute(
+                            """
+                            SELECT symbol, cierre, ultimo, inicio FROM velas
+                            WHERE segundos = ? AND symbol = ? AND inicio >= ? AND inicio < ?
+                            ORDER BY inicio
+                            LIMIT ?
+                            """,
+                            (nivel, symbol, velas.a_fecha(desde), velas.a_fecha(hasta), tamano_pagina),
+                        )
+                    filas = cursor.fetchall()
+                for fila in filas:
+                    yield fila[0], fila[1], fila[2]
+                if len(filas) < tamano_pagina:
+                    break
+                # Las fechas son de segundos enteros y únicas por símbolo (o por vela)
+                desde = velas.a_segundos(filas[-1][3]) + max(nivel, 1)
+
+    def obtener_estadisticas(self, chat_id: str, symbol: str) -> tuple[float, float, float, float] | None:
         """
-        Calcula estadísticas básicas del historial de precios de una acción.
+        Devuelve las estadísticas del historial de precios de una acción.
+
+        Las capturas manuales son la lectura de una fila de `estadisticas_capturas`. Cada
+        periodo de seguimiento se lee con las velas más gruesas que caben enteras en él y
+        solo sus extremos con velas más finas o precios sueltos (ver `bot.velas`), así que
+        el coste no crece con la longitud del historial.
 
         Args:
             chat_id (str): ID de usuario de Telegram.
             symbol (str): Ticker de la acción.
 
         Returns:
-            Tuple[float, float, float]: Mínimo, máximo y promedio de precios.
+            tuple[float, float, float, float] | None: Mínimo, máximo, promedio y desviación
+            típica de los precios, o None si no hay historial.
         """
-        with self._conectar() as conn:
+        self._ver_pendientes()
+        with self._leer() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                SELECT MIN(precio), MAX(precio), AVG(precio)
-                FROM historial_precios
+                SELECT num, suma, suma_cuadrados, minimo, maximo
+                FROM estadisticas_capturas
                 WHERE chat_id = ? AND symbol = ?
                 """,
                 (chat_id, symbol),
             )
-            resultado = cursor.fetchone()
-            assert resultado is not None, f"No se encontraron precios para {symbol} del usuario {chat_id}"
-            return cast(tuple[float, float, float], resultado)
+            partes: list[Resumen] = cursor.fetchall()
+            intervalos = self._periodos(cursor, chat_id, symbol).get(symbol, [])
+            for nivel, desde, hasta in velas.tramos(intervalos, cortes=self._cortes()):
+                if nivel == velas.TICKS:
+                    cursor.execute(
+                        """
+                        SELECT COUNT(*), SUM(precio), SUM(precio * precio), MIN(precio), MAX(precio)
+                        FROM precios_mercado
+                        WHERE symbol = ? AND timestamp >= ? AND timestamp < ?
+                        """,
+                        (symbol, velas.a_fecha(desde), velas.a_fecha(hasta)),
+                    )
+                else:
+                    cursor.execute(
+                        """
+                        SELECT SUM(num), SUM(suma), SUM(suma_cuadrados), MIN(minimo), MAX(maximo)
+                        FROM velas
+                        WHERE segundos = ? AND symbol = ? AND inicio >= ? AND inicio < ?
+                        """,
+                        (nivel, symbol, velas.a_fecha(desde), velas.a_fecha(hasta)),
+                    )
+                partes.append(cursor.fetchone())
 
-    # ========== Exportar historial para CSV ==========
-    def obtener_historial_usuario(self, chat_id: str, ticker: str | None = None) -> list[dict[str, str | float]]:
+        partes = [parte for parte in partes if parte[0]]
+        if not partes:
+            return None
+        num = sum(parte[0] for parte in partes)
+        media = sum(parte[1] for parte in partes) / num
+        varianza = sum(parte[2] for parte in partes) / num - media * media
+        # Los redondeos pueden dejar la varianza ligeramente por debajo de cero
+        return min(parte[3] for parte in partes), max(parte[4] for parte in partes), media, math.sqrt(max(varianza, 0.0))
+
+    def reconstruir_estadisticas(self, chat_id: str | None = None, symbol: str | None = None) -> int:
         """
-        Devuelve todo el historial de precios de un usuario en formato lista de diccionarios.
+        Recalcula `estadisticas_capturas` a partir de las capturas manuales guardadas.
 
-        Si se indica un ticker, filtra solo para ese símbolo.
+        Solo hace falta para repararla: el trigger de las capturas la mantiene al día y la
+        migración que la crea la rellena. Se recalcula en una sola transacción de escritura,
+        así que ninguna captura nueva se pierde ni se cuenta dos veces.
 
         Args:
-            chat_id (str): ID de usuario de Telegram.
-            ticker (str, optional): Ticker de la acción. Si es None, devuelve todo el historial.
+            chat_id (str | None, optional): ID de usuario de Telegram. Si es None, todos.
+            symbol (str | None, optional): Ticker de la acción. Si es None, todos.
 
         Returns:
-            list: Lista de diccionarios con las claves 'Símbolo', 'Precio' y 'Fecha'.
+            int: Filas de estadísticas escritas.
         """
+        filtro = {"chat_id": chat_id, "symbol": symbol}
+        # Nombres de columna fijos; los valores van como parámetros
+        columnas = [columna for columna, valor in filtro.items() if valor]
+        condicion = " AND ".join(f"{columna} = :{columna}" for columna in columnas) or "true"
         with self._conectar() as conn:
             cursor = conn.cursor()
-            if ticker:
-                cursor.execute(
-                    """
-                    SELECT symbol, precio, timestamp
-                    FROM historial_precios
-                    WHERE chat_id = ? AND symbol = ?
-                    ORDER BY timestamp ASC
-                    """,
-                    (chat_id, ticker),
-                )
-            else:
+            cursor.execute(f"DELETE FROM estadisticas_capturas WHERE {condicion}", filtro)
+            cursor.execute(
+                RESUMIR_CAPTURAS.format(filtro=" AND ".join(f"c.{columna} = :{columna}" for columna in columnas) or "true"),
+                filtro,
+            )
+            escritas = cursor.rowcount
+            conn.commit()
+        if escritas:
+            logging.info(f"📊 Estadísticas de las capturas reconstruidas: {escritas} filas.")
+        return escritas
+
+    def obtener_serie(self, chat_id: str, symbol: str, max_puntos: int = MAX_PUNTOS_SERIE) -> list[tuple[float, str]]:
+        """
+        Recupera la evolución del precio de una acción para representarla en un gráfico.
+
+        Usa las velas más finas con las que todos los periodos de seguimiento y las capturas
+        manuales caben en `max_puntos` puntos (ver `velas.elegir_nivel`) y toma el cierre de
+        cada una. Las velas de los extremos de un periodo pueden incluir precios de justo
+        antes o después. De las capturas manuales se toma la última de cada vela del mismo
+        tamaño, así que tampoco se leen todas.
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str): Ticker de la acción.
+            max_puntos (int, optional): Velas como máximo. Default `MAX_PUNTOS_SERIE`.
+
+        Returns:
+            list[tuple[float, str]]: Tuplas (precio, timestamp) ordenadas por fecha ascendente.
+        """
+        self._ver_pendientes()
+        with self._leer() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT primero, ultimo FROM estadisticas_capturas WHERE chat_id = ? AND symbol = ?",
+                (chat_id, symbol),
+            )
+            capturas = [(velas.a_segundos(primero), velas.a_segundos(ultimo) + 1) for primero, ultimo in cursor.fetchall()]
+            intervalos = self._periodos(cursor, chat_id, symbol).get(symbol, [])
+            extremos = capturas + intervalos
+            if not extremos:
+                return []
+            duracion = max(hasta for _, hasta in extremos) - min(desde for desde, _ in extremos)
+            nivel = velas.elegir_nivel(duracion, max_puntos)
+            # Si ni con velas de día cabe todo, las capturas se agrupan en velas más anchas
+            ancho = max(nivel, -(-duracion // max_puntos))
+            filas = self._ultimas_capturas(cursor, chat_id, symbol, ancho) if capturas else []
+        if intervalos:
+            tramos = velas.tramos(intervalos, maxima=nivel, minima=nivel, cortes=self._cortes())
+            filas.extend(self._paginar_tramos(symbol, tramos))
+        return sorted(((precio, fecha) for _, precio, fecha in filas), key=lambda punto: punto[1])
+
+    def _ultimas_capturas(
+        self, cursor: sqlite3.Cursor, chat_id: str, symbol: str, ancho: int
+    ) -> list[tuple[str, float, str]]:
+        """
+        Busca la última captura manual de cada vela de `ancho` segundos que tenga alguna.
+
+        Salta de vela en vela por el índice de las capturas: lanza dos consultas por vela
+        con capturas, sin leer las demás.
+
+        Returns:
+            list[tuple[str, float, str]]: (symbol, precio, fecha) por orden de fecha.
+        """
+        puntos: list[tuple[str, float, str]] = []
+        desde = ""
+        while True:
+            cursor.execute(
+                """
+                SELECT timestamp FROM capturas_manuales
+                WHERE chat_id = ? AND symbol = ? AND timestamp >= ?
+                ORDER BY timestamp LIMIT 1
+                """,
+                (chat_id, symbol, desde),
+            )
+            fila = cursor.fetchone()
+            if fila is None:
+                return puntos
+            desde = velas.a_fecha(velas.inicio_vela(velas.a_segundos(fila[0]), ancho) + ancho)
+            cursor.execute(
+                """
+                SELECT symbol, precio, timestamp FROM capturas_manuales
+                WHERE chat_id = ? AND symbol = ? AND timestamp < ?
+                ORDER BY timestamp DESC, id DESC LIMIT 1
+                """,
+                (chat_id, symbol, desde),
+            )
+            puntos.append(cursor.fetchone())
+
+    def aplicar_retencion(self) -> int:
+        """
+        Purga los precios de mercado sueltos y las velas más antiguos que su retención.
+
+        Las lecturas de esas fechas pasan a usar las velas del nivel superior. Se borra
+        símbolo a símbolo, cada uno en su propia transacción, para no retener mucho
+        tiempo la conexión de escritura.
+
+        Returns:
+            int: Filas borradas.
+        """
+        self._ver_pendientes()
+        cortes = self._cortes()
+        with self._leer() as conn:
+            cursor = conn.cursor()
+            # Todo precio de mercado tiene su vela de día
+            cursor.execute("SELECT DISTINCT symbol FROM velas WHERE segundos = ?", (velas.DIA,))
+            simbolos = [fila[0] for fila in cursor.fetchall()]
+
+        borradas = 0
+        for symbol in simbolos:
+            with self._conectar() as conn:
+                cursor = conn.cursor()
+                for nivel, corte in cortes.items():
+                    if nivel == velas.TICKS:
+                        cursor.execute(
+                            "DELETE FROM precios_mercado WHERE symbol = ? AND timestamp < ?",
+                            (symbol, velas.a_fecha(corte)),
+                        )
+                    else:
+                        cursor.execute(
+                            "DELETE FROM velas WHERE segundos = ? AND symbol = ? AND inicio < ?",
+                            (nivel, symbol, velas.a_fecha(corte)),
+                        )
+                    borradas += cursor.rowcount
+                conn.commit()
+        if borradas:
+            logging.info(f"🧹 Retención del historial: {borradas} filas purgadas.")
+        return borradas
+
+    # ========== Exportar historial para CSV ==========
+    def iterar_historial_usuario(
+        self,
+        chat_id: str,
+        ticker: str | None = None,
+        desde: str | None = None,
+        hasta: str | None = None,
+        tamano_pagina: int = 500,
+    ) -> Iterator[tuple[str, float, str]]:
+        """
+        Recorre por orden de fecha el historial de precios de un usuario sin cargarlo en memoria.
+
+        Cada fuente (las capturas manuales y los precios de mercado de cada símbolo) se lee
+        por páginas de `tamano_pagina` filas con paginación por clave: cada consulta sigue
+        desde la última fila leída usando el índice, en lugar de saltar filas con `OFFSET`,
+        y la conexión vuelve al grupo entre una página y la siguiente. Las fuentes se mezclan
+        por fecha con `heapq.merge`, así que la memoria depende del número de símbolos y no
+        del tamaño del historial.
+
+        Los precios de mercado más antiguos que su retención salen como el cierre de cada
+        vela de minuto (o de hora, si tampoco quedan estas).
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            ticker (str | None, optional): Ticker de la acción. Si es None, recorre todo el historial.
+            desde (str | None, optional): Fecha UTC ('YYYY-MM-DD HH:MM:SS') desde la que se incluyen precios.
+            hasta (str | None, optional): Fecha UTC (excluida) hasta la que se incluyen precios.
+            tamano_pagina (int, optional): Filas leídas en cada consulta. Default 500.
+
+        Yields:
+            tuple[str, float, str]: (symbol, precio, fecha) por orden de fecha ascendente.
+        """
+        self._ver_pendientes()
+        with self._leer() as conn:
+            periodos = self._periodos(conn.cursor(), chat_id, ticker)
+        # Los periodos abiertos llegan hasta el segundo actual incluido
+        inicio = velas.a_segundos(desde) if desde else 0
+        fin = velas.a_segundos(hasta) if hasta else velas.a_segundos(_ahora()) + 1
+        cortes = self._cortes()
+
+        fuentes = [self._paginar_capturas(chat_id, ticker, desde, hasta, tamano_pagina)]
+        for symbol, intervalos in periodos.items():
+            recortados = [(max(a, inicio), min(b, fin)) for a, b in intervalos]
+            tramos = velas.tramos([(a, b) for a, b in recortados if a < b], maxima=velas.TICKS, cortes=cortes)
+            fuentes.append(self._paginar_tramos(symbol, tramos, tamano_pagina))
+
+        for fila in heapq.merge(*fuentes, key=itemgetter(2)):
+            # El cierre de una vela de los extremos puede caer fuera del rango pedido
+            if (desde is None or fila[2] >= desde) and (hasta is None or fila[2] < hasta):
+                yield fila
+
+    def _paginar_capturas(
+        self, chat_id: str, ticker: str | None, desde: str | None, hasta: str | None, tamano_pagina: int
+    ) -> Iterator[tuple[str, float, str]]:
+        """
+        Recorre por orden de fecha las capturas manuales de un usuario, por páginas.
+
+        La clave de paginación es `(timestamp, id)`, las últimas columnas de los índices
+        de `capturas_manuales` tras el usuario (y el símbolo).
+
+        Yields:
+            tuple[str, float, str]: (symbol, precio, fecha).
+        """
+        filtro = "chat_id = :chat_id" + (" AND symbol = :symbol" if ticker else "")
+        if hasta:
+            filtro += " AND timestamp < :hasta"
+        parametros: dict[str, str | int | None] = {
+            "chat_id": chat_id,
+            "symbol": ticker,
+            "hasta": hasta,
+            "fecha": desde or "",
+            "id": 0,
+            "tamano": tamano_pagina,
+        }
+        while True:
+            with self._leer() as conn:
+                cursor = conn.cursor()
                 cursor.execute(
-                    """
-                    SELECT symbol, precio, timestamp
-                    FROM historial_precios
-                    WHERE chat_id = ?
-                    ORDER BY timestamp ASC
+                    f"""
+                    SELECT symbol, precio, timestamp, id FROM capturas_manuales
+                    WHERE {filtro} AND (timestamp, id) > (:fecha, :id)
+                    ORDER BY timestamp, id
+                    LIMIT :tamano
                     """,
-                    (chat_id,),
+                    parametros,
                 )
-            rows = cursor.fetchall()
+                filas = cursor.fetchall()
+            for fila in filas:
+                yield fila[0], fila[1], fila[2]
+            if len(filas) < tamano_pagina:
+                return
+            parametros["fecha"], parametros["id"] = filas[-1][2], filas[-1][3]
 
-            historial = [{"Símbolo": row[0], "Precio": row[1], "Fecha": row[2]} for row in rows]
+    def obtener_historial_usuario(self, chat_id: str, ticker: str | None = None) -> list[dict[str, str | float]]:
+        """
+        Devuelve todo el historial de precios de un usuario en formato lista de diccionarios.
 
-            return historial
+        Si se indica un ticker, filtra solo para ese símbolo. Para historiales grandes es
+        preferible recorrerlo con `iterar_historial_usuario`.
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            ticker (str, optional): Ticker de la acción. Si es None, devuelve todo el historial.
+
+        Returns:
+            list: Lista de diccionarios con las claves 'Símbolo', 'Precio' y 'Fecha'.
+        """
+        return [
+            {"Símbolo": symbol, "Precio": precio, "Fecha": fecha}
+            for symbol, precio, fecha in self.iterar_historial_usuario(chat_id, ticker)
+        ]
 
     # ========== Exportar favoritas para CSV ==========
     def obtener_favoritas_usuario(self, chat_id: str) -> list[dict[str, str | float]]:
@@ -397,7 +1269,7 @@ class DatabaseManager:
             list: Lista de diccionarios con las claves 'Símbolo', 'Nombre', 'Intervalo (min)', 'Límite
             Inferior' y 'Límite Superior'.
         """
-        with self._conectar() as conn:
+        with self._leer() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
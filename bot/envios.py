@@ -0,0 +1,247 @@
+"""
+Módulo: envios.py
+
+Cola de salida de mensajes de Telegram con límites de ritmo.
+
+El seguimiento de precios no envía las alertas directamente: las deja en esta cola y
+sigue trabajando. Unos pocos trabajadores las entregan respetando los límites de
+Telegram (unos 30 mensajes por segundo en total y 1 por segundo a cada chat):
+
+- Las alertas pendientes de un mismo chat se fusionan en un único mensaje.
+- Un `RetryAfter` de Telegram pausa los envíos el tiempo indicado y el mensaje se reintenta.
+- La cola está acotada: si se llena, los mensajes nuevos se descartan y se cuentan.
+
+`estadisticas()` expone la profundidad de la cola, la latencia de entrega y los descartes.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Callable
+from datetime import timedelta
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from bot.limitador import TokenBucket
+
+# Longitud máxima de un mensaje de Telegram
+MAX_LONGITUD = 4096
+
+SEPARADOR = "\n\n"
+
+
+class ColaEnvios:
+    """
+    Cola de mensajes salientes con límite global, límite por chat y fusión por chat.
+    """
+
+    def __init__(
+        self,
+        trabajadores: int = 4,
+        por_segundo: float = 30.0,
+        por_chat: float = 1.0,
+        max_pendientes: int = 10_000,
+        reloj: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            trabajadores (int, optional): Tareas que entregan mensajes en paralelo.
+            por_segundo (float, optional): Mensajes por segundo en total.
+            por_chat (float, optional): Mensajes por segundo a un mismo chat.
+            max_pendientes (int, optional): Mensajes en espera a partir de los cuales se descartan los nuevos.
+            reloj (Callable[[], float], optional): Fuente de tiempo (inyectable en tests).
+        """
+        self.num_trabajadores = trabajadores
+        self.intervalo_chat = 1 / por_chat
+        self.max_pendientes = max_pendientes
+        self._reloj = reloj
+        self._global = TokenBucket(por_segundo, 1, reloj)
+        self._bot: Bot | None = None
+        self._cola: asyncio.Queue[str] | None = None
+        self._trabajadores: list[asyncio.Task[None]] = []
+        self._pendientes: dict[str, deque[tuple[str, float]]] = {}
+        self._ultimo_envio: dict[str, float] = {}
+        self._pausa_hasta = 0.0
+        self._latencias: deque[float] = deque(maxlen=1000)
+        self.num_pendientes = 0
+        self.enviados = 0
+        self.fusionados = 0
+        self.descartados = 0
+        self.reintentos = 0
+
+    def iniciar(self, bot: Bot) -> None:
+        """
+        Arranca los trabajadores (si no lo están ya) en el bucle actual.
+
+        Args:
+            bot (telegram.Bot): Bot con el que se envían los mensajes.
+        """
+        self._bot = bot
+        if self._trabajadores:
+            return
+        self._cola = asyncio.Queue()
+        # Los chats que ya tenían mensajes esperando vuelven a la cola
+        for chat_id in self._pendientes:
+            self._cola.put_nowait(chat_id)
+        self._trabajadores = [asyncio.create_task(self._trabajar()) for _ in range(self.num_trabajadores)]
+
+    async def detener(self) -> None:
+        """
+        Detiene los trabajadores. Los mensajes pendientes se conservan.
+        """
+        for tarea in self._trabajadores:
+            tarea.cancel()
+        await asyncio.gather(*self._trabajadores, return_exceptions=True)
+        self._trabajadores = []
+        self._cola = None
+
+    def encolar(self, chat_id: str, texto: str) -> bool:
+        """
+        Añade un mensaje (en Markdown) a la cola sin esperar a que se envíe.
+
+        Si el chat ya tenía mensajes esperando, el nuevo se fusionará con ellos.
+
+        Args:
+            chat_id (str): Chat de destino.
+            texto (str): Texto del mensaje.
+
+        Returns:
+            bool: False si la cola está llena y el mensaje se ha descartado.
+        """
+        if self.num_pendientes >= self.max_pendientes:
+            self.descartados += 1
+            logging.warning(f"Cola de envíos llena: se descarta un mensaje para {chat_id}.")
+            return False
+
+        self.num_pendientes += 1
+        mensajes = self._pendientes.get(chat_id)
+        if mensajes is not None:
+            self.fusionados += 1
+            mensajes.append((texto, self._reloj()))
+            return True
+
+        self._pendientes[chat_id] = deque([(texto, self._reloj())])
+        if self._cola is not None:
+            self._cola.put_nowait(chat_id)
+        return True
+
+    def estadisticas(self) -> dict[str, float]:
+        """
+        Devuelve las métricas de la cola.
+
+        Returns:
+            dict[str, float]: Mensajes y chats pendientes, enviados, fusionados, descartados,
+            reintentos por `RetryAfter` y latencia media y máxima de entrega (s) de los últimos envíos.
+        """
+        latencias = self._latencias
+        return {
+            "pendientes": self.num_pendientes,
+            "chats_pendientes": len(self._pendientes),
+            "enviados": self.enviados,
+            "fusionados": self.fusionados,
+            "descartados": self.descartados,
+            "reintentos": self.reintentos,
+            "latencia_media": sum(latencias) / len(latencias) if latencias else 0.0,
+            "latencia_max": max(latencias, default=0.0),
+        }
+
+    def _programar(self, chat_id: str, espera: float) -> None:
+        """
+        Vuelve a poner un chat en la cola dentro de `espera` segundos.
+        """
+        cola = self._cola
+        if cola is not None:
+            asyncio.get_running_loop().call_later(espera, cola.put_nowait, chat_id)
+
+    async def _trabajar(self) -> None:
+        assert self._cola is not None
+        cola = self._cola
+        while True:
+            chat_id = await cola.get()
+            try:
+                await self._atender(chat_id)
+            except Exception as e:
+                logging.error(f"Error en la cola de envíos para {chat_id}: {e}")
+            finally:
+                cola.task_done()
+
+    async def _esperar_turno_global(self) -> None:
+        while True:
+            espera = max(self._pausa_hasta - self._reloj(), self._global.espera(1))
+            if espera <= 0:
+                self._global.consumir(1)
+                return
+            await asyncio.sleep(espera)
+
+    async def _atender(self, chat_id: str) -> None:
+        """
+        Envía los mensajes pendientes de un chat fusionados en uno solo (hasta `MAX_LONGITUD`).
+        """
+        mensajes = self._pendientes.get(chat_id)
+        if not mensajes:
+            return
+
+        espera_chat = self._ultimo_envio.get(chat_id, float("-inf")) + self.intervalo_chat - self._reloj()
+        if espera_chat > 0:
+            self._programar(chat_id, espera_chat)
+            return
+
+        await self._esperar_turno_global()
+
+        lote = [mensajes.popleft()]
+        longitud = len(lote[0][0])
+        while mensajes and longitud + len(SEPARADOR) + len(mensajes[0][0]) <= MAX_LONGITUD:
+            lote.append(mensajes.popleft())
+            longitud += len(SEPARADOR) + len(lote[-1][0])
+
+        try:
+            assert self._bot is not None, "La cola de envíos no se ha iniciado"
+            await self._bot.send_message(
+                chat_id=chat_id, text=SEPARADOR.join(texto for texto, _ in lote), parse_mode="Markdown"
+            )
+        except RetryAfter as e:
+            espera = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            logging.warning(f"Telegram pide esperar {espera:.0f} s antes de seguir enviando.")
+            self.reintentos += 1
+            self._pausa_hasta = max(self._pausa_hasta, self._reloj() + espera)
+            mensajes.extendleft(reversed(lote))
+            self._programar(chat_id, espera)
+            return
+        except Exception as e:
+            logging.error(f"No se pudo enviar el mensaje a {chat_id}: {e}")
+            self.descartados += len(lote)
+        else:
+            ahora = self._reloj()
+            self.enviados += 1
+            self._latencias.append(ahora - lote[0][1])
+            logging.info(f"✅ Mensaje enviado a {chat_id}")
+        finally:
+            self._ultimo_envio[chat_id] = self._reloj()
+
+        self.num_pendientes -= len(lote)
+        if mensajes:
+            self._programar(chat_id, self.intervalo_chat)
+        else:
+            del self._pendientes[chat_id]
+        self._olvidar_chats_inactivos()
+
+    def _olvidar_chats_inactivos(self) -> None:
+        """
+        Acota el registro de últimos envíos quitando los chats que ya pueden recibir otro mensaje.
+        """
+        if len(self._ultimo_envio) <= 2 * self.max_pendientes:
+            return
+        limite = self._reloj() - self.intervalo_chat
+        self._ultimo_envio = {chat_id: t for chat_id, t in self._ultimo_envio.items() if t > limite}
+
+
+# Cola compartida por todo el bot
+cola_envios = ColaEnvios(
+    trabajadores=int(os.getenv("ENVIOS_TRABAJADORES", "4")),
+    por_segundo=float(os.getenv("ENVIOS_POR_SEGUNDO", "30")),
+    por_chat=float(os.getenv("ENVIOS_POR_CHAT", "1")),
+    max_pendientes=int(os.getenv("ENVIOS_MAX_PENDIENTES", "10000")),
+)
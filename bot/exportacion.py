@@ -0,0 +1,149 @@
+"""
+Módulo: exportacion.py
+
+Exportación de tablas a CSV sin cargarlas en memoria.
+
+Las filas se leen de un iterable (p. ej. `DatabaseManager.iterar_historial_usuario`) y se
+escriben una a una en ficheros temporales que pasan de memoria a disco al superar
+`UMBRAL_DISCO` bytes, opcionalmente comprimidos con gzip. Si el resultado no cabe en
+un documento de Telegram (`LIMITE_DOCUMENTO`), se reparte en varias partes: cada una
+empieza con la cabecera y corta en el límite de una fila, así que todas son un CSV (o
+un `.csv.gz`) válido por sí mismo.
+
+`exportar_csv()` es bloqueante; desde el bot se ejecuta con `asyncio.to_thread()` para
+no detener el bucle de eventos mientras se codifica el fichero.
+"""
+
+import csv
+import gzip
+import io
+import os
+import tempfile
+from collections.abc import Iterable, Sequence
+from typing import IO
+
+# Tamaño máximo de un documento que un bot puede enviar a Telegram
+LIMITE_DOCUMENTO = int(os.getenv("EXPORTACION_LIMITE_DOCUMENTO", str(50 * 1024 * 1024)))
+# Bytes a partir de los cuales una parte se escribe en disco en lugar de en memoria
+UMBRAL_DISCO = int(os.getenv("EXPORTACION_UMBRAL_DISCO", str(1024 * 1024)))
+
+# Cabecera y cola de gzip más el marcador de cada volcado (holgado)
+_MARGEN_GZIP = 64
+
+# (nombre del fichero, contenido posicionado al inicio)
+type Parte = tuple[str, IO[bytes]]
+
+
+class _Escritor:
+    """
+    Fichero temporal de una parte, con una cota superior de su tamaño final.
+
+    Con gzip no se sabe cuánto ocupan los datos aún en el compresor sin volcarlo, y volcar
+    en cada fila empeora la compresión. Se lleva la cuenta de los bytes sin volcar y se
+    acota su tamaño comprimido por el peor caso de deflate; solo se vuelca cuando la cota
+    se acerca al límite.
+    """
+
+    def __init__(self, comprimir: bool, umbral_disco: int) -> None:
+        self.fichero: IO[bytes] = tempfile.SpooledTemporaryFile(max_size=umbral_disco)  # noqa: SIM115
+        self._gzip = gzip.GzipFile(fileobj=self.fichero, mode="wb") if comprimir else None
+        self._sin_volcar = 0
+        self.filas = 0
+
+    def cota(self, extra: int = 0) -> int:
+        """
+        Tamaño máximo que tendrá la parte cerrada si se le añaden `extra` bytes.
+        """
+        if self._gzip is None:
+            return self.fichero.tell() + extra
+        pendiente = self._sin_volcar + extra
+        return self.fichero.tell() + pendiente + (pendiente >> 12) + (pendiente >> 14) + _MARGEN_GZIP
+
+    def volcar(self) -> None:
+        """
+        Vacía el compresor en el fichero para conocer su tamaño exacto.
+        """
+        if self._gzip is not None and self._sin_volcar:
+            self._gzip.flush()
+            self._sin_volcar = 0
+
+    def escribir(self, datos: bytes) -> None:
+        if self._gzip is None:
+            self.fichero.write(datos)
+        else:
+            self._gzip.write(datos)
+            self._sin_volcar += len(datos)
+
+    def cerrar(self) -> IO[bytes]:
+        """
+        Termina la parte y devuelve su fichero posicionado al inicio.
+        """
+        if self._gzip is not None:
+            self._gzip.close()
+        self.fichero.seek(0)
+        return self.fichero
+
+
+def exportar_csv(
+    filas: Iterable[Sequence[object]],
+    cabecera: Sequence[str],
+    nombre: str,
+    comprimir: bool = False,
+    limite: int = LIMITE_DOCUMENTO,
+    umbral_disco: int = UMBRAL_DISCO,
+) -> tuple[int, list[Parte]]:
+    """
+    Escribe unas filas en uno o varios ficheros CSV temporales.
+
+    Args:
+        filas (Iterable[Sequence[object]]): Filas a exportar; se consumen una a una.
+        cabecera (Sequence[str]): Nombres de las columnas, repetidos al inicio de cada parte.
+        nombre (str): Nombre base de los ficheros, sin extensión.
+        comprimir (bool, optional): Si es True, las partes se comprimen con gzip (`.csv.gz`).
+        limite (int, optional): Tamaño máximo en bytes de cada parte. Default `LIMITE_DOCUMENTO`.
+        umbral_disco (int, optional): Bytes a partir de los cuales una parte pasa a disco.
+
+    Returns:
+        tuple[int, list[Parte]]: Número de filas exportadas y partes generadas (ninguna si
+        no había filas). Quien las recibe debe cerrar sus ficheros.
+    """
+    texto = io.StringIO()
+    escritor_csv = csv.writer(texto, lineterminator="\n")
+
+    def codificar(fila: Sequence[object]) -> bytes:
+        texto.seek(0)
+        texto.truncate()
+        escritor_csv.writerow(fila)
+        return texto.getvalue().encode()
+
+    inicio = codificar(cabecera)
+    ficheros: list[IO[bytes]] = []
+    actual: _Escritor | None = None
+    total = 0
+    try:
+        for fila in filas:
+            datos = codificar(fila)
+            if actual is not None and actual.filas and actual.cota(len(datos)) > limite:
+                actual.volcar()
+                if actual.cota(len(datos)) > limite:
+                    ficheros.append(actual.cerrar())
+                    actual = None
+            if actual is None:
+                actual = _Escritor(comprimir, umbral_disco)
+                actual.escribir(inicio)
+            actual.escribir(datos)
+            actual.filas += 1
+            total += 1
+        if actual is not None:
+            ficheros.append(actual.cerrar())
+    except BaseException:
+        for fichero in ficheros:
+            fichero.close()
+        if actual is not None:
+            actual.fichero.close()
+        raise
+
+    extension = ".csv.gz" if comprimir else ".csv"
+    if len(ficheros) == 1:
+        return total, [(nombre + extension, ficheros[0])]
+    return total, [(f"{nombre}_parte{i}{extension}", fichero) for i, fichero in enumerate(ficheros, 1)]
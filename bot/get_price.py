@@ -1,46 +1,286 @@
 """
 Módulo: get_price.py
 
-Este módulo realiza peticiones a la API de Twelve Data para obtener precios y nombres
+Este módulo realiza peticiones asíncronas a la API de Twelve Data para obtener precios y nombres
 de activos financieros. Devuelve los datos procesados o errores si los hay.
+
+Todas las peticiones comparten una única sesión `aiohttp` con un pool de conexiones acotado,
+keep-alive y caché DNS, de modo que una respuesta lenta nunca bloquea el bucle de eventos.
+Los fallos transitorios del servicio (5xx, timeouts y errores de conexión) se reintentan
+con backoff y un circuit breaker deja de llamar a la API durante un tiempo si falla de
+forma repetida. Un 429 significa que una API key concreta se ha quedado sin créditos: no
+se reintenta ni cuenta como fallo del servicio, para que no corte las consultas del resto.
 """
 
-import requests
+import asyncio
+import os
+from typing import Any, cast
+
+import aiohttp
+
+from bot.limitador import CreditosAgotados, limitador_creditos
+from bot.resiliencia import CircuitBreaker, CircuitoAbierto, ErrorTransitorio, interpretar_retry_after, reintentar
+
+URL_QUOTE = "https://api.twelvedata.com/quote"
+
+# Configuración del pool de conexiones (ajustable por entorno)
+MAX_CONEXIONES = int(os.getenv("TWELVEDATA_MAX_CONEXIONES", "100"))
+MAX_CONEXIONES_HOST = int(os.getenv("TWELVEDATA_MAX_CONEXIONES_HOST", "20"))
+TIMEOUT_PETICION = float(os.getenv("TWELVEDATA_TIMEOUT", "5"))
+TTL_CACHE_DNS = 300
+KEEPALIVE_SEGUNDOS = 30.0
+
+# Máximo de símbolos por petición que admite el endpoint /quote
+MAX_SIMBOLOS_LOTE = int(os.getenv("TWELVEDATA_MAX_SIMBOLOS_LOTE", "120"))
+
+# Reintentos y circuit breaker
+REINTENTOS = int(os.getenv("TWELVEDATA_REINTENTOS", "3"))
+BACKOFF_BASE = float(os.getenv("TWELVEDATA_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("TWELVEDATA_BACKOFF_MAX", "8"))
+ERRORES_TRANSITORIOS = (ErrorTransitorio, TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
 
+# Espera que se anuncia tras un 429 sin cabecera Retry-After (los créditos por minuto se renuevan cada minuto)
+ESPERA_SIN_CREDITOS = 60.0
 
-def fetch_stock_price(symbol: str, api_key: str) -> dict[str, float | str | None]:
+circuito_twelvedata = CircuitBreaker(
+    "TwelveData",
+    umbral_fallos=int(os.getenv("TWELVEDATA_CIRCUITO_FALLOS", "5")),
+    enfriamiento=float(os.getenv("TWELVEDATA_CIRCUITO_ENFRIAMIENTO", "60")),
+)
+
+# Resultado de una consulta: "precio", "nombre", "error" y, si viene de la caché, "obsoleto"
+type Cotizacion = dict[str, float | str | bool | None]
+
+_sesion: aiohttp.ClientSession | None = None
+_bucle_sesion: asyncio.AbstractEventLoop | None = None
+
+
+def obtener_sesion() -> aiohttp.ClientSession:
     """
-    Consulta el precio actual de un activo financiero usando Twelve Data.
+    Devuelve la sesión HTTP compartida, creándola si aún no existe.
+
+    La sesión se asocia al bucle de eventos en ejecución; si el bucle cambia
+    (por ejemplo, entre tests) se crea una nueva.
+
+    Returns:
+        aiohttp.ClientSession: Sesión con pool de conexiones, keep-alive y caché DNS.
+    """
+    global _sesion, _bucle_sesion
+    bucle = asyncio.get_running_loop()
+    if _sesion is None or _sesion.closed or _bucle_sesion is not bucle:
+        conector = aiohttp.TCPConnector(
+            limit=MAX_CONEXIONES,
+            limit_per_host=MAX_CONEXIONES_HOST,
+            ttl_dns_cache=TTL_CACHE_DNS,
+            keepalive_timeout=KEEPALIVE_SEGUNDOS,
+        )
+        _sesion = aiohttp.ClientSession(connector=conector, timeout=aiohttp.ClientTimeout(total=TIMEOUT_PETICION))
+        _bucle_sesion = bucle
+    return _sesion
+
+
+async def cerrar_sesion() -> None:
+    """
+    Cierra la sesión HTTP compartida y libera las conexiones del pool.
+
+    Debe llamarse al apagar el bot (por ejemplo, desde `post_shutdown`).
+    """
+    global _sesion, _bucle_sesion
+    if _sesion is not None and not _sesion.closed:
+        await _sesion.close()
+    _sesion = None
+    _bucle_sesion = None
+
+
+async def _consultar_quote(params: dict[str, str]) -> dict[str, Any]:
+    """
+    Lanza una petición GET al endpoint `/quote` con un plazo máximo por petición.
 
     Args:
-        symbol (str): Símbolo bursátil del activo (ej. "AAPL").
+        params (dict[str, str]): Parámetros de la consulta (símbolo y API key).
+
+    Returns:
+        dict[str, Any]: Cuerpo JSON de la respuesta ya decodificado.
+
+    Raises:
+        CreditosAgotados: Si la API responde con un 429: la API key no tiene créditos.
+        ErrorTransitorio: Si la API responde con un 5xx (en el código HTTP o en el cuerpo).
+    """
+    sesion = obtener_sesion()
+    plazo = aiohttp.ClientTimeout(total=TIMEOUT_PETICION)
+    async with sesion.get(URL_QUOTE, params=params, timeout=plazo) as respuesta:
+        retry_after = interpretar_retry_after(respuesta.headers.get("Retry-After"))
+        if respuesta.status == 429:
+            raise CreditosAgotados(ESPERA_SIN_CREDITOS if retry_after is None else retry_after)
+        if respuesta.status >= 500:
+            raise ErrorTransitorio(f"HTTP {respuesta.status} de la API", retry_after)
+        respuesta.raise_for_status()
+        data = cast(dict[str, Any], await respuesta.json(content_type=None))
+
+    # TwelveData también informa de los errores con un 200 y el código en el cuerpo
+    codigo = data.get("code")
+    if data.get("status") == "error" and isinstance(codigo, int):
+        if codigo == 429:
+            raise CreditosAgotados(ESPERA_SIN_CREDITOS)
+        if codigo >= 500:
+            raise ErrorTransitorio(data.get("message", f"Error {codigo} de la API"))
+    return data
+
+
+async def _consultar_con_reintentos(params: dict[str, str], api_key: str, coste: int) -> dict[str, Any]:
+    """
+    Consulta `/quote` pasando por el circuit breaker, el limitador de créditos y los reintentos.
+
+    Cada intento reserva sus propios créditos, ya que la API puede cobrarlos aunque falle.
+    Solo los fallos transitorios del servicio cuentan para el circuit breaker y se reintentan;
+    una API key sin créditos (`CreditosAgotados`) falla al momento.
+
+    Args:
+        params (dict[str, str]): Parámetros de la consulta.
         api_key (str): Clave de API de Twelve Data.
+        coste (int): Créditos que cuesta cada intento.
 
     Returns:
-        Dict[str, Optional[float | str]]: Diccionario con las claves:
-            - "precio": precio de cierre del activo (o None si falla).
-            - "nombre": nombre de la empresa (o None si falla).
-            - "error": mensaje de error (o None si todo fue bien).
+        dict[str, Any]: Cuerpo JSON de la respuesta.
     """
-    try:
-        url = f"https://api.twelvedata.com/quote?symbol={symbol}&apikey={api_key}"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
 
-        data = response.json()
+    async def intento() -> dict[str, Any]:
+        circuito_twelvedata.comprobar()
+        await limitador_creditos.adquirir(api_key, coste=coste)
+        try:
+            data = await _consultar_quote(params)
+        except ERRORES_TRANSITORIOS:
+            circuito_twelvedata.registrar_fallo()
+            raise
+        circuito_twelvedata.registrar_exito()
+        return data
 
-        # Validación defensiva
-        if "close" not in data or "name" not in data:
-            return {
-                "precio": None,
-                "nombre": None,
-                "error": data.get("message", "Respuesta incompleta de la API"),
-            }
+    return await reintentar(intento, REINTENTOS, BACKOFF_BASE, BACKOFF_MAX, ERRORES_TRANSITORIOS)
 
-        precio = float(data["close"])
-        nombre_empresa = data["name"]
 
-        return {"precio": precio, "nombre": nombre_empresa, "error": None}
+def _procesar_quote(data: dict[str, Any]) -> Cotizacion:
+    """
+    Convierte la respuesta de `/quote` para un símbolo en el diccionario de resultado.
+
+    Args:
+        data (dict[str, Any]): Objeto JSON devuelto por la API para un único símbolo.
+
+    Returns:
+        Cotizacion: Diccionario con las claves "precio", "nombre" y "error".
+    """
+    # Validación defensiva
+    if "close" not in data or "name" not in data:
+        return {
+            "precio": None,
+            "nombre": None,
+            "error": data.get("message", "Respuesta incompleta de la API"),
+        }
 
-    except (requests.RequestException, TimeoutError, ValueError, KeyError) as e:
+    try:
+        precio = float(data["close"])
+    except (TypeError, ValueError) as e:
         return {"precio": None, "nombre": None, "error": str(e)}
+
+    return {"precio": precio, "nombre": data["name"], "error": None}
+
+
+def _trocear(symbols: list[str], tamano: int) -> list[list[str]]:
+    """
+    Divide una lista de símbolos en lotes de como máximo `tamano` elementos.
+
+    Args:
+        symbols (list[str]): Símbolos a dividir.
+        tamano (int): Número máximo de símbolos por lote.
+
+    Returns:
+        list[list[str]]: Lotes en el mismo orden que la lista original.
+    """
+    return [symbols[i : i + tamano] for i in range(0, len(symbols), tamano)]
+
+
+async def _consultar_lote(lote: list[str], api_key: str) -> dict[str, Cotizacion]:
+    """
+    Consulta un lote de símbolos en una única petición HTTP.
+
+    Cada intento reserva en el limitador tantos créditos como símbolos tenga el lote.
+    Si la petición completa falla, todos los símbolos del lote reciben el mismo error;
+    si solo fallan algunos símbolos, el resto conserva su resultado.
+
+    Args:
+        lote (list[str]): Símbolos del lote (como máximo `MAX_SIMBOLOS_LOTE`).
+        api_key (str): Clave de API de Twelve Data.
+
+    Returns:
+        dict[str, Cotizacion]: Resultado por símbolo.
+    """
+    try:
+        data = await _consultar_con_reintentos({"symbol": ",".join(lote), "apikey": api_key}, api_key, len(lote))
+    except (aiohttp.ClientError, TimeoutError, ValueError, CreditosAgotados, ErrorTransitorio, CircuitoAbierto) as e:
+        # Algunos errores (p. ej. TimeoutError) no traen mensaje
+        error = str(e) or type(e).__name__
+        return {symbol: {"precio": None, "nombre": None, "error": error} for symbol in lote}
+
+    # Con un único símbolo la API devuelve el objeto plano, sin anidar por símbolo
+    if len(lote) == 1:
+        return {lote[0]: _procesar_quote(data)}
+
+    # Error global de la petición (API key inválida, sin créditos...)
+    if data.get("status") == "error" and not any(symbol in data for symbol in lote):
+        error = data.get("message", "Respuesta incompleta de la API")
+        return {symbol: {"precio": None, "nombre": None, "error": error} for symbol in lote}
+
+    resultados: dict[str, Cotizacion] = {}
+    for symbol in lote:
+        datos_symbol = data.get(symbol)
+        if isinstance(datos_symbol, dict):
+            resultados[symbol] = _procesar_quote(datos_symbol)
+        else:
+            resultados[symbol] = {"precio": None, "nombre": None, "error": "Símbolo ausente en la respuesta de la API"}
+    return resultados
+
+
+async def fetch_stock_prices(symbols: list[str], api_key: str) -> dict[str, Cotizacion]:
+    """
+    Consulta el precio actual de varios activos con el mínimo número de peticiones.
+
+    Los símbolos se agrupan en lotes separados por comas (el endpoint `/quote` los admite
+    así) y los lotes se consultan en paralelo. Cada lote tiene como máximo
+    `MAX_SIMBOLOS_LOTE` símbolos y nunca más de los créditos por minuto de una API key.
+
+    Args:
+        symbols (list[str]): Símbolos bursátiles (se ignoran los duplicados).
+        api_key (str): Clave de API de Twelve Data.
+
+    Returns:
+        dict[str, Cotizacion]: Resultado por símbolo, con el mismo formato que
+        `fetch_stock_price`. Un fallo en un símbolo no afecta al resto.
+    """
+    unicos = list(dict.fromkeys(symbols))
+    if not unicos:
+        return {}
+
+    lotes = _trocear(unicos, min(MAX_SIMBOLOS_LOTE, limitador_creditos.por_minuto))
+    respuestas = await asyncio.gather(*(_consultar_lote(lote, api_key) for lote in lotes))
+
+    resultados: dict[str, Cotizacion] = {}
+    for respuesta in respuestas:
+        resultados.update(respuesta)
+    return resultados
+
+
+async def fetch_stock_price(symbol: str, api_key: str) -> Cotizacion:
+    """
+    Consulta el precio actual de un activo financiero usando Twelve Data.
+
+    Args:
+        symbol (str): Símbolo bursátil del activo (ej. "AAPL").
+        api_key (str): Clave de API de Twelve Data.
+
+    Returns:
+        Dict[str, Optional[float | str]]: Diccionario con las claves:
+            - "precio": precio de cierre del activo (o None si falla).
+            - "nombre": nombre de la empresa (o None si falla).
+            - "error": mensaje de error (o None si todo fue bien).
+    """
+    resultados = await fetch_stock_prices([symbol], api_key)
+    return resultados[symbol]
@@ -5,15 +5,20 @@ Este módulo genera un gráfico PNG con el historial de precios de una acción
 seguida por el usuario, utilizando matplotlib.
 
 Se utiliza para representar visualmente la evolución del precio de un activo.
+Todo el historial cabe en como mucho `MAX_PUNTOS` puntos: para periodos largos se
+dibuja el cierre de cada vela de hora o de día en lugar de cada precio.
 """
 
 import io
+import os
 from datetime import datetime
 
 import matplotlib.pyplot as plt
 
 from bot.db_instance import db
 
+MAX_PUNTOS = int(os.getenv("GRAFICO_MAX_PUNTOS", "200"))
+
 
 def generar_grafico(chat_id: str, ticker: str) -> io.BytesIO | None:
     """
@@ -26,7 +31,7 @@ def generar_grafico(chat_id: str, ticker: str) -> io.BytesIO | None:
     Returns:
         io.BytesIO | None: Imagen PNG en memoria o None si no hay datos.
     """
-    historial = db.obtener_historial(chat_id, ticker)
+    historial = db.obtener_serie(chat_id, ticker, MAX_PUNTOS)
 
     if not historial:
         return None
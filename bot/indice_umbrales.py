@@ -0,0 +1,133 @@
+"""
+Módulo: indice_umbrales.py
+
+Índice en memoria de los límites de alerta de los suscriptores de cada símbolo.
+
+Por cada símbolo mantiene dos listas ordenadas, una con los límites inferiores y otra
+con los superiores. Con ellas, los suscriptores cuyo rango deja fuera un precio se
+encuentran con una búsqueda binaria (`bisect`) en lugar de comprobar uno a uno:
+
+- precio < límite inferior: el sufijo de la lista de inferiores a partir del precio.
+- precio > límite superior: el prefijo de la lista de superiores hasta el precio.
+
+Guarda además, por símbolo, las suscripciones con una alerta activa (fuera del rango en
+la revisión anterior): aunque el precio vuelva al rango hay que evaluarlas para salir de
+ese estado. `por_evaluar()` junta ambas, así que el coste de repartir un precio depende
+de las suscripciones afectadas y no de todas las del símbolo.
+
+El índice se actualiza al dar de alta o de baja una suscripción y al cambiar su estado
+de alerta (ver `bot.planificador`).
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
+
+class IndiceUmbrales:
+    """
+    Límites inferiores y superiores de cada símbolo en listas ordenadas de (límite, chat_id).
+    """
+
+    def __init__(self) -> None:
+        self._inferiores: dict[str, list[tuple[float, str]]] = {}
+        self._superiores: dict[str, list[tuple[float, str]]] = {}
+        self._limites: dict[tuple[str, str], tuple[float, float]] = {}
+        self._con_alerta: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._limites)
+
+    def agregar(self, chat_id: str, symbol: str, limite_inf: float, limite_sup: float) -> None:
+        """
+        Añade una suscripción al índice o actualiza sus límites.
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str): Ticker de la acción.
+            limite_inf (float): Límite inferior de alerta.
+            limite_sup (float): Límite superior de alerta.
+        """
+        self.quitar(chat_id, symbol)
+        self._limites[(chat_id, symbol)] = (limite_inf, limite_sup)
+        insort(self._inferiores.setdefault(symbol, []), (limite_inf, chat_id))
+        insort(self._superiores.setdefault(symbol, []), (limite_sup, chat_id))
+
+    def quitar(self, chat_id: str, symbol: str) -> None:
+        """
+        Elimina una suscripción del índice (si existe).
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str): Ticker de la acción.
+        """
+        limites = self._limites.pop((chat_id, symbol), None)
+        if limites is None:
+            return
+        self.marcar_alerta(chat_id, symbol, False)
+        inferiores, superiores = self._inferiores[symbol], self._superiores[symbol]
+        del inferiores[bisect_left(inferiores, (limites[0], chat_id))]
+        del superiores[bisect_left(superiores, (limites[1], chat_id))]
+        if not inferiores:
+            del self._inferiores[symbol], self._superiores[symbol]
+
+    def vaciar(self) -> None:
+        """
+        Elimina todas las suscripciones del índice.
+        """
+        self._inferiores.clear()
+        self._superiores.clear()
+        self._limites.clear()
+        self._con_alerta.clear()
+
+    def marcar_alerta(self, chat_id: str, symbol: str, activa: bool) -> None:
+        """
+        Registra si una suscripción del índice tiene una alerta activa.
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str): Ticker de la acción.
+            activa (bool): True si su estado de alerta no es "dentro".
+        """
+        if activa and (chat_id, symbol) in self._limites:
+            self._con_alerta.setdefault(symbol, set()).add(chat_id)
+        elif symbol in self._con_alerta:
+            self._con_alerta[symbol].discard(chat_id)
+            if not self._con_alerta[symbol]:
+                del self._con_alerta[symbol]
+
+    def fuera_de_rango(self, symbol: str, precio: float) -> set[str]:
+        """
+        Devuelve los suscriptores de un símbolo cuyo rango deja fuera el precio.
+
+        Args:
+            symbol (str): Ticker de la acción.
+            precio (float): Precio actual.
+
+        Returns:
+            set[str]: chat_id de las suscripciones con precio < límite inferior o precio > límite superior.
+        """
+        inferiores = self._inferiores.get(symbol)
+        if not inferiores:
+            return set()
+        superiores = self._superiores[symbol]
+        # Un límite igual al precio no cuenta como fuera del rango
+        bajo = inferiores[bisect_right(inferiores, precio, key=itemgetter(0)) :]
+        sobre = superiores[: bisect_left(superiores, precio, key=itemgetter(0))]
+        fuera = set(map(itemgetter(1), bajo))
+        fuera.update(map(itemgetter(1), sobre))
+        return fuera
+
+    def por_evaluar(self, symbol: str, precio: float) -> set[str]:
+        """
+        Devuelve los suscriptores de un símbolo cuyo estado de alerta puede cambiar con el precio.
+
+        Args:
+            symbol (str): Ticker de la acción.
+            precio (float): Precio actual.
+
+        Returns:
+            set[str]: chat_id de las suscripciones fuera del rango o con una alerta activa.
+        """
+        por_evaluar = self.fuera_de_rango(symbol, precio)
+        por_evaluar.update(self._con_alerta.get(symbol, ()))
+        return por_evaluar
@@ -0,0 +1,206 @@
+"""
+Módulo: limitador.py
+
+Limitador de créditos de la API de TwelveData por API key.
+
+Cada usuario usa su propia API key y las claves gratuitas están limitadas a 8 créditos
+por minuto y 800 al día. Cada símbolo consultado consume un crédito, también dentro de
+una petición por lotes. Este módulo mantiene, para cada clave, un token bucket por
+minuto y otro por día: las peticiones esperan a tener créditos en lugar de fallar.
+"""
+
+import asyncio
+import os
+import time
+from collections.abc import Callable
+
+# Claves registradas a partir de las cuales se purgan las inactivas
+MAX_CLAVES_SIN_PURGAR = 1000
+
+
+class CreditosAgotados(Exception):
+    """
+    Se lanza cuando obtener los créditos pedidos exigiría esperar más de lo permitido.
+    """
+
+    def __init__(self, espera: float) -> None:
+        super().__init__(f"Límite de créditos de la API alcanzado (disponibles en {espera:.0f} s)")
+        self.espera = espera
+
+
+class TokenBucket:
+    """
+    Token bucket clásico: `capacidad` tokens que se rellenan de forma continua a lo largo de `periodo` segundos.
+    """
+
+    def __init__(self, capacidad: float, periodo: float, reloj: Callable[[], float] = time.monotonic) -> None:
+        """
+        Crea un bucket lleno.
+
+        Args:
+            capacidad (float): Número máximo de tokens.
+            periodo (float): Segundos que tarda en rellenarse por completo.
+            reloj (Callable[[], float], optional): Fuente de tiempo (inyectable en tests).
+        """
+        self.capacidad = capacidad
+        self.tasa = capacidad / periodo
+        self._reloj = reloj
+        self._tokens = capacidad
+        self._ultimo = reloj()
+
+    def _rellenar(self) -> None:
+        ahora = self._reloj()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def disponibles(self) -> float:
+        """
+        Devuelve los tokens disponibles en este momento.
+
+        Returns:
+            float: Tokens disponibles.
+        """
+        self._rellenar()
+        return self._tokens
+
+    def espera(self, coste: float = 1) -> float:
+        """
+        Calcula cuántos segundos faltan para disponer de `coste` tokens.
+
+        Args:
+            coste (float, optional): Tokens necesarios.
+
+        Returns:
+            float: Segundos de espera (0 si ya hay tokens suficientes).
+        """
+        faltan = coste - self.disponibles()
+        return max(0.0, faltan / self.tasa)
+
+    def consumir(self, coste: float = 1) -> None:
+        """
+        Resta `coste` tokens (el llamante debe haber comprobado antes que hay suficientes).
+
+        Args:
+            coste (float, optional): Tokens a consumir.
+        """
+        self._rellenar()
+        self._tokens -= coste
+
+
+class LimitadorCreditos:
+    """
+    Limitador por API key con un presupuesto por minuto y otro por día.
+    """
+
+    def __init__(
+        self,
+        por_minuto: int = 8,
+        por_dia: int = 800,
+        max_espera: float | None = 60.0,
+        reloj: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Inicializa el limitador.
+
+        Args:
+            por_minuto (int, optional): Créditos por minuto de cada API key.
+            por_dia (int, optional): Créditos por día de cada API key.
+            max_espera (float | None, optional): Espera máxima por defecto antes de rendirse (None = sin límite).
+            reloj (Callable[[], float], optional): Fuente de tiempo (inyectable en tests).
+        """
+        self.por_minuto = por_minuto
+        self.por_dia = por_dia
+        self.max_espera = max_espera
+        self._reloj = reloj
+        self._cubos: dict[str, tuple[TokenBucket, TokenBucket]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def purgar(self) -> int:
+        """
+        Olvida las claves con ambos cubos llenos y sin peticiones en curso.
+
+        Un cubo lleno equivale a uno recién creado, así que quitarlo no cambia el
+        comportamiento y evita que el registro crezca con las claves de usuarios que ya no usan el bot.
+
+        Returns:
+            int: Número de claves eliminadas.
+        """
+        inactivas = [
+            api_key
+            for api_key, (minuto, dia) in self._cubos.items()
+            if minuto.disponibles() >= minuto.capacidad
+            and dia.disponibles() >= dia.capacidad
+            and not (api_key in self._locks and self._locks[api_key].locked())
+        ]
+        for api_key in inactivas:
+            del self._cubos[api_key]
+            self._locks.pop(api_key, None)
+        return len(inactivas)
+
+    def _cubos_de(self, api_key: str) -> tuple[TokenBucket, TokenBucket]:
+        cubos = self._cubos.get(api_key)
+        if cubos is None:
+            if len(self._cubos) >= MAX_CLAVES_SIN_PURGAR:
+                self.purgar()
+            cubos = (
+                TokenBucket(self.por_minuto, 60, self._reloj),
+                TokenBucket(self.por_dia, 86_400, self._reloj),
+            )
+            self._cubos[api_key] = cubos
+        return cubos
+
+    def restantes(self, api_key: str) -> dict[str, int]:
+        """
+        Devuelve los créditos disponibles ahora mismo para una API key.
+
+        Permite al planificador repartir el trabajo sin agotar el presupuesto.
+
+        Args:
+            api_key (str): API key de TwelveData.
+
+        Returns:
+            dict[str, int]: Créditos disponibles en las claves "minuto" y "dia".
+        """
+        minuto, dia = self._cubos_de(api_key)
+        return {"minuto": int(minuto.disponibles()), "dia": int(dia.disponibles())}
+
+    async def adquirir(self, api_key: str, coste: int = 1, max_espera: float | None = None) -> None:
+        """
+        Espera hasta disponer de `coste` créditos en ambos presupuestos y los consume.
+
+        Las peticiones de una misma clave se atienden en orden de llegada.
+
+        Args:
+            api_key (str): API key de TwelveData.
+            coste (int, optional): Créditos que cuesta la petición (uno por símbolo).
+            max_espera (float | None, optional): Espera máxima; por defecto la del limitador.
+
+        Raises:
+            ValueError: Si el coste supera la capacidad por minuto (nunca podría atenderse).
+            CreditosAgotados: Si habría que esperar más de `max_espera` segundos.
+        """
+        if coste > self.por_minuto:
+            raise ValueError(f"Una petición no puede costar más de {self.por_minuto} créditos")
+
+        limite = self.max_espera if max_espera is None else max_espera
+        minuto, dia = self._cubos_de(api_key)
+        lock = self._locks.setdefault(api_key, asyncio.Lock())
+
+        async with lock:
+            while True:
+                espera = max(minuto.espera(coste), dia.espera(coste))
+                if espera <= 0:
+                    minuto.consumir(coste)
+                    dia.consumir(coste)
+                    return
+                if limite is not None and espera > limite:
+                    raise CreditosAgotados(espera)
+                await asyncio.sleep(espera)
+
+
+# Limitador compartido por todas las consultas a TwelveData
+limitador_creditos = LimitadorCreditos(
+    por_minuto=int(os.getenv("TWELVEDATA_CREDITOS_MINUTO", "8")),
+    por_dia=int(os.getenv("TWELVEDATA_CREDITOS_DIA", "800")),
+    max_espera=float(os.getenv("TWELVEDATA_MAX_ESPERA_CREDITOS", "60")),
+)
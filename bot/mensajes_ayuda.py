@@ -6,6 +6,7 @@ Contiene funciones que devuelven textos de ayuda y comandos para el bot de Teleg
 Estos textos se utilizan en los comandos `/ayuda` y `/comandos` del bot.
 """
 
+
 def get_commands_text() -> str:
     """
     Devuelve un texto con todos los comandos disponibles del bot.
@@ -20,7 +21,7 @@ def get_commands_text() -> str:
         "/ayuda - Ayuda detallada\n"
         "/seguir <TICKER> - Seguir una acción\n"
         "/favoritas - Ver tus acciones seguidas\n"
-        "/price <TICKER> - Precio actual\n"
+        "/price <TICKER> - Precio actual (admite varios tickers)\n"
         "/historial <TICKER> - Ver historial\n"
         "/guardar <TICKER> - Guardar precio actual\n"
         "/borrar\\_historial <TICKER> - Borrar historial\n"
@@ -28,8 +29,9 @@ def get_commands_text() -> str:
         "/grafico <TICKER> - Gráfico del historial\n"
         "/exportar\\_historial - Exportar todo tu historial\n"
         "/exportar\\_historial <TICKER> - Exportar historial de una acción\n"
+        "/exportar\\_historial [TICKER] gz - Exportar historial comprimido\n"
         "/exportar\\_favoritas - Exportar tus favoritas\n"
-        "/media <TICKER> - Media del historial de precios\n"
+        "/media <TICKER> - Media y desviación del historial de precios\n"
     )
 
 
@@ -48,13 +50,13 @@ def get_help_text() -> str:
         "`/seguir <TICKER> [MIN] [LIM_INF] [LIM_SUP]`\n"
         "Por ejemplo: `/seguir AAPL 5 140 180`\n"
         "— Esto sigue a Apple (AAPL), revisando cada 5 minutos y avisando si el precio está fuera del rango 140$ - 180$.\n\n"
-        "🔎 Consulta el precio: `/price AAPL`\n"
+        "🔎 Consulta el precio: `/price AAPL` (o varias a la vez: `/price AAPL MSFT`)\n"
         "⭐ Consulta tus favoritas: `/favoritas`\n"
         "📜 Consulta el historial: `/historial AAPL`\n"
         "🗑️ Borra historial: `/borrar_historial AAPL`\n"
         "🛑 Deja de seguir: `/dejar AAPL`\n"
         "📈 Gráfico de precios: `/grafico AAPL`\n"
-        "📤 Exportar historial: `/exportar_historial`\n\n"
+        "📤 Exportar historial: `/exportar_historial` (añade `gz` para recibirlo comprimido)\n\n"
         "Si tienes dudas, vuelve a escribir `/ayuda` o pregunta al soporte.\n"
         "¡Buena suerte con tus inversiones! 🚀\n\n"
     )
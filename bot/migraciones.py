@@ -0,0 +1,457 @@
+"""
+Módulo: migraciones.py
+
+Migraciones versionadas del esquema de la base de datos.
+
+Cada migración tiene un número de versión, una descripción y las sentencias que aplica.
+La tabla `schema_version` registra las ya aplicadas, así que al arrancar solo se ejecutan
+las pendientes, en orden y cada una en su propia transacción: si falla, la base de datos
+se queda en la versión anterior. Las sentencias de creación usan `IF NOT EXISTS` para que
+aplicarlas sobre una base creada antes de existir este sistema no falle.
+
+Para evolucionar el esquema se añade una migración nueva al final de `MIGRACIONES`;
+nunca se modifica una ya publicada.
+"""
+
+import logging
+import sqlite3
+
+# (versión, descripción, sentencias)
+type Migracion = tuple[int, str, tuple[str, ...]]
+
+# Acumula precios de mercado en sus velas de 1 minuto, 1 hora y 1 día (ver `bot.velas`).
+# La apertura y el cierre son los del precio más antiguo y más reciente de cada vela,
+# sea cual sea el orden en que lleguen.
+_ACUMULAR_EN_VELAS = """
+INSERT INTO velas (segundos, symbol, inicio, apertura, maximo, minimo, cierre, num, suma, primero, ultimo)
+SELECT n.column1, t.symbol,
+       datetime(CAST(strftime('%s', t.timestamp) AS INTEGER) / n.column1 * n.column1, 'unixepoch'),
+       t.precio, t.precio, t.precio, t.precio, 1, t.precio, t.timestamp, t.timestamp
+FROM {origen} AS t, (VALUES (60), (3600), (86400)) AS n
+WHERE true
+ON CONFLICT (segundos, symbol, inicio) DO UPDATE SET
+    apertura = CASE WHEN excluded.primero < primero THEN excluded.apertura ELSE apertura END,
+    maximo = MAX(maximo, excluded.maximo),
+    minimo = MIN(minimo, excluded.minimo),
+    cierre = CASE WHEN excluded.ultimo >= ultimo THEN excluded.cierre ELSE cierre END,
+    num = num + excluded.num,
+    suma = suma + excluded.suma,
+    primero = MIN(primero, excluded.primero),
+    ultimo = MAX(ultimo, excluded.ultimo);
+"""
+_PRECIO_NUEVO = "(SELECT NEW.symbol AS symbol, NEW.precio AS precio, NEW.timestamp AS timestamp)"
+
+# Combina una fila de resumen (número, suma, suma de cuadrados, extremos, apertura y cierre)
+# con la que ya existe para su clave
+_COMBINAR_RESUMEN = """
+    apertura = CASE WHEN excluded.primero < primero THEN excluded.apertura ELSE apertura END,
+    maximo = MAX(maximo, excluded.maximo),
+    minimo = MIN(minimo, excluded.minimo),
+    cierre = CASE WHEN excluded.ultimo >= ultimo THEN excluded.cierre ELSE cierre END,
+    num = num + excluded.num,
+    suma = suma + excluded.suma,
+    suma_cuadrados = suma_cuadrados + excluded.suma_cuadrados,
+    primero = MIN(primero, excluded.primero),
+    ultimo = MAX(ultimo, excluded.ultimo);
+"""
+# Como `_ACUMULAR_EN_VELAS`, acumulando también la suma de cuadrados (versión 5)
+_ACUMULAR_EN_VELAS_CUADRADOS = f"""
+INSERT INTO velas (segundos, symbol, inicio, apertura, maximo, minimo, cierre, num, suma, suma_cuadrados, primero, ultimo)
+SELECT n.column1, t.symbol,
+       datetime(CAST(strftime('%s', t.timestamp) AS INTEGER) / n.column1 * n.column1, 'unixepoch'),
+       t.precio, t.precio, t.precio, t.precio, 1, t.precio, t.precio * t.precio, t.timestamp, t.timestamp
+FROM {{origen}} AS t, (VALUES (60), (3600), (86400)) AS n
+WHERE true
+ON CONFLICT (segundos, symbol, inicio) DO UPDATE SET {_COMBINAR_RESUMEN}
+"""
+# Acumula precios del historial de usuarios en sus estadísticas por (chat_id, symbol)
+_ACUMULAR_EN_ESTADISTICAS = f"""
+INSERT INTO estadisticas_historial (
+    chat_id, symbol, apertura, maximo, minimo, cierre, num, suma, suma_cuadrados, primero, ultimo
+)
+SELECT t.chat_id, t.symbol, t.precio, t.precio, t.precio, t.precio,
+       1, t.precio, t.precio * t.precio, t.timestamp, t.timestamp
+FROM {{origen}} AS t
+WHERE true
+ON CONFLICT (chat_id, symbol) DO UPDATE SET {_COMBINAR_RESUMEN}
+"""
+# Usuarios que tienen en su historial un precio de mercado recién insertado: los que siguen
+# el símbolo y los que lo dejaron después (el precio es de antes de volcar el lote)
+_SEGUIDORES_DEL_PRECIO = """(
+    SELECT p.chat_id AS chat_id, NEW.symbol AS symbol, NEW.precio AS precio, NEW.timestamp AS timestamp
+    FROM periodos_seguimiento AS p
+    WHERE p.symbol = NEW.symbol AND p.hasta IS NULL AND p.desde <= NEW.timestamp
+    UNION ALL
+    SELECT p.chat_id, NEW.symbol, NEW.precio, NEW.timestamp
+    FROM periodos_seguimiento AS p
+    WHERE p.symbol = NEW.symbol AND p.hasta > NEW.timestamp AND p.desde <= NEW.timestamp
+)"""
+_CAPTURA_NUEVA = "(SELECT NEW.chat_id AS chat_id, NEW.symbol AS symbol, NEW.precio AS precio, NEW.timestamp AS timestamp)"
+# Acumula una captura manual nueva en las estadísticas de su usuario y símbolo (versión 6)
+_ACUMULAR_CAPTURA = f"""
+INSERT INTO estadisticas_capturas (
+    chat_id, symbol, apertura, maximo, minimo, cierre, num, suma, suma_cuadrados, primero, ultimo
+)
+VALUES (NEW.chat_id, NEW.symbol, NEW.precio, NEW.precio, NEW.precio, NEW.precio,
+        1, NEW.precio, NEW.precio * NEW.precio, NEW.timestamp, NEW.timestamp)
+ON CONFLICT (chat_id, symbol) DO UPDATE SET {_COMBINAR_RESUMEN}
+"""
+# Recalcula desde `capturas_manuales` las estadísticas de los pares (chat_id, symbol) que
+# cumplen `{filtro}` (condición sobre `c`). La usan la migración 6 y
+# `DatabaseManager.reconstruir_estadisticas`.
+RESUMIR_CAPTURAS = """
+INSERT INTO estadisticas_capturas (
+    chat_id, symbol, apertura, maximo, minimo, cierre, num, suma, suma_cuadrados, primero, ultimo
+)
+SELECT c.chat_id, c.symbol,
+       (SELECT precio FROM capturas_manuales WHERE chat_id = c.chat_id AND symbol = c.symbol
+        ORDER BY timestamp, id LIMIT 1),
+       MAX(c.precio), MIN(c.precio),
+       (SELECT precio FROM capturas_manuales WHERE chat_id = c.chat_id AND symbol = c.symbol
+        ORDER BY timestamp DESC, id DESC LIMIT 1),
+       COUNT(*), SUM(c.precio), SUM(c.precio * c.precio), MIN(c.timestamp), MAX(c.timestamp)
+FROM capturas_manuales AS c
+WHERE {filtro}
+GROUP BY c.chat_id, c.symbol;
+"""
+
+MIGRACIONES: list[Migracion] = [
+    (
+        1,
+        "Esquema inicial",
+        (
+            # Tabla de usuarios (incluye API Key)
+            """
+            CREATE TABLE IF NOT EXISTS usuarios (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT UNIQUE NOT NULL,
+                username TEXT,
+                fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                api_key TEXT
+            );
+            """,
+            # Tabla de productos seguidos
+            """
+            CREATE TABLE IF NOT EXISTS productos_seguidos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                nombre_empresa TEXT,
+                intervalo_min INTEGER DEFAULT 15,
+                limite_inferior REAL,
+                limite_superior REAL,
+                UNIQUE(chat_id, symbol)
+            );
+            """,
+            # Tabla de historial de precios
+            """
+            CREATE TABLE IF NOT EXISTS historial_precios (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                precio REAL NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            # Estado del planificador (segundos epoch) para sobrevivir a los reinicios
+            """
+            CREATE TABLE IF NOT EXISTS estado_seguimiento (
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                ultima_revision REAL,
+                proxima_revision REAL NOT NULL,
+                PRIMARY KEY (chat_id, symbol)
+            );
+            """,
+            # Estado de las alertas de cada suscripción (dentro, bajo o sobre) y última alerta enviada
+            """
+            CREATE TABLE IF NOT EXISTS estado_alertas (
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                ultima_alerta INTEGER,
+                PRIMARY KEY (chat_id, symbol)
+            );
+            """,
+        ),
+    ),
+    (
+        2,
+        "Índices del historial de precios",
+        (
+            # Últimos precios, estadísticas y borrado de un símbolo de un usuario (cubre las columnas leídas)
+            """
+            CREATE INDEX IF NOT EXISTS idx_historial_usuario_symbol
+            ON historial_precios (chat_id, symbol, id, precio, timestamp);
+            """,
+            # Exportación del historial completo de un usuario ordenado por fecha
+            """
+            CREATE INDEX IF NOT EXISTS idx_historial_usuario_fecha
+            ON historial_precios (chat_id, timestamp, symbol, precio);
+            """,
+        ),
+    ),
+    (
+        3,
+        "Precios de mercado compartidos entre usuarios",
+        (
+            # Cada precio consultado por el seguimiento se guarda una sola vez por símbolo e instante
+            """
+            CREATE TABLE IF NOT EXISTS precios_mercado (
+                id INTEGER PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                precio REAL NOT NULL,
+                timestamp DATETIME NOT NULL,
+                UNIQUE (symbol, timestamp)
+            );
+            """,
+            # Precios guardados a mano con /guardar (y el historial anterior a esta migración)
+            """
+            CREATE TABLE IF NOT EXISTS capturas_manuales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                precio REAL NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_capturas_usuario_symbol
+            ON capturas_manuales (chat_id, symbol, timestamp, id, precio);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_capturas_usuario_fecha
+            ON capturas_manuales (chat_id, timestamp, id, symbol, precio);
+            """,
+            # Intervalos en los que un usuario ha seguido un símbolo (hasta NULL: lo sigue todavía)
+            """
+            CREATE TABLE IF NOT EXISTS periodos_seguimiento (
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                desde DATETIME NOT NULL,
+                hasta DATETIME,
+                PRIMARY KEY (chat_id, symbol, desde)
+            );
+            """,
+            # El historial existente no distingue capturas del seguimiento y manuales: se conserva tal cual
+            """
+            INSERT INTO capturas_manuales (id, chat_id, symbol, precio, timestamp)
+            SELECT id, chat_id, symbol, precio, timestamp FROM historial_precios;
+            """,
+            """
+            INSERT OR IGNORE INTO periodos_seguimiento (chat_id, symbol, desde)
+            SELECT chat_id, symbol, CURRENT_TIMESTAMP FROM productos_seguidos;
+            """,
+            "DROP TABLE historial_precios;",
+            # El historial de cada usuario: precios de mercado de sus periodos de seguimiento más sus capturas
+            """
+            CREATE VIEW IF NOT EXISTS historial_precios (id, chat_id, symbol, precio, timestamp) AS
+            SELECT m.id, p.chat_id, m.symbol, m.precio, m.timestamp
+            FROM periodos_seguimiento AS p
+            JOIN precios_mercado AS m
+                ON m.symbol = p.symbol AND m.timestamp >= p.desde AND (p.hasta IS NULL OR m.timestamp < p.hasta)
+            UNION ALL
+            SELECT id, chat_id, symbol, precio, timestamp FROM capturas_manuales;
+            """,
+            # Las inserciones directas en el historial se guardan como capturas manuales
+            """
+            CREATE TRIGGER IF NOT EXISTS historial_precios_insertar
+            INSTEAD OF INSERT ON historial_precios
+            BEGIN
+                INSERT INTO capturas_manuales (chat_id, symbol, precio, timestamp)
+                VALUES (NEW.chat_id, NEW.symbol, NEW.precio, COALESCE(NEW.timestamp, CURRENT_TIMESTAMP));
+            END;
+            """,
+        ),
+    ),
+    (
+        4,
+        "Velas OHLC de los precios de mercado",
+        (
+            # Una fila por resolución (segundos), símbolo y vela; `primero` y `ultimo` son las fechas de apertura y cierre
+            """
+            CREATE TABLE IF NOT EXISTS velas (
+                segundos INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                inicio DATETIME NOT NULL,
+                apertura REAL NOT NULL,
+                maximo REAL NOT NULL,
+                minimo REAL NOT NULL,
+                cierre REAL NOT NULL,
+                num INTEGER NOT NULL,
+                suma REAL NOT NULL,
+                primero DATETIME NOT NULL,
+                ultimo DATETIME NOT NULL,
+                PRIMARY KEY (segundos, symbol, inicio)
+            ) WITHOUT ROWID;
+            """,
+            # Las velas se mantienen al insertar cada precio (los repetidos que se ignoran no cuentan)
+            f"""
+            CREATE TRIGGER IF NOT EXISTS precios_mercado_velas
+            AFTER INSERT ON precios_mercado
+            BEGIN
+                {_ACUMULAR_EN_VELAS.format(origen=_PRECIO_NUEVO)}
+            END;
+            """,
+            _ACUMULAR_EN_VELAS.format(origen="precios_mercado"),
+        ),
+    ),
+    (
+        5,
+        "Estadísticas del historial por usuario y símbolo",
+        (
+            # Las velas guardan también la suma de cuadrados. Si ya se purgaron sus precios, se
+            # aproxima como si todos los de la vela fuesen iguales a su media
+            "ALTER TABLE velas ADD COLUMN suma_cuadrados REAL NOT NULL DEFAULT 0;",
+            """
+            UPDATE velas SET suma_cuadrados = COALESCE((
+                SELECT CASE WHEN COUNT(*) = velas.num THEN SUM(m.precio * m.precio) END
+                FROM precios_mercado AS m
+                WHERE m.symbol = velas.symbol
+                  AND m.timestamp >= velas.inicio
+                  AND m.timestamp < datetime(velas.inicio, '+' || velas.segundos || ' seconds')
+            ), suma * suma / num);
+            """,
+            "DROP TRIGGER IF EXISTS precios_mercado_velas;",
+            f"""
+            CREATE TRIGGER IF NOT EXISTS precios_mercado_velas
+            AFTER INSERT ON precios_mercado
+            BEGIN
+                {_ACUMULAR_EN_VELAS_CUADRADOS.format(origen=_PRECIO_NUEVO)}
+            END;
+            """,
+            # Resumen de todo el historial de cada usuario y símbolo, para /media sin recorrerlo.
+            # Se rellena con `DatabaseManager.reconstruir_estadisticas`, que lee las velas de lo ya purgado
+            """
+            CREATE TABLE IF NOT EXISTS estadisticas_historial (
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                apertura REAL NOT NULL,
+                maximo REAL NOT NULL,
+                minimo REAL NOT NULL,
+                cierre REAL NOT NULL,
+                num INTEGER NOT NULL,
+                suma REAL NOT NULL,
+                suma_cuadrados REAL NOT NULL,
+                primero DATETIME NOT NULL,
+                ultimo DATETIME NOT NULL,
+                PRIMARY KEY (chat_id, symbol)
+            ) WITHOUT ROWID;
+            """,
+            # Seguidores de un símbolo en un instante, para repartir cada precio de mercado
+            """
+            CREATE INDEX IF NOT EXISTS idx_periodos_symbol
+            ON periodos_seguimiento (symbol, hasta, desde, chat_id);
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS capturas_manuales_estadisticas
+            AFTER INSERT ON capturas_manuales
+            BEGIN
+                {_ACUMULAR_EN_ESTADISTICAS.format(origen=_CAPTURA_NUEVA)}
+            END;
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS precios_mercado_estadisticas
+            AFTER INSERT ON precios_mercado
+            BEGIN
+                {_ACUMULAR_EN_ESTADISTICAS.format(origen=_SEGUIDORES_DEL_PRECIO)}
+            END;
+            """,
+        ),
+    ),
+    (
+        6,
+        "Estadísticas solo de las capturas manuales",
+        (
+            # Repartir cada precio de mercado entre los seguidores costaba una escritura por
+            # seguidor. Las velas ya guardan la suma de cuadrados (versión 5): /media resume al
+            # leer los precios de mercado de los periodos de seguimiento, y solo las capturas
+            # manuales se acumulan por usuario
+            "DROP TRIGGER IF EXISTS precios_mercado_estadisticas;",
+            "DROP TRIGGER IF EXISTS capturas_manuales_estadisticas;",
+            "DROP INDEX IF EXISTS idx_periodos_symbol;",
+            "DROP TABLE IF EXISTS estadisticas_historial;",
+            """
+            CREATE TABLE IF NOT EXISTS estadisticas_capturas (
+                chat_id TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                apertura REAL NOT NULL,
+                maximo REAL NOT NULL,
+                minimo REAL NOT NULL,
+                cierre REAL NOT NULL,
+                num INTEGER NOT NULL,
+                suma REAL NOT NULL,
+                suma_cuadrados REAL NOT NULL,
+                primero DATETIME NOT NULL,
+                ultimo DATETIME NOT NULL,
+                PRIMARY KEY (chat_id, symbol)
+            ) WITHOUT ROWID;
+            """,
+            RESUMIR_CAPTURAS.format(filtro="true"),
+            f"""
+            CREATE TRIGGER IF NOT EXISTS capturas_manuales_estadisticas
+            AFTER INSERT ON capturas_manuales
+            BEGIN
+                {_ACUMULAR_CAPTURA}
+            END;
+            """,
+        ),
+    ),
+]
+
+
+def version_actual(conn: sqlite3.Connection) -> int:
+    """
+    Devuelve la versión del esquema de una base de datos.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos.
+
+    Returns:
+        int: Última migración aplicada (0 si no hay ninguna).
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        descripcion TEXT NOT NULL,
+        aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    return int(conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0])
+
+
+def migrar(conn: sqlite3.Connection, migraciones: list[Migracion] = MIGRACIONES) -> int:
+    """
+    Aplica en orden las migraciones pendientes.
+
+    Cada migración se ejecuta en una transacción `IMMEDIATE` que vuelve a comprobar la
+    versión, de modo que dos procesos arrancando a la vez no la aplican dos veces.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura.
+        migraciones (list[Migracion], optional): Migraciones conocidas, ordenadas por versión.
+
+    Returns:
+        int: Versión del esquema tras migrar.
+
+    Raises:
+        sqlite3.Error: Si una migración falla (se deshace y las siguientes no se aplican).
+    """
+    version = version_actual(conn)
+    conn.commit()
+    for numero, descripcion, sentencias in migraciones:
+        if numero <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version_actual(conn) < numero:
+                for sentencia in sentencias:
+                    conn.execute(sentencia)
+                conn.execute("INSERT INTO schema_version (version, descripcion) VALUES (?, ?)", (numero, descripcion))
+                logging.info(f"🗄️ Migración {numero} aplicada: {descripcion}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = numero
+    return version
@@ -0,0 +1,313 @@
+"""
+Módulo: planificador.py
+
+Planificador de revisiones de precios basado en una cola de prioridad (heap).
+
+Cada suscripción (usuario, símbolo) tiene un instante de vencimiento. El bucle de
+seguimiento duerme exactamente hasta el siguiente vencimiento y solo procesa las
+suscripciones vencidas, de modo que el coste de cada despertar depende del número de
+elementos vencidos y no del total de suscripciones.
+
+Las altas y bajas (`/seguir` y `/dejar`) actualizan la cola de forma incremental y
+despiertan al bucle si el nuevo vencimiento es anterior al que estaba esperando, y
+mantienen al día el índice de límites de alerta por símbolo (`bot.indice_umbrales`), que
+también sigue los cambios de estado de alerta (`cambiar_estado_alerta`).
+
+El registro es compacto para que la memoria no crezca con los meses: los registros usan
+`__slots__`, los símbolos se internan, los instantes son enteros epoch y las entradas
+muertas del heap se compactan cuando superan a las vivas.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import sys
+import time
+from collections.abc import Callable, Iterable
+
+from bot.alertas import DENTRO
+from bot.indice_umbrales import IndiceUmbrales
+
+# Separación mínima entre dos revisiones de una misma suscripción (el antiguo barrido era cada 30 s)
+INTERVALO_MINIMO = 30
+
+# Entradas muertas toleradas en el heap antes de compactarlo (además de tantas como vivas)
+MARGEN_COMPACTACION = 64
+
+
+class Suscripcion:
+    """
+    Datos de una suscripción necesarios para revisarla sin volver a consultar la base de datos.
+
+    Los símbolos, los chat_id y los nombres se internan: miles de suscripciones a un mismo
+    ticker comparten una sola cadena.
+    """
+
+    __slots__ = (
+        "chat_id",
+        "symbol",
+        "intervalo_min",
+        "nombre",
+        "limite_inf",
+        "limite_sup",
+        "vencimiento",
+        "version",
+        "estado_alerta",
+        "ultima_alerta",
+    )
+
+    def __init__(
+        self,
+        chat_id: str,
+        symbol: str,
+        intervalo_min: int,
+        nombre: str,
+        limite_inf: float,
+        limite_sup: float,
+        vencimiento: float,
+        estado_alerta: str = DENTRO,
+        ultima_alerta: int | None = None,
+    ) -> None:
+        self.chat_id = sys.intern(chat_id)
+        self.symbol = sys.intern(symbol)
+        self.intervalo_min = intervalo_min
+        self.nombre = sys.intern(nombre)
+        self.limite_inf = limite_inf
+        self.limite_sup = limite_sup
+        self.vencimiento = int(vencimiento)
+        self.version = 0
+        self.estado_alerta = estado_alerta
+        self.ultima_alerta = ultima_alerta
+
+    @property
+    def clave(self) -> tuple[str, str]:
+        return (self.chat_id, self.symbol)
+
+
+class Planificador:
+    """
+    Cola de prioridad de suscripciones ordenada por instante de vencimiento.
+
+    Las bajas y reprogramaciones usan borrado perezoso: la entrada antigua se queda en
+    el heap y se descarta al extraerla si su versión ya no coincide.
+    """
+
+    def __init__(self, reloj: Callable[[], float] = time.time) -> None:
+        """
+        Args:
+            reloj (Callable[[], float], optional): Fuente de tiempo en segundos epoch (inyectable en tests).
+        """
+        self._reloj = reloj
+        self._heap: list[tuple[int, int, str, str]] = []
+        self._suscripciones: dict[tuple[str, str], Suscripcion] = {}
+        self._versiones = itertools.count(1)
+        self._cambios = asyncio.Event()
+        self.indice = IndiceUmbrales()
+        self.compactaciones = 0
+
+    def __len__(self) -> int:
+        return len(self._suscripciones)
+
+    def __contains__(self, clave: object) -> bool:
+        return clave in self._suscripciones
+
+    def ahora(self) -> float:
+        """
+        Devuelve el instante actual según el reloj del planificador.
+
+        Returns:
+            float: Segundos epoch.
+        """
+        return self._reloj()
+
+    def estadisticas(self) -> dict[str, int]:
+        """
+        Devuelve el tamaño del registro para vigilar su consumo de memoria.
+
+        Returns:
+            dict[str, int]: Suscripciones vivas, entradas del heap (vivas y muertas) y compactaciones realizadas.
+        """
+        return {
+            "suscripciones": len(self._suscripciones),
+            "entradas_heap": len(self._heap),
+            "compactaciones": self.compactaciones,
+        }
+
+    def _vigente(self, entrada: tuple[int, int, str, str]) -> bool:
+        suscripcion = self._suscripciones.get((entrada[2], entrada[3]))
+        return suscripcion is not None and suscripcion.version == entrada[1]
+
+    def _compactar_si_hace_falta(self) -> None:
+        """
+        Elimina las entradas muertas del heap cuando superan a las vivas (más un margen).
+        """
+        if len(self._heap) <= 2 * len(self._suscripciones) + MARGEN_COMPACTACION:
+            return
+        self._heap = [entrada for entrada in self._heap if self._vigente(entrada)]
+        heapq.heapify(self._heap)
+        self.compactaciones += 1
+
+    def _encolar(self, suscripcion: Suscripcion) -> None:
+        suscripcion.version = next(self._versiones)
+        heapq.heappush(self._heap, (suscripcion.vencimiento, suscripcion.version, suscripcion.chat_id, suscripcion.symbol))
+        self._compactar_si_hace_falta()
+
+    def cargar(self, suscripciones: Iterable[Suscripcion]) -> None:
+        """
+        Sustituye el contenido de la cola por las suscripciones indicadas (arranque).
+
+        Args:
+            suscripciones (Iterable[Suscripcion]): Suscripciones con su vencimiento ya calculado.
+        """
+        self._suscripciones = {}
+        self._heap = []
+        self.indice.vaciar()
+        for suscripcion in suscripciones:
+            suscripcion.version = next(self._versiones)
+            self._suscripciones[suscripcion.clave] = suscripcion
+            self.indice.agregar(suscripcion.chat_id, suscripcion.symbol, suscripcion.limite_inf, suscripcion.limite_sup)
+            self.indice.marcar_alerta(suscripcion.chat_id, suscripcion.symbol, suscripcion.estado_alerta != DENTRO)
+            self._heap.append((suscripcion.vencimiento, suscripcion.version, suscripcion.chat_id, suscripcion.symbol))
+        heapq.heapify(self._heap)
+        self._cambios.set()
+
+    def programar(
+        self,
+        chat_id: str,
+        symbol: str,
+        intervalo_min: int,
+        nombre: str,
+        limite_inf: float,
+        limite_sup: float,
+        vencimiento: float | None = None,
+    ) -> Suscripcion:
+        """
+        Añade o actualiza una suscripción. Por defecto vence inmediatamente.
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str): Ticker de la acción.
+            intervalo_min (int): Minutos entre revisiones.
+            nombre (str): Nombre de la empresa.
+            limite_inf (float): Límite inferior de alerta.
+            limite_sup (float): Límite superior de alerta.
+            vencimiento (float | None, optional): Instante epoch de la próxima revisión.
+
+        Returns:
+            Suscripcion: La suscripción programada.
+        """
+        suscripcion = Suscripcion(
+            chat_id,
+            symbol,
+            intervalo_min,
+            nombre,
+            limite_inf,
+            limite_sup,
+            self._reloj() if vencimiento is None else vencimiento,
+        )
+        self._suscripciones[suscripcion.clave] = suscripcion
+        self.indice.agregar(suscripcion.chat_id, suscripcion.symbol, limite_inf, limite_sup)
+        self._encolar(suscripcion)
+        self._cambios.set()
+        return suscripcion
+
+    def cancelar(self, chat_id: str, symbol: str) -> None:
+        """
+        Elimina una suscripción de la cola (si existe).
+
+        Args:
+            chat_id (str): ID de usuario de Telegram.
+            symbol (str): Ticker de la acción.
+        """
+        self._suscripciones.pop((chat_id, symbol), None)
+        self.indice.quitar(chat_id, symbol)
+        self._compactar_si_hace_falta()
+
+    def cambiar_estado_alerta(self, suscripcion: Suscripcion, estado: str) -> None:
+        """
+        Cambia el estado de alerta de una suscripción y olvida su última alerta.
+
+        Si la suscripción se canceló o se sustituyó mientras se revisaba, el índice no cambia.
+
+        Args:
+            suscripcion (Suscripcion): Suscripción revisada.
+            estado (str): Nuevo estado (ver `bot.alertas`).
+        """
+        suscripcion.estado_alerta, suscripcion.ultima_alerta = estado, None
+        if self._suscripciones.get(suscripcion.clave) is suscripcion:
+            self.indice.marcar_alerta(suscripcion.chat_id, suscripcion.symbol, estado != DENTRO)
+
+    def reprogramar(self, suscripcion: Suscripcion, ahora: float | None = None, retraso: float | None = None) -> None:
+        """
+        Programa la siguiente revisión de una suscripción un intervalo después de `ahora`.
+
+        Si la suscripción se canceló o se sustituyó mientras se procesaba, no se vuelve a encolar.
+
+        Args:
+            suscripcion (Suscripcion): Suscripción recién revisada.
+            ahora (float | None, optional): Instante de la revisión.
+            retraso (float | None, optional): Segundos hasta la próxima revisión; por defecto su intervalo.
+        """
+        if self._suscripciones.get(suscripcion.clave) is not suscripcion:
+            return
+        ahora = self._reloj() if ahora is None else ahora
+        retraso = suscripcion.intervalo_min * 60 if retraso is None else retraso
+        suscripcion.vencimiento = int(ahora + max(INTERVALO_MINIMO, retraso))
+        self._encolar(suscripcion)
+
+    def extraer_vencidas(self, ahora: float | None = None) -> list[Suscripcion]:
+        """
+        Saca de la cola todas las suscripciones vencidas.
+
+        Las suscripciones extraídas no vuelven a la cola hasta que se llama a `reprogramar`.
+
+        Args:
+            ahora (float | None, optional): Instante de referencia.
+
+        Returns:
+            list[Suscripcion]: Suscripciones vencidas en orden de vencimiento.
+        """
+        ahora = self._reloj() if ahora is None else ahora
+        vencidas: list[Suscripcion] = []
+        while self._heap and self._heap[0][0] <= ahora:
+            entrada = heapq.heappop(self._heap)
+            if self._vigente(entrada):
+                vencidas.append(self._suscripciones[(entrada[2], entrada[3])])
+        return vencidas
+
+    def segundos_hasta_siguiente(self, ahora: float | None = None) -> float | None:
+        """
+        Calcula cuánto falta para el siguiente vencimiento válido.
+
+        Args:
+            ahora (float | None, optional): Instante de referencia.
+
+        Returns:
+            float | None: Segundos (0 si ya hay algo vencido) o None si la cola está vacía.
+        """
+        ahora = self._reloj() if ahora is None else ahora
+        while self._heap:
+            if self._vigente(self._heap[0]):
+                return max(0.0, self._heap[0][0] - ahora)
+            heapq.heappop(self._heap)
+        return None
+
+    async def esperar(self, maximo: float) -> None:
+        """
+        Duerme hasta el siguiente vencimiento, hasta `maximo` segundos o hasta que cambie la cola.
+
+        Args:
+            maximo (float): Espera máxima en segundos.
+        """
+        siguiente = self.segundos_hasta_siguiente()
+        espera = maximo if siguiente is None else min(siguiente, maximo)
+        if espera <= 0:
+            return
+        self._cambios.clear()
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(self._cambios.wait(), timeout=espera)
+
+
+# Planificador compartido por el bucle de seguimiento y los comandos del bot
+planificador = Planificador()
@@ -0,0 +1,196 @@
+"""
+Módulo: resiliencia.py
+
+Herramientas para tolerar fallos transitorios de proveedores externos.
+
+- `reintentar`: repite una operación idempotente con backoff exponencial acotado y
+  jitter, respetando la cabecera `Retry-After` cuando el proveedor la envía.
+- `CircuitBreaker`: tras varios fallos seguidos deja de llamar al proveedor durante un
+  periodo de enfriamiento y falla al momento, sin gastar conexiones ni créditos.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class ErrorTransitorio(Exception):
+    """
+    Fallo temporal del proveedor (timeout, HTTP 429, 5xx...) que merece un reintento.
+    """
+
+    def __init__(self, mensaje: str, retry_after: float | None = None) -> None:
+        """
+        Args:
+            mensaje (str): Descripción del error.
+            retry_after (float | None, optional): Segundos que el proveedor pide esperar.
+        """
+        super().__init__(mensaje)
+        self.retry_after = retry_after
+
+
+class CircuitoAbierto(Exception):
+    """
+    Se lanza al intentar llamar a un proveedor cuyo circuito está abierto.
+    """
+
+
+def interpretar_retry_after(valor: str | None) -> float | None:
+    """
+    Convierte el valor de una cabecera `Retry-After` en segundos.
+
+    Args:
+        valor (str | None): Número de segundos o fecha HTTP.
+
+    Returns:
+        float | None: Segundos de espera, o None si la cabecera falta o no es válida.
+    """
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (fecha - datetime.now(UTC)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de tres estados (cerrado, abierto y semiabierto) para un proveedor.
+
+    En estado cerrado las llamadas pasan con normalidad. Tras `umbral_fallos` fallos
+    seguidos se abre y rechaza las llamadas durante `enfriamiento` segundos. Pasado ese
+    tiempo queda semiabierto: el primer éxito lo cierra y el primer fallo lo vuelve a abrir.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        umbral_fallos: int = 5,
+        enfriamiento: float = 60.0,
+        reloj: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            nombre (str): Nombre del proveedor (para los logs).
+            umbral_fallos (int, optional): Fallos consecutivos que abren el circuito.
+            enfriamiento (float, optional): Segundos que permanece abierto.
+            reloj (Callable[[], float], optional): Fuente de tiempo (inyectable en tests).
+        """
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self._reloj = reloj
+        self._estado = CERRADO
+        self._abierto_desde = 0.0
+        self.fallos_consecutivos = 0
+        self.aperturas = 0
+        self.rechazadas = 0
+
+    @property
+    def estado(self) -> str:
+        """
+        Estado actual del circuito ("cerrado", "abierto" o "semiabierto").
+        """
+        if self._estado == ABIERTO and self._reloj() - self._abierto_desde >= self.enfriamiento:
+            self._estado = SEMIABIERTO
+        return self._estado
+
+    def comprobar(self) -> None:
+        """
+        Comprueba si se puede llamar al proveedor.
+
+        Raises:
+            CircuitoAbierto: Si el circuito está abierto.
+        """
+        if self.estado == ABIERTO:
+            self.rechazadas += 1
+            restante = self.enfriamiento - (self._reloj() - self._abierto_desde)
+            raise CircuitoAbierto(f"Servicio {self.nombre} no disponible temporalmente (reintenta en {restante:.0f} s)")
+
+    def registrar_exito(self) -> None:
+        """
+        Anota una llamada correcta y cierra el circuito.
+        """
+        if self._estado != CERRADO:
+            logging.info(f"🔌 Circuito de {self.nombre} cerrado de nuevo.")
+        self._estado = CERRADO
+        self.fallos_consecutivos = 0
+
+    def registrar_fallo(self) -> None:
+        """
+        Anota un fallo transitorio y abre el circuito si se alcanza el umbral.
+        """
+        self.fallos_consecutivos += 1
+        if self.estado == SEMIABIERTO or self.fallos_consecutivos >= self.umbral_fallos:
+            if self._estado != ABIERTO:
+                self.aperturas += 1
+                logging.warning(f"⚡ Circuito de {self.nombre} abierto tras {self.fallos_consecutivos} fallos seguidos.")
+            self._estado = ABIERTO
+            self._abierto_desde = self._reloj()
+
+    def estadisticas(self) -> dict[str, str | int]:
+        """
+        Devuelve el estado del circuito y sus contadores.
+
+        Returns:
+            dict[str, str | int]: Estado, fallos consecutivos, aperturas y llamadas rechazadas.
+        """
+        return {
+            "estado": self.estado,
+            "fallos_consecutivos": self.fallos_consecutivos,
+            "aperturas": self.aperturas,
+            "rechazadas": self.rechazadas,
+        }
+
+
+async def reintentar[T](
+    funcion: Callable[[], Awaitable[T]],
+    intentos: int = 3,
+    base: float = 0.5,
+    maximo: float = 8.0,
+    transitorias: tuple[type[BaseException], ...] = (ErrorTransitorio,),
+) -> T:
+    """
+    Ejecuta `funcion` y la repite ante errores transitorios con backoff exponencial.
+
+    La espera entre intentos es aleatoria entre 0 y `min(maximo, base * 2**intento)`
+    ("full jitter"). Si el error trae `retry_after`, se espera ese tiempo; si supera
+    `maximo` no se reintenta.
+
+    Args:
+        funcion (Callable[[], Awaitable[T]]): Operación idempotente a ejecutar.
+        intentos (int, optional): Número máximo de intentos (incluido el primero).
+        base (float, optional): Espera base en segundos.
+        maximo (float, optional): Espera máxima entre intentos.
+        transitorias (tuple[type[BaseException], ...], optional): Excepciones que se reintentan.
+
+    Returns:
+        T: Resultado de la primera ejecución correcta.
+
+    Raises:
+        BaseException: El último error si se agotan los intentos o el error no es transitorio.
+    """
+    for intento in range(intentos):
+        try:
+            return await funcion()
+        except transitorias as e:
+            retry_after = e.retry_after if isinstance(e, ErrorTransitorio) else None
+            if intento == intentos - 1 or (retry_after is not None and retry_after > maximo):
+                raise
+            espera = retry_after if retry_after is not None else random.uniform(0, min(maximo, base * 2**intento))
+            logging.info(f"Reintento {intento + 1}/{intentos - 1} en {espera:.2f} s tras error transitorio: {e}")
+            await asyncio.sleep(espera)
+    raise ValueError("El número de intentos debe ser al menos 1")
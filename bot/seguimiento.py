@@ -1,25 +1,47 @@
 """
 Módulo de seguimiento automático de precios y envío de alertas por Telegram.
 
-Este módulo lanza una tarea asincrónica que comprueba periódicamente
-los precios de acciones o activos seguidos por los usuarios registrados.
+Este módulo lanza una tarea asincrónica que revisa los precios de acciones o
+activos seguidos por los usuarios registrados. Las suscripciones se ordenan por
+su próximo vencimiento en el planificador y el bucle duerme hasta el siguiente.
 Cuando un precio supera los límites definidos, el bot envía una alerta.
 """
 
 import asyncio
 import logging
+import os
+import random
+import time
 from collections import defaultdict
-from datetime import datetime, timedelta
 from typing import Any
 
 from telegram.ext import Application
 
+from bot import alertas
+from bot.cache_precios import cache_precios
 from bot.db_instance import db
-from bot.get_price import fetch_stock_price
+from bot.envios import cola_envios
+from bot.get_price import Cotizacion
+from bot.limitador import limitador_creditos
+from bot.planificador import Suscripcion, planificador
 
 logging.basicConfig(level=logging.INFO)
 
-ultima_revision: dict[tuple[str, str], datetime] = defaultdict(lambda: datetime.min)
+# Espera máxima del bucle aunque no haya nada programado (red de seguridad)
+ESPERA_MAXIMA = 300.0
+
+# Consultas de precios simultáneas en total y con una misma API key
+MAX_CONSULTAS_CONCURRENTES = int(os.getenv("SEGUIMIENTO_MAX_CONCURRENCIA", "20"))
+MAX_CONSULTAS_POR_API_KEY = int(os.getenv("SEGUIMIENTO_MAX_POR_API_KEY", "2"))
+
+# Ventana (segundos) en la que se reparten al arrancar las revisiones atrasadas
+VENTANA_ARRANQUE = float(os.getenv("SEGUIMIENTO_VENTANA_ARRANQUE", "300"))
+
+# Segundos entre purgas del historial de mercado antiguo (ver `DatabaseManager.aplicar_retencion`)
+INTERVALO_RETENCION = float(os.getenv("SEGUIMIENTO_INTERVALO_RETENCION", "3600"))
+
+# API key propia del servicio: si existe, se usa antes que las de los usuarios
+API_KEY_SERVICIO = os.getenv("TWELVEDATA_API_KEY")
 
 type App = Application[Any, Any, Any, Any, Any, Any]
 
@@ -36,76 +58,295 @@ async def lanzar_seguimiento(app: App) -> None:
     app.create_task(comprobar_alertas_periodicamente(app))
 
 
+def vencimiento_al_arrancar(proxima: float | None, intervalo_min: int, ahora: float) -> float:
+    """
+    Calcula cuándo revisar una suscripción tras un arranque.
+
+    Si su próxima revisión guardada aún no ha llegado, se respeta. Si está atrasada (o no
+    hay estado guardado), se programa en un instante aleatorio de la ventana de arranque,
+    sin pasar de su propio intervalo, para no revisar todo a la vez tras un despliegue.
+
+    Args:
+        proxima (float | None): Próxima revisión guardada (epoch) o None si no hay.
+        intervalo_min (int): Minutos entre revisiones de la suscripción.
+        ahora (float): Instante actual (epoch).
+
+    Returns:
+        float: Vencimiento (epoch) con el que se carga en el planificador.
+    """
+    if proxima is not None and proxima > ahora:
+        return proxima
+    return ahora + random.uniform(0, min(VENTANA_ARRANQUE, intervalo_min * 60))
+
+
+def cargar_suscripciones() -> None:
+    """
+    Carga en el planificador todas las suscripciones guardadas con su estado persistido
+    (próxima revisión y estado de alerta).
+
+    Las suscripciones se leen con una sola consulta que ya descarta a los usuarios sin
+    API Key. Solo se llama al arrancar: después `/seguir` y `/dejar` actualizan el planificador.
+    """
+    ahora = planificador.ahora()
+    revisiones = db.obtener_revisiones()
+    estados = db.obtener_estados_alerta()
+    planificador.cargar(
+        Suscripcion(
+            chat_id,
+            symbol,
+            intervalo,
+            nombre,
+            limite_inf,
+            limite_sup,
+            vencimiento_al_arrancar(revisiones.get((chat_id, symbol), (None, None))[1], intervalo, ahora),
+            *estados.get((chat_id, symbol), (alertas.DENTRO, None)),
+        )
+        for chat_id, symbol, intervalo, nombre, limite_inf, limite_sup, _ in db.iterar_suscripciones_activas()
+    )
+    logging.info(f"📋 {len(planificador)} suscripciones cargadas en el planificador.")
+
+
 async def comprobar_alertas_periodicamente(app: App) -> None:
     """
-    Tarea asincrónica que ejecuta el seguimiento de todos los usuarios cada 30 segundos.
+    Tarea asincrónica que revisa las suscripciones a medida que vencen.
 
-    Itera por todos los usuarios registrados, comprueba los precios y envía
-    alertas si es necesario.
+    En cada despertar solo se procesan las suscripciones vencidas; después el bucle
+    duerme hasta el siguiente vencimiento. Las alertas se entregan a través de la cola
+    de envíos, que se arranca aquí, para que el envío no frene las revisiones. Cada
+    `INTERVALO_RETENCION` segundos se purga además el historial de mercado antiguo.
 
     Args:
         app: Instancia de la aplicación de Telegram.
     """
     logging.info("🔁 Iniciando seguimiento automático...")
+    cola_envios.iniciar(app.bot)
+    cargadas = False
+    proxima_retencion = planificador.ahora()
     while True:
         try:
-            usuarios = db.obtener_usuarios()
-            for chat_id in usuarios:
-                await procesar_usuario(app, chat_id)
+            if not cargadas:
+                cargar_suscripciones()
+                cargadas = True
+            await procesar_vencidas(planificador.extraer_vencidas())
         except Exception as e:
             logging.error(f"Error general en el seguimiento: {e}")
-        await asyncio.sleep(30)
+        if planificador.ahora() >= proxima_retencion:
+            proxima_retencion = planificador.ahora() + INTERVALO_RETENCION
+            await aplicar_retencion()
+        await planificador.esperar(ESPERA_MAXIMA)
 
 
-async def procesar_usuario(app: App, chat_id: str) -> None:
+async def aplicar_retencion() -> None:
     """
-    Procesa todos los activos seguidos por un usuario concreto.
+    Purga en un hilo aparte el historial de mercado más antiguo que su retención.
+
+    Los errores se registran y no detienen el seguimiento.
+    """
+    try:
+        await asyncio.to_thread(db.aplicar_retencion)
+    except Exception as e:
+        logging.error(f"Error al aplicar la retención del historial: {e}")
 
-    Comprueba si es momento de revisar un símbolo según su intervalo,
-    consulta el precio, guarda el valor y envía una alerta si es necesario.
+
+def asignar_claves(
+    por_symbol: dict[str, dict[str, Suscripcion]], claves: dict[str, str]
+) -> tuple[dict[str, list[str]], list[str]]:
+    """
+    Elige con qué API key se consulta cada símbolo.
+
+    Entre la clave del servicio (si está configurada) y las de los suscriptores del
+    símbolo que aún tienen créditos diarios, se elige la que más créditos le quedan
+    en el minuto en curso; a igualdad, la del servicio. Así un barrido grande se
+    reparte entre las claves de los suscriptores en lugar de hacer cola tras el
+    límite por minuto de una sola.
 
     Args:
-        app: Instancia de la aplicación de Telegram.
-        chat_id (str): ID del chat del usuario.
+        por_symbol (dict[str, dict[str, Suscripcion]]): Suscripciones vencidas por símbolo y chat_id.
+        claves (dict[str, str]): API key de cada usuario con suscripciones vencidas.
+
+    Returns:
+        tuple[dict[str, list[str]], list[str]]: Símbolos a consultar con cada clave y
+        símbolos aplazados por falta de créditos.
+    """
+    presupuestos: dict[str, dict[str, int]] = {}
+    por_clave: dict[str, list[str]] = {}
+    aplazados: list[str] = []
+
+    for symbol, suscripciones in por_symbol.items():
+        candidatas = [API_KEY_SERVICIO] if API_KEY_SERVICIO else []
+        candidatas += [claves[chat_id] for chat_id in suscripciones]
+        for api_key in candidatas:
+            if api_key not in presupuestos:
+                presupuestos[api_key] = limitador_creditos.restantes(api_key)
+        con_creditos = [api_key for api_key in dict.fromkeys(candidatas) if presupuestos[api_key]["dia"] > 0]
+        if not con_creditos:
+            logging.warning(f"Ninguna API key tiene créditos diarios para {symbol}. Se aplaza.")
+            aplazados.append(symbol)
+            continue
+        # max() se queda con la primera en caso de empate, que es la del servicio. El saldo del
+        # minuto puede quedar negativo: el símbolo esperará al minuto siguiente en la clave menos cargada
+        api_key = max(con_creditos, key=lambda clave: presupuestos[clave]["minuto"])
+        presupuestos[api_key]["minuto"] -= 1
+        presupuestos[api_key]["dia"] -= 1
+        por_clave.setdefault(api_key, []).append(symbol)
+
+    return por_clave, aplazados
+
+
+async def procesar_vencidas(vencidas: list[Suscripcion]) -> None:
     """
+    Revisa las suscripciones vencidas consultando cada símbolo una sola vez.
+
+    Las API keys de todos los usuarios vencidos se leen en una sola consulta. Las
+    suscripciones se agrupan por símbolo, cada símbolo se consulta con una única
+    API key (ver `asignar_claves`) y su precio se reparte entre todos sus suscriptores.
+    Como mucho hay `MAX_CONSULTAS_CONCURRENTES` consultas a la vez y
+    `MAX_CONSULTAS_POR_API_KEY` con una misma clave; el ritmo real de peticiones lo
+    marca el limitador de créditos. Al terminar se registra la duración.
+
+    Args:
+        vencidas (list[Suscripcion]): Suscripciones extraídas del planificador.
+    """
+    if not vencidas:
+        return
+
+    inicio = time.perf_counter()
+    por_symbol: dict[str, dict[str, Suscripcion]] = {}
+    aplazados: set[str] = set()
     try:
-        api_key = db.obtener_api_key(chat_id)
-        if not api_key:
+        claves = db.obtener_api_keys(s.chat_id for s in vencidas)
+        for chat_id in dict.fromkeys(s.chat_id for s in vencidas if s.chat_id not in claves):
             logging.warning(f"Usuario {chat_id} no tiene API Key registrada. Saltando alertas.")
-            return
+        for suscripcion in vencidas:
+            if suscripcion.chat_id in claves:
+                por_symbol.setdefault(suscripcion.symbol, {})[suscripcion.chat_id] = suscripcion
+
+        por_clave, sin_creditos = asignar_claves(por_symbol, claves)
+        aplazados.update(sin_creditos)
+
+        limite_global = asyncio.Semaphore(MAX_CONSULTAS_CONCURRENTES)
+        limites_por_clave: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(MAX_CONSULTAS_POR_API_KEY)
+        )
+
+        async def consultar(api_key: str, symbols: list[str]) -> None:
+            # Primero el turno de la clave: los lotes que esperan a su clave no ocupan plazas globales
+            async with limites_por_clave[api_key], limite_global:
+                try:
+                    precios = await cache_precios.obtener_varias(symbols, api_key, permitir_obsoleto=False)
+                except Exception as e:
+                    logging.error(f"Error al consultar {', '.join(symbols)}: {e}")
+                    return
+            for symbol in symbols:
+                repartir_precio(symbol, precios[symbol], por_symbol[symbol])
+
+        # Cada clave se reparte en lotes que caben en su presupuesto por minuto
+        tamano = max(1, limitador_creditos.por_minuto)
+        await asyncio.gather(
+            *(
+                consultar(api_key, symbols[i : i + tamano])
+                for api_key, symbols in por_clave.items()
+                for i in range(0, len(symbols), tamano)
+            )
+        )
+    except Exception as e:
+        logging.error(f"Error al procesar las suscripciones vencidas: {e}")
+    finally:
+        # Las aplazadas por falta de créditos se reintentan cuanto antes
+        ahora = planificador.ahora()
+        for suscripcion in vencidas:
+            planificador.reprogramar(suscripcion, ahora, retraso=0 if suscripcion.symbol in aplazados else None)
+        guardar_estado(vencidas, ahora)
+
+    duracion = time.perf_counter() - inicio
+    logging.info(
+        f"⏱️ Revisadas {len(vencidas)} suscripciones de {len(por_symbol)} símbolos en {duracion:.2f} s "
+        f"(registro: {planificador.estadisticas()}, caché de usuarios: {db.estadisticas_cache()})."
+    )
+
+
+def guardar_estado(suscripciones: list[Suscripcion], ahora: float) -> None:
+    """
+    Persiste la última y la próxima revisión de las suscripciones recién revisadas.
+
+    Args:
+        suscripciones (list[Suscripcion]): Suscripciones ya reprogramadas.
+        ahora (float): Instante de la revisión (epoch).
+    """
+    try:
+        # Las canceladas durante la revisión ya no tienen estado que guardar
+        db.guardar_revisiones(
+            [(s.chat_id, s.symbol, int(ahora), s.vencimiento) for s in suscripciones if s.clave in planificador]
+        )
+    except Exception as e:
+        logging.error(f"Error al guardar el estado del seguimiento: {e}")
+
 
-        productos = db.obtener_productos(chat_id)
+def repartir_precio(symbol: str, data: Cotizacion, suscripciones: dict[str, Suscripcion]) -> None:
+    """
+    Reparte la cotización de un símbolo entre todos sus suscriptores.
 
-        for symbol, intervalo_min, nombre, limite_inf, limite_sup in productos:
-            clave = (chat_id, symbol)
-            ahora = datetime.now()
+    El precio se guarda una sola vez como precio de mercado, compartido por el historial
+    de todos los suscriptores. Solo se evalúan las suscripciones vencidas que el índice
+    de umbrales da por fuera del rango o con una alerta activa (ver
+    `IndiceUmbrales.por_evaluar`), buscándolas por su chat_id: las que siguen dentro del
+    rango ni se recorren. Para cada una se actualiza el estado de alerta y se encola una
+    alerta solo si el precio acaba de salir del rango o si ha vencido el enfriamiento
+    (ver `bot.alertas`). Los estados que cambian se guardan para sobrevivir a los reinicios.
 
-            if ahora - ultima_revision[clave] < timedelta(minutes=intervalo_min):
-                continue
+    Args:
+        symbol (str): Ticker consultado.
+        data (Cotizacion): Resultado de la consulta.
+        suscripciones (dict[str, Suscripcion]): Suscripciones vencidas de ese símbolo por chat_id.
+    """
+    if data["error"] or data["precio"] is None:
+        logging.warning(f"Error en {symbol}: {data['error']}")
+        return
 
-            ultima_revision[clave] = ahora
+    # Un precio de respaldo (API caída) no se guarda ni dispara alertas
+    if data.get("obsoleto"):
+        return
 
-            data = fetch_stock_price(symbol, api_key)
-            if data["error"] or data["precio"] is None:
-                logging.warning(f"Error en {symbol}: {data['error']}")
-                continue
+    precio_actual = float(data["precio"])
+    try:
+        db.guardar_precio_mercado(symbol, precio_actual)
+    except Exception as e:
+        logging.error(f"Error al guardar el precio de {symbol}: {e}")
 
-            precio_actual = float(data["precio"])
-            db.guardar_precio(chat_id, symbol, precio_actual)
+    ahora = int(planificador.ahora())
+    por_evaluar = planificador.indice.por_evaluar(symbol, precio_actual)
+    # Se recorre el menor de los dos conjuntos y se busca en el otro
+    if len(por_evaluar) < len(suscripciones):
+        afectadas = [s for chat_id in por_evaluar if (s := suscripciones.get(chat_id)) is not None]
+    else:
+        afectadas = [s for chat_id, s in suscripciones.items() if chat_id in por_evaluar]
+    cambiadas: list[Suscripcion] = []
+    for suscripcion in afectadas:
+        chat_id = suscripcion.chat_id
+        previo = (suscripcion.estado_alerta, suscripcion.ultima_alerta)
+        try:
+            estado = alertas.clasificar(precio_actual, suscripcion.limite_inf, suscripcion.limite_sup, previo[0])
+            alertar = alertas.debe_alertar(previo[0], estado, suscripcion.ultima_alerta, ahora)
+            if estado != previo[0]:
+                planificador.cambiar_estado_alerta(suscripcion, estado)
 
-            if not (limite_inf <= precio_actual <= limite_sup):
+            if alertar:
                 mensaje = (
                     f"🚨 *Alerta de precio*\n\n"
-                    f"{nombre} ({symbol})\n"
+                    f"{suscripcion.nombre} ({symbol})\n"
                     f"💰 Precio actual: {precio_actual:.2f}$\n"
-                    f"Fuera del rango: {limite_inf}$ - {limite_sup}$"
+                    f"Fuera del rango: {suscripcion.limite_inf}$ - {suscripcion.limite_sup}$"
                 )
-                try:
-                    await app.bot.send_message(chat_id=chat_id, text=mensaje, parse_mode="Markdown")
-                    logging.info(f"✅ Alerta enviada a {chat_id}")
-                except Exception as e:
-                    logging.error(f"Error al enviar mensaje a {chat_id}: {e}")
+                # Si la cola está llena no se marca como enviada y se reintenta en la siguiente revisión
+                if cola_envios.encolar(chat_id, mensaje):
+                    suscripcion.ultima_alerta = ahora
+        except Exception as e:
+            logging.error(f"Error al procesar {symbol} para {chat_id}: {e}")
+        if (suscripcion.estado_alerta, suscripcion.ultima_alerta) != previo:
+            cambiadas.append(suscripcion)
 
-            await asyncio.sleep(1)
-    except Exception as e:
-        logging.error(f"Error al procesar usuario {chat_id}: {e}")
+    if cambiadas:
+        try:
+            db.guardar_estados_alerta([(s.chat_id, s.symbol, s.estado_alerta, s.ultima_alerta) for s in cambiadas])
+        except Exception as e:
+            logging.error(f"Error al guardar el estado de las alertas de {symbol}: {e}")
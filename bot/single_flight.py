@@ -0,0 +1,122 @@
+"""
+Módulo: single_flight.py
+
+Coalescencia de peticiones concurrentes ("single-flight").
+
+Cuando varias corrutinas piden a la vez el mismo recurso (por ejemplo, el precio de TSLA
+en la apertura del mercado), solo la primera lanza la consulta real; el resto espera a
+esa misma consulta y recibe su resultado o su error.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+
+class SingleFlight[K, V]:
+    """
+    Agrupa las llamadas concurrentes por clave para que cada clave tenga como mucho
+    una consulta en vuelo.
+
+    La consulta se ejecuta en una tarea propia, de modo que si la corrutina que la
+    inició se cancela, el resto de corrutinas que esperan siguen recibiendo el resultado.
+    """
+
+    def __init__(self) -> None:
+        """
+        Inicializa el registro de consultas en vuelo y los contadores.
+        """
+        self._en_vuelo: dict[K, asyncio.Future[V]] = {}
+        self._tareas: set[asyncio.Task[None]] = set()
+        self.ejecuciones = 0
+        self.coalescidas = 0
+
+    def en_vuelo(self) -> int:
+        """
+        Devuelve el número de claves con una consulta en curso.
+
+        Returns:
+            int: Claves en vuelo.
+        """
+        return len(self._en_vuelo)
+
+    async def ejecutar(self, clave: K, funcion: Callable[[], Awaitable[V]]) -> V:
+        """
+        Ejecuta `funcion` para una clave o se une a la ejecución en curso de esa clave.
+
+        Args:
+            clave (K): Clave que identifica el recurso.
+            funcion (Callable[[], Awaitable[V]]): Consulta a realizar si no hay ninguna en vuelo.
+
+        Returns:
+            V: Resultado compartido de la consulta.
+        """
+
+        async def lote(_: list[K]) -> dict[K, V]:
+            return {clave: await funcion()}
+
+        resultados = await self.ejecutar_lote([clave], lote)
+        return resultados[clave]
+
+    async def ejecutar_lote(self, claves: list[K], funcion: Callable[[list[K]], Awaitable[dict[K, V]]]) -> dict[K, V]:
+        """
+        Versión por lotes: las claves ya en vuelo se esperan y el resto se consulta en
+        una única llamada a `funcion`.
+
+        Args:
+            claves (list[K]): Claves solicitadas (se ignoran los duplicados).
+            funcion (Callable[[list[K]], Awaitable[dict[K, V]]]): Consulta por lote que
+                devuelve un resultado por cada clave recibida.
+
+        Returns:
+            dict[K, V]: Resultado por clave.
+        """
+        bucle = asyncio.get_running_loop()
+        futuros: dict[K, asyncio.Future[V]] = {}
+        propias: list[K] = []
+
+        for clave in dict.fromkeys(claves):
+            futuro = self._en_vuelo.get(clave)
+            if futuro is None:
+                futuro = bucle.create_future()
+                # Evita el aviso de "exception was never retrieved" si nadie llega a esperarlo
+                futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self._en_vuelo[clave] = futuro
+                propias.append(clave)
+            else:
+                self.coalescidas += 1
+            futuros[clave] = futuro
+
+        if propias:
+            self.ejecuciones += 1
+            tarea = asyncio.create_task(self._resolver(propias, funcion))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+
+        valores = await asyncio.gather(*(asyncio.shield(f) for f in futuros.values()))
+        return dict(zip(futuros, valores, strict=True))
+
+    async def _resolver(self, claves: list[K], funcion: Callable[[list[K]], Awaitable[dict[K, V]]]) -> None:
+        """
+        Ejecuta la consulta por lote y reparte su resultado (o su error) entre los futuros.
+
+        Args:
+            claves (list[K]): Claves de las que esta llamada es responsable.
+            funcion (Callable[[list[K]], Awaitable[dict[K, V]]]): Consulta por lote.
+        """
+        try:
+            resultados = await funcion(claves)
+        except Exception as e:
+            for clave in claves:
+                self._en_vuelo.pop(clave).set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for clave in claves:
+                self._en_vuelo.pop(clave).cancel()
+            raise
+
+        for clave in claves:
+            futuro = self._en_vuelo.pop(clave)
+            if clave in resultados:
+                futuro.set_result(resultados[clave])
+            else:
+                futuro.set_exception(KeyError(clave))
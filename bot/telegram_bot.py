@@ -8,32 +8,67 @@ consultar precios, exportar historiales, generar gráficos y más.
 Diseñado para integrarse con python-telegram-bot y una base de datos SQLite.
 """
 
-import io
+import asyncio
 
-import pandas as pd
-from telegram import InputFile, Update
+from telegram import InputFile, Message, Update
 from telegram.ext import (
     ContextTypes,
     ConversationHandler,
 )
+from telegram.helpers import escape_markdown
 
+from bot.cache_precios import cache_precios
 from bot.db_instance import db
-from bot.get_price import fetch_stock_price
+from bot.exportacion import Parte, exportar_csv
 from bot.grafico import generar_grafico
 from bot.mensajes_ayuda import get_commands_text, get_help_text
+from bot.planificador import planificador
 
 PEDIR_API_KEY = 1
 
 # ==================== EXPORTAR HISTORIAL CSV (todo o por ticker) ====================
 
+# Argumentos que piden la exportación comprimida
+_ARGS_GZIP = {"GZ", "GZIP"}
+
+
+async def _enviar_partes(mensaje: Message, partes: list[Parte], caption: str) -> None:
+    """
+    Envía al usuario los ficheros de una exportación y los cierra.
+
+    Los ficheros se suben desde el disco sin leerlos enteros en memoria. Si la exportación
+    se ha repartido en varias partes, cada una lleva su número en el pie.
+
+    Args:
+        mensaje (telegram.Message): Mensaje al que se responde.
+        partes (list[Parte]): Ficheros generados por `exportar_csv()`.
+        caption (str): Pie de los documentos.
+
+    Returns:
+        None
+    """
+    try:
+        for numero, (nombre, fichero) in enumerate(partes, 1):
+            await mensaje.reply_document(
+                document=InputFile(fichero, filename=nombre, read_file_handle=False),
+                filename=nombre,
+                caption=caption if len(partes) == 1 else f"{caption} (parte {numero} de {len(partes)})",
+            )
+    finally:
+        for _, fichero in partes:
+            fichero.close()
+
 
 async def exportar_historial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Exporta el historial de precios del usuario a un archivo CSV.
 
+    El historial se recorre por páginas y se escribe en un hilo aparte, sin cargarlo en
+    memoria. Con el argumento `gz` el archivo se envía comprimido.
+
     Args:
         update (telegram.Update): Contiene el mensaje recibido.
-        context (telegram.ext.CallbackContext): Contexto con argumentos opcionales.
+        context (telegram.ext.CallbackContext): Contexto con el ticker y `gz` opcionales.
 
     Returns:
         None
@@ -44,31 +79,32 @@ async def exportar_historial(update: Update, context: ContextTypes.DEFAULT_TYPE)
     chat_id = str(update.effective_user.id)
     # Compatibilidad con tests: asegúrate de que context.args siempre es lista
     args = list(context.args) if hasattr(context, "args") and isinstance(context.args, list | tuple) else []
-    ticker = args[0].strip().upper() if args else None
-
-    # Obtiene historial (todo o filtrado)
-    historial = db.obtener_historial_usuario(chat_id, ticker)
+    args = [arg.strip().upper() for arg in args]
+    comprimir = any(arg in _ARGS_GZIP for arg in args)
+    tickers = [arg for arg in args if arg not in _ARGS_GZIP]
+    ticker = tickers[0] if tickers else None
+
+    nombre_archivo = f"historial_{ticker}" if ticker else "historial"
+    total, partes = await asyncio.to_thread(
+        exportar_csv,
+        db.iterar_historial_usuario(chat_id, ticker),
+        ("Símbolo", "Precio", "Fecha"),
+        nombre_archivo,
+        comprimir,
+    )
 
     # Si no hay historial, envía mensaje adecuado según si se filtró por ticker
-    if not historial:
+    if not total:
         if ticker:
             await update.message.reply_text(f"No tienes historial guardado para {ticker}.")
         else:
             await update.message.reply_text("No tienes historial de precios aún.")
         return
 
-    # Prepara el archivo CSV en memoria
-    nombre_archivo = f"historial_{ticker}.csv" if ticker else "historial.csv"
-    df = pd.DataFrame(historial)
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
-
-    # Envía el archivo CSV al usuario
-    await update.message.reply_document(
-        document=InputFile(io.BytesIO(buffer.getvalue().encode()), filename=nombre_archivo),
-        filename=nombre_archivo,
-        caption=f"Aquí tienes tu historial {'de ' + ticker if ticker else 'completo'} en formato CSV.",
+    await _enviar_partes(
+        update.message,
+        partes,
+        f"Aquí tienes tu historial {'de ' + ticker if ticker else 'completo'} en formato CSV.",
     )
 
 
@@ -96,17 +132,13 @@ async def exportar_favoritas(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("No estás siguiendo ninguna acción aún.")
         return
 
-    # Prepara y envía el archivo CSV
-    df = pd.DataFrame(favoritas)
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False)
-    buffer.seek(0)
-
-    await update.message.reply_document(
-        document=InputFile(io.BytesIO(buffer.getvalue().encode()), filename="favoritas.csv"),
-        filename="favoritas.csv",
-        caption="Aquí tienes tu lista de acciones favoritas en formato CSV.",
+    _, partes = await asyncio.to_thread(
+        exportar_csv,
+        (list(favorita.values()) for favorita in favoritas),
+        list(favoritas[0]),
+        "favoritas",
     )
+    await _enviar_partes(update.message, partes, "Aquí tienes tu lista de acciones favoritas en formato CSV.")
 
 
 # ==================== PETICIÓN Y GESTIÓN DE API KEY ====================
@@ -274,7 +306,7 @@ async def seguir(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await pedir_api_key(update, context)
         return
 
-    data = fetch_stock_price(ticker, api_key)
+    data = await cache_precios.obtener(ticker, api_key)
     if data["error"] or data["nombre"] is None:
         await update.message.reply_text(f"No se pudo seguir '{ticker}': {data['error'] or 'Error desconocido'}")
         return
@@ -283,6 +315,7 @@ async def seguir(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     assert isinstance(nombre_empresa, str), "Nombre de empresa no válido"
 
     db.agregar_producto(chat_id, ticker, nombre_empresa, intervalo, limite_inf, limite_sup)
+    planificador.programar(chat_id, ticker, intervalo, nombre_empresa, limite_inf, limite_sup)
 
     await update.message.reply_text(
         f"✅ Ahora estás siguiendo {data['nombre']} ({ticker}) cada {intervalo} minutos.\n"
@@ -324,7 +357,9 @@ async def favoritas(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Consulta y muestra el precio actual de un activo financiero.
+    Consulta y muestra el precio actual de uno o varios activos financieros.
+
+    Si se indican varios tickers, se consultan todos en una única petición por lote.
 
     Args:
         update (telegram.Update): Contiene el comando /price recibido.
@@ -341,25 +376,31 @@ async def price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Uso correcto: /price <TICKER>")
         return
 
-    ticker = context.args[0].strip().upper()
+    tickers = list(dict.fromkeys(arg.strip().upper() for arg in context.args))
     chat_id = str(update.effective_user.id)
     api_key = db.obtener_api_key(chat_id)
     if not api_key:
         await pedir_api_key(update, context)
         return
 
-    data = fetch_stock_price(ticker, api_key)
-    if data["error"]:
-        await update.message.reply_text(f"No se pudo obtener el precio de '{ticker}': {data['error']}")
+    precios = await cache_precios.obtener_varias(tickers, api_key)
+
+    if len(tickers) == 1 and precios[tickers[0]]["error"]:
+        await update.message.reply_text(f"No se pudo obtener el precio de '{tickers[0]}': {precios[tickers[0]]['error']}")
         return
 
-    nombre = data["nombre"]
-    precio = data["precio"]
+    lineas = []
+    for ticker in tickers:
+        data = precios[ticker]
+        if data["error"]:
+            lineas.append(f"❌ No se pudo obtener el precio de '{ticker}': {escape_markdown(str(data['error']))}")
+        else:
+            linea = f"📈 *{data['nombre']}* ({ticker})\n💰 Precio actual: {data['precio']:.2f}$"
+            if data.get("obsoleto"):
+                linea += "\n⏳ Último precio conocido, puede no estar actualizado."
+            lineas.append(linea)
 
-    await update.message.reply_text(
-        f"📈 *{nombre}* ({ticker})\n💰 Precio actual: {precio:.2f}$",
-        parse_mode="Markdown",
-    )
+    await update.message.reply_text("\n\n".join(lineas), parse_mode="Markdown")
 
 
 async def guardar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -387,11 +428,16 @@ async def guardar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await pedir_api_key(update, context)
         return
 
-    data = fetch_stock_price(ticker, api_key)
+    # Al guardar en el historial solo vale un precio actualizado
+    data = await cache_precios.obtener(ticker, api_key, permitir_obsoleto=False)
     if data["error"]:
         await update.message.reply_text(f"No se pudo obtener el precio de '{ticker}': {data['error']}")
         return
 
+    if data.get("obsoleto"):
+        await update.message.reply_text(f"No se pudo obtener un precio actualizado de '{ticker}'. Inténtalo más tarde.")
+        return
+
     precio = data["precio"]
     nombre = data["nombre"]
 
@@ -435,7 +481,7 @@ async def historial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await pedir_api_key(update, context)
         return
 
-    data = fetch_stock_price(ticker, api_key)
+    data = await cache_precios.obtener(ticker, api_key)
     if data["error"]:
         await update.message.reply_text(f"Ticker '{ticker}' no válido o no disponible: {data['error']}")
         return
@@ -506,14 +552,12 @@ async def dejar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     ticker = context.args[0].strip().upper()
     chat_id = str(update.effective_user.id)
-    productos = db.obtener_productos(chat_id)
-    seguidos = [p[0] for p in productos]
-
-    if ticker not in seguidos:
+    if ticker not in db.obtener_simbolos_seguidos(chat_id):
         await update.message.reply_text(f"No estás siguiendo '{ticker}'.")
         return
 
     db.eliminar_producto(chat_id, ticker)
+    planificador.cancelar(chat_id, ticker)
     await update.message.reply_text(f"🗑️ Has dejado de seguir {ticker}.")
 
 
@@ -554,7 +598,7 @@ async def grafico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def media_historial(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Calcula y muestra estadísticas básicas (mínimo, máximo, media) del historial de precios.
+    Muestra estadísticas básicas (mínimo, máximo, media y desviación típica) del historial de precios.
 
     Args:
         update (telegram.Update): Contiene el mensaje del usuario.
@@ -565,7 +609,7 @@ async def media_historial(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     if update.effective_user is None or update.message is None:
         return
-    
+
     if not isinstance(context.args, list) or len(context.args) != 1:
         await update.message.reply_text("Uso correcto: /media <TICKER>\nEjemplo: /media AAPL")
         return
@@ -584,19 +628,19 @@ async def media_historial(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text(f"No tienes historial guardado para {ticker}.")
             return
 
-        minimo, maximo, media = resultado
+        minimo, maximo, media, desviacion = resultado
 
         minimo = round(minimo, 2)
         maximo = round(maximo, 2)
         media = round(media, 2)
-
-        print(f"Estadísticas de {ticker}: min={minimo}, max={maximo}, media={media}")
+        desviacion = round(desviacion, 2)
 
         await update.message.reply_text(
             f"📊 Estadísticas de {ticker} en tu historial:\n\n"
             f"🔻 Mínimo: {minimo} €\n"
             f"🔺 Máximo: {maximo} €\n"
-            f"📈 Media: {media} €"
+            f"📈 Media: {media} €\n"
+            f"📏 Desviación típica: {desviacion} €"
         )
 
     except Exception as e:
@@ -0,0 +1,174 @@
+"""
+Módulo: velas.py
+
+Resoluciones del historial de precios de mercado.
+
+Cada precio que guarda el seguimiento se acumula, con un trigger (ver `bot.migraciones`),
+en velas OHLC de 1 minuto, 1 hora y 1 día: apertura, máximo, mínimo, cierre, número de
+precios y su suma. Los precios sueltos (nivel `TICKS`) y las velas de minuto se purgan
+pasado su tiempo de retención; las de hora y día se conservan siempre.
+
+`tramos()` reparte un intervalo entre los niveles: las velas de día que caben enteras,
+las de hora y de minuto que quedan en los extremos y, en los bordes, los precios
+sueltos. Así unas estadísticas de meses leen unas decenas de filas en lugar de cientos
+de miles, con el mismo resultado. Si un tramo cae antes de la retención de su nivel se
+sustituye por las velas del nivel superior que lo contienen, y en ese borde el resultado
+pasa a ser aproximado.
+"""
+
+import calendar
+import time
+
+# Nivel de los precios sueltos; el resto son los segundos que abarca cada vela
+TICKS = 0
+MINUTO = 60
+HORA = 3600
+DIA = 86400
+NIVELES = (TICKS, MINUTO, HORA, DIA)
+
+# Mismo formato que CURRENT_TIMESTAMP de SQLite (UTC)
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+# (nivel, desde, hasta): filas del nivel cuyo instante (o inicio de vela) está en [desde, hasta)
+type Tramo = tuple[int, int, int]
+
+
+def a_segundos(fecha: str) -> int:
+    """
+    Convierte una fecha de la base de datos (UTC) en segundos epoch.
+    """
+    return calendar.timegm(time.strptime(fecha, FORMATO_FECHA))
+
+
+def a_fecha(segundos: int) -> str:
+    """
+    Convierte segundos epoch en una fecha con el formato de la base de datos (UTC).
+    """
+    return time.strftime(FORMATO_FECHA, time.gmtime(segundos))
+
+
+def inicio_vela(segundos: int, nivel: int) -> int:
+    """
+    Devuelve el inicio de la vela del nivel que contiene un instante.
+
+    Args:
+        segundos (int): Instante epoch.
+        nivel (int): Nivel de la vela (`TICKS` devuelve el propio instante).
+
+    Returns:
+        int: Inicio de la vela en segundos epoch.
+    """
+    return segundos - segundos % nivel if nivel else segundos
+
+
+def cortes_retencion(ahora: int, retencion: dict[int, float]) -> dict[int, int]:
+    """
+    Calcula desde qué instante se conservan los datos de cada nivel con retención.
+
+    Los cortes se alinean al inicio del día y un nivel nunca conserva más que el
+    superior: así, al sustituir un tramo purgado por velas del nivel superior, estas
+    no se solapan con los tramos que siguen disponibles.
+
+    Args:
+        ahora (int): Instante actual en segundos epoch.
+        retencion (dict[int, float]): Días que se conserva cada nivel (los que no aparecen, siempre).
+
+    Returns:
+        dict[int, int]: Instante de corte por nivel.
+    """
+    resultado: dict[int, int] = {}
+    anterior: int | None = None
+    for nivel in reversed(NIVELES):
+        dias = retencion.get(nivel)
+        corte = None if dias is None else inicio_vela(ahora - int(dias * DIA), DIA)
+        if anterior is not None:
+            corte = anterior if corte is None else max(corte, anterior)
+        if corte is not None:
+            resultado[nivel] = anterior = corte
+    return resultado
+
+
+def tramos(
+    intervalos: list[tuple[int, int]],
+    maxima: int = DIA,
+    minima: int = TICKS,
+    cortes: dict[int, int] | None = None,
+) -> list[Tramo]:
+    """
+    Reparte unos intervalos de tiempo entre los niveles del historial.
+
+    En cada intervalo se usan las velas más gruesas que caben enteras y los niveles más
+    finos solo para los extremos. Los bordes que no llenan una vela del nivel `minima`
+    se leen con la vela que los contiene.
+
+    Args:
+        intervalos (list[tuple[int, int]]): Intervalos [desde, hasta) en segundos epoch, sin solapes.
+        maxima (int, optional): Nivel más grueso que se usa. Default `DIA`.
+        minima (int, optional): Nivel más fino que se usa. Default `TICKS`.
+        cortes (dict[int, int] | None, optional): Instante por nivel antes del cual ya no hay
+            datos (ver `cortes_retencion()`).
+
+    Returns:
+        list[Tramo]: Tramos sin solapes, ordenados por su inicio.
+    """
+    niveles = [nivel for nivel in reversed(NIVELES) if minima <= nivel <= maxima]
+    repartidos = [tramo for desde, hasta in intervalos for tramo in _repartir(desde, hasta, niveles)]
+    return _fusionar([parte for tramo in repartidos for parte in _disponibles(tramo, cortes or {})])
+
+
+def elegir_nivel(duracion: int, max_puntos: int) -> int:
+    """
+    Devuelve el nivel de vela más fino con el que un intervalo cabe en `max_puntos` puntos.
+
+    Args:
+        duracion (int): Segundos que abarca el intervalo.
+        max_puntos (int): Número máximo de velas.
+
+    Returns:
+        int: `MINUTO`, `HORA` o `DIA`.
+    """
+    for nivel in (MINUTO, HORA):
+        if duracion <= nivel * max_puntos:
+            return nivel
+    return DIA
+
+
+def _repartir(desde: int, hasta: int, niveles: list[int]) -> list[Tramo]:
+    if desde >= hasta:
+        return []
+    nivel, *finos = niveles
+    if not finos:
+        return [(nivel, inicio_vela(desde, nivel), hasta)]
+    primera = -(-desde // nivel) * nivel
+    ultima = inicio_vela(hasta, nivel)
+    if primera >= ultima:
+        return _repartir(desde, hasta, finos)
+    return [*_repartir(desde, primera, finos), (nivel, primera, ultima), *_repartir(ultima, hasta, finos)]
+
+
+def _disponibles(tramo: Tramo, cortes: dict[int, int]) -> list[Tramo]:
+    """
+    Sustituye la parte de un tramo anterior al corte de su nivel por velas del nivel superior.
+    """
+    nivel, desde, hasta = tramo
+    corte = cortes.get(nivel)
+    if corte is None or desde >= corte or nivel == DIA:
+        return [tramo]
+    superior = NIVELES[NIVELES.index(nivel) + 1]
+    partes = _disponibles((superior, inicio_vela(desde, superior), min(hasta, corte)), cortes)
+    if hasta > corte:
+        partes.append((nivel, corte, hasta))
+    return partes
+
+
+def _fusionar(tramos: list[Tramo]) -> list[Tramo]:
+    """
+    Une los tramos del mismo nivel que se solapan o se tocan.
+    """
+    fusionados: list[Tramo] = []
+    for nivel, desde, hasta in sorted(tramos):
+        if fusionados and fusionados[-1][0] == nivel and desde <= fusionados[-1][2]:
+            fusionados[-1] = (nivel, fusionados[-1][1], max(hasta, fusionados[-1][2]))
+        else:
+            fusionados.append((nivel, desde, hasta))
+    return sorted(fusionados, key=lambda tramo: (tramo[1], tramo[0]))
@@ -1,5 +1,6 @@
 import asyncio
 import os
+import sys
 from typing import Any
 
 from dotenv import load_dotenv
@@ -11,6 +12,9 @@ from telegram.ext import (
     filters,
 )
 
+from bot.db_instance import db
+from bot.envios import cola_envios
+from bot.get_price import cerrar_sesion
 from bot.seguimiento import comprobar_alertas_periodicamente
 from bot.telegram_bot import (
     PEDIR_API_KEY,
@@ -57,6 +61,9 @@ def prueba_telegram_bot() -> None:
                 await seguimiento_task
             except asyncio.CancelledError:
                 print("🛑 Tarea de seguimiento detenida correctamente.")
+        await cola_envios.detener()
+        await cerrar_sesion()
+        db.cerrar()
 
     app = Application.builder().token(TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
 
@@ -91,6 +98,11 @@ def prueba_telegram_bot() -> None:
 
 
 def main() -> None:
+    # `python main.py reconstruir_estadisticas` recalcula las estadísticas de las capturas y sale
+    if sys.argv[1:] == ["reconstruir_estadisticas"]:
+        print(f"📊 Estadísticas reconstruidas: {db.reconstruir_estadisticas()} filas.")
+        db.cerrar()
+        return
     prueba_telegram_bot()
 
 
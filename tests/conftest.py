@@ -0,0 +1,16 @@
+import pytest
+
+
+class Reloj:
+    """Reloj falso: devuelve `t`, que cada test avanza a mano."""
+
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def reloj():
+    return Reloj()
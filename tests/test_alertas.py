@@ -0,0 +1,37 @@
+import pytest
+
+from bot.alertas import BAJO, DENTRO, SOBRE, clasificar, debe_alertar
+
+
+@pytest.fixture(autouse=True)
+def configuracion(monkeypatch):
+    monkeypatch.setattr("bot.alertas.HISTERESIS", 0.1)
+    monkeypatch.setattr("bot.alertas.ENFRIAMIENTO", 600)
+
+
+@pytest.mark.parametrize(
+    ("precio", "previo", "esperado"),
+    [
+        (150.0, DENTRO, DENTRO),
+        (99.0, DENTRO, BAJO),
+        (201.0, DENTRO, SOBRE),
+        (105.0, BAJO, BAJO),  # Dentro del rango pero en la banda de histéresis
+        (110.0, BAJO, DENTRO),
+        (185.0, SOBRE, SOBRE),
+        (180.0, SOBRE, DENTRO),
+        (201.0, BAJO, SOBRE),
+        (105.0, DENTRO, DENTRO),
+    ],
+)
+def test_clasificar(precio, previo, esperado):
+    assert clasificar(precio, 100.0, 200.0, previo) == esperado
+
+
+def test_debe_alertar_solo_en_transiciones_o_tras_el_enfriamiento():
+    assert debe_alertar(DENTRO, BAJO, None, 1000)
+    assert debe_alertar(BAJO, SOBRE, 990, 1000)
+    assert not debe_alertar(BAJO, DENTRO, None, 1000)
+    assert not debe_alertar(BAJO, BAJO, 900, 1000)
+    assert debe_alertar(BAJO, BAJO, 400, 1000)
+    # Sigue fuera pero la alerta anterior no llegó a enviarse
+    assert debe_alertar(BAJO, BAJO, None, 1000)
@@ -0,0 +1,105 @@
+import threading
+
+from bot.cache_lru import CacheLRU
+
+
+def test_carga_una_vez_y_despues_acierta():
+    cache = CacheLRU[str, int](max_entradas=10)
+    cargas = []
+
+    def cargar():
+        cargas.append(1)
+        return 42
+
+    assert cache.obtener("a", cargar) == 42
+    assert cache.obtener("a", cargar) == 42
+
+    assert len(cargas) == 1
+    assert cache.estadisticas() == {
+        "aciertos": 1,
+        "fallos": 1,
+        "tasa_aciertos": 0.5,
+        "desalojos": 0,
+        "invalidaciones": 0,
+        "entradas": 1,
+    }
+
+
+def test_guarda_tambien_los_valores_vacios():
+    cache = CacheLRU[str, str | None]()
+
+    assert cache.obtener("a", lambda: None) is None
+    assert cache.consultar("a") == (True, None)
+
+
+def test_desaloja_la_menos_usada():
+    cache = CacheLRU[str, int](max_entradas=2)
+    cache.obtener("a", lambda: 1)
+    cache.obtener("b", lambda: 2)
+    cache.obtener("a", lambda: 0)  # "a" pasa a ser la más reciente
+
+    cache.obtener("c", lambda: 3)
+
+    assert cache.consultar("b") == (False, None)
+    assert cache.consultar("a") == (True, 1)
+    assert cache.estadisticas()["desalojos"] == 1
+
+
+def test_invalidar_obliga_a_recargar():
+    cache = CacheLRU[str, int]()
+    cache.obtener("a", lambda: 1)
+
+    cache.invalidar("a")
+
+    assert cache.obtener("a", lambda: 2) == 2
+    assert cache.estadisticas()["invalidaciones"] == 1
+
+
+def test_una_carga_anterior_a_la_invalidacion_no_se_guarda():
+    cache = CacheLRU[str, int]()
+    leyendo, escrito = threading.Event(), threading.Event()
+
+    def cargar_valor_anterior():
+        leyendo.set()
+        escrito.wait(1)
+        return 1
+
+    hilo = threading.Thread(target=cache.obtener, args=("a", cargar_valor_anterior))
+    hilo.start()
+    leyendo.wait(1)
+    cache.invalidar("a")  # Otro hilo escribe el valor 2 mientras se leía el 1
+    escrito.set()
+    hilo.join()
+
+    assert cache.obtener("a", lambda: 2) == 2
+
+
+def test_guardar_respeta_la_generacion():
+    cache = CacheLRU[str, int]()
+    generacion = cache.generacion()
+    cache.invalidar("otra")
+
+    cache.guardar("a", 1, generacion)
+    cache.guardar("b", 2, cache.generacion())
+
+    assert cache.consultar("a") == (False, None)
+    assert cache.consultar("b") == (True, 2)
+
+
+def test_sin_entradas_no_guarda_nada():
+    cache = CacheLRU[str, int](max_entradas=0)
+
+    cache.obtener("a", lambda: 1)
+
+    assert len(cache) == 0
+
+
+def test_limpiar_reinicia_los_contadores():
+    cache = CacheLRU[str, int]()
+    cache.obtener("a", lambda: 1)
+
+    cache.limpiar()
+
+    assert len(cache) == 0
+    assert cache.estadisticas()["fallos"] == 0
+    assert cache.estadisticas()["tasa_aciertos"] == 0.0
@@ -0,0 +1,155 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from bot.cache_precios import CachePrecios
+
+
+def ok(precio, nombre="Empresa"):
+    return {"precio": precio, "nombre": nombre, "error": None}
+
+
+def error(mensaje="API caída"):
+    return {"precio": None, "nombre": None, "error": mensaje}
+
+
+@pytest.mark.asyncio
+async def test_acierto_fresco_no_consulta_api(monkeypatch, reloj):
+    cache = CachePrecios(ttl=60, reloj=reloj)
+    mock_fetch = AsyncMock(return_value={"AAPL": ok(150.0)})
+    monkeypatch.setattr("bot.cache_precios.fetch_stock_prices", mock_fetch)
+
+    primero = await cache.obtener("AAPL", "k")
+    reloj.t += 30
+    segundo = await cache.obtener("AAPL", "otra_clave")
+
+    assert primero == {**ok(150.0), "obsoleto": False}
+    assert segundo == primero
+    mock_fetch.assert_awaited_once_with(["AAPL"], "k")
+    assert cache.estadisticas()["aciertos"] == 1
+    assert cache.estadisticas()["fallos"] == 1
+
+
+@pytest.mark.asyncio
+async def test_obsoleto_se_sirve_y_se_refresca_en_segundo_plano(monkeypatch, reloj):
+    cache = CachePrecios(ttl=60, max_obsoleto=600, reloj=reloj)
+    cache.guardar("AAPL", ok(150.0))
+    reloj.t += 120
+
+    mock_fetch = AsyncMock(return_value={"AAPL": ok(155.0)})
+    monkeypatch.setattr("bot.cache_precios.fetch_stock_prices", mock_fetch)
+
+    resultado = await cache.obtener("AAPL", "k")
+    assert resultado["precio"] == 150.0
+    assert resultado["obsoleto"] is True
+
+    # Espera a que termine el refresco en segundo plano
+    await asyncio.gather(*cache._tareas)
+
+    mock_fetch.assert_awaited_once_with(["AAPL"], "k")
+    refrescado = await cache.obtener("AAPL", "k")
+    assert refrescado == {**ok(155.0), "obsoleto": False}
+    assert cache.estadisticas()["aciertos_obsoletos"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sin_permitir_obsoleto_consulta_de_nuevo(monkeypatch, reloj):
+    cache = CachePrecios(ttl=60, max_obsoleto=600, reloj=reloj)
+    cache.guardar("AAPL", ok(150.0))
+    reloj.t += 120
+    monkeypatch.setattr("bot.cache_precios.fetch_stock_prices", AsyncMock(return_value={"AAPL": ok(151.0)}))
+
+    resultado = await cache.obtener("AAPL", "k", permitir_obsoleto=False)
+
+    assert resultado == {**ok(151.0), "obsoleto": False}
+
+
+@pytest.mark.asyncio
+async def test_api_caida_sirve_ultimo_precio_conocido(monkeypatch, reloj):
+    cache = CachePrecios(ttl=60, max_obsoleto=60, reloj=reloj)
+    cache.guardar("AAPL", ok(150.0))
+    reloj.t += 10_000
+    monkeypatch.setattr(
+        "bot.cache_precios.fetch_stock_prices",
+        AsyncMock(return_value={"AAPL": error(), "MSFT": error("symbol not found")}),
+    )
+
+    resultados = await cache.obtener_varias(["AAPL", "MSFT"], "k")
+
+    assert resultados["AAPL"] == {**ok(150.0), "obsoleto": True}
+    assert resultados["MSFT"]["error"] == "symbol not found"
+    assert cache.estadisticas()["respaldos"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fallos_se_agrupan_en_una_consulta(monkeypatch, reloj):
+    cache = CachePrecios(ttl=60, reloj=reloj)
+    cache.guardar("AAPL", ok(150.0))
+    mock_fetch = AsyncMock(return_value={"MSFT": ok(400.0), "TSLA": ok(200.0)})
+    monkeypatch.setattr("bot.cache_precios.fetch_stock_prices", mock_fetch)
+
+    resultados = await cache.obtener_varias(["AAPL", "MSFT", "TSLA", "MSFT"], "k")
+
+    mock_fetch.assert_awaited_once_with(["MSFT", "TSLA"], "k")
+    assert set(resultados) == {"AAPL", "MSFT", "TSLA"}
+
+
+def test_desalojo_lru(reloj):
+    cache = CachePrecios(max_entradas=2, reloj=reloj)
+    cache.guardar("A", ok(1.0))
+    cache.guardar("B", ok(2.0))
+    # Se usa A para que B pase a ser la menos reciente
+    cache._entradas.move_to_end("A")
+    cache.guardar("C", ok(3.0))
+
+    assert len(cache) == 2
+    assert "B" not in cache._entradas
+    assert cache.estadisticas()["desalojos"] == 1
+
+    cache.limpiar()
+    assert cache.estadisticas() == {
+        "aciertos": 0,
+        "aciertos_obsoletos": 0,
+        "fallos": 0,
+        "desalojos": 0,
+        "respaldos": 0,
+        "coalescidas": 0,
+        "entradas": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_consultas_concurrentes_comparten_una_peticion(monkeypatch, reloj):
+    cache = CachePrecios(reloj=reloj)
+    llamadas = []
+
+    async def fake_fetch(symbols, api_key):
+        llamadas.append(list(symbols))
+        await asyncio.sleep(0.01)
+        return {s: ok(100.0, s) for s in symbols}
+
+    monkeypatch.setattr("bot.cache_precios.fetch_stock_prices", fake_fetch)
+
+    resultados = await asyncio.gather(*(cache.obtener("TSLA", "k") for _ in range(20)))
+
+    assert llamadas == [["TSLA"]]
+    assert all(r["precio"] == 100.0 for r in resultados)
+    assert cache.estadisticas()["coalescidas"] == 19
+
+
+@pytest.mark.asyncio
+async def test_consultas_concurrentes_con_otra_clave_no_comparten_el_error(monkeypatch, reloj):
+    cache = CachePrecios(reloj=reloj)
+
+    async def fake_fetch(symbols, api_key):
+        await asyncio.sleep(0.01)
+        if api_key == "MALA":
+            return {s: error("apikey parameter is incorrect") for s in symbols}
+        return {s: ok(100.0, s) for s in symbols}
+
+    monkeypatch.setattr("bot.cache_precios.fetch_stock_prices", fake_fetch)
+
+    _, buena = await asyncio.gather(cache.obtener("AAPL", "MALA"), cache.obtener("AAPL", "BUENA"))
+
+    assert buena == {**ok(100.0, "AAPL"), "obsoleto": False}
@@ -1,11 +1,17 @@
+import itertools
+import math
+import re
 import sqlite3
+import statistics
 import time
 
 import pytest
 from hypothesis import HealthCheck, given, settings
 from hypothesis.strategies import characters, text
 
+from bot import velas
 from bot.db_manager import DatabaseManager
+from bot.migraciones import MIGRACIONES, migrar
 
 letras_numeros = characters(whitelist_categories=("Ll", "Lu", "Nd"))
 
@@ -22,14 +28,25 @@ def db_temp():
 
 
 def test_tablas_creadas(db_temp):
-    tablas_esperadas = {"usuarios", "productos_seguidos", "historial_precios"}
+    tablas_esperadas = {
+        "usuarios",
+        "productos_seguidos",
+        "precios_mercado",
+        "capturas_manuales",
+        "periodos_seguimiento",
+        "estado_seguimiento",
+        "estado_alertas",
+    }
 
     with db_temp._conectar() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tablas_creadas = {fila[0] for fila in cursor.fetchall()}
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='view';")
+        vistas_creadas = {fila[0] for fila in cursor.fetchall()}
 
     assert tablas_esperadas.issubset(tablas_creadas)
+    assert "historial_precios" in vistas_creadas
 
 
 @settings(suppress_health_check=[HealthCheck.function_scoped_fixture])
@@ -131,6 +148,7 @@ def test_guardar_precio_inserta_entrada_correcta(db_temp):
     precio = 150.25
 
     db_temp.guardar_precio(chat_id, symbol, precio)
+    db_temp.volcar_precios()
 
     with db_temp._conectar() as conn:
         cursor = conn.cursor()
@@ -157,6 +175,7 @@ def test_guardar_precio_permite_multiples_registros(db_temp):
 
     for precio in precios:
         db_temp.guardar_precio(chat_id, symbol, precio)
+    db_temp.volcar_precios()
 
     with db_temp._conectar() as conn:
         cursor = conn.cursor()
@@ -209,11 +228,12 @@ def test_obtener_estadisticas_calcula_min_max_avg(db_temp):
     for precio in precios:
         db_temp.guardar_precio(chat_id, symbol, precio)
 
-    minimo, maximo, media = db_temp.obtener_estadisticas(chat_id, symbol)
+    minimo, maximo, media, desviacion = db_temp.obtener_estadisticas(chat_id, symbol)
 
     assert minimo == min(precios)
     assert maximo == max(precios)
     assert round(media, 2) == round(sum(precios) / len(precios), 2)
+    assert desviacion == pytest.approx(statistics.pstdev(precios))
 
 
 def test_obtener_estadisticas_sin_datos_retorna_none(db_temp):
@@ -222,7 +242,7 @@ def test_obtener_estadisticas_sin_datos_retorna_none(db_temp):
 
     resultado = db_temp.obtener_estadisticas(chat_id, symbol)
 
-    assert resultado == (None, None, None)
+    assert resultado is None
 
 
 def test_obtener_limites_devuelve_valores_correctos(db_temp):
@@ -378,3 +398,653 @@ def test_obtener_historial_usuario_filtrado_por_ticker(db_temp):
     assert all(item["Símbolo"] == "AAPL" for item in historial_aapl)
     assert all("Precio" in item and "Fecha" in item for item in historial_aapl)
     assert len(historial_aapl) == 1  # Solo hay un AAPL
+
+
+def test_guardar_y_obtener_revisiones(db_temp):
+    db_temp.guardar_revisiones([("1", "AAPL", 100.0, 400.0), ("2", "MSFT", None, 500.0)])
+    db_temp.guardar_revisiones([("1", "AAPL", 400.0, 700.0)])
+
+    assert db_temp.obtener_revisiones() == {("1", "AAPL"): (400.0, 700.0), ("2", "MSFT"): (None, 500.0)}
+
+
+def test_eliminar_producto_borra_su_estado_de_seguimiento(db_temp):
+    db_temp.agregar_producto("1", "AAPL", "Apple")
+    db_temp.guardar_revisiones([("1", "AAPL", 100.0, 400.0), ("1", "MSFT", 100.0, 400.0)])
+
+    db_temp.eliminar_producto("1", "AAPL")
+
+    assert list(db_temp.obtener_revisiones()) == [("1", "MSFT")]
+
+
+def test_guardar_y_obtener_estados_alerta(db_temp):
+    db_temp.guardar_estados_alerta([("1", "AAPL", "bajo", 100), ("2", "MSFT", "dentro", None)])
+    db_temp.guardar_estados_alerta([("1", "AAPL", "sobre", 200)])
+
+    assert db_temp.obtener_estados_alerta() == {("1", "AAPL"): ("sobre", 200), ("2", "MSFT"): ("dentro", None)}
+
+    db_temp.eliminar_producto("1", "AAPL")
+    assert list(db_temp.obtener_estados_alerta()) == [("2", "MSFT")]
+
+
+def test_cambiar_los_limites_reinicia_el_estado_de_alerta(db_temp):
+    db_temp.agregar_producto("1", "AAPL", "Apple", limite_inf=100, limite_sup=200)
+    db_temp.guardar_estados_alerta([("1", "AAPL", "bajo", 100), ("2", "AAPL", "sobre", 200)])
+
+    # /seguir de nuevo con otros límites: tras reiniciar no debe volver el estado anterior
+    db_temp.agregar_producto("1", "AAPL", "Apple", limite_inf=50, limite_sup=80)
+
+    assert db_temp.obtener_estados_alerta() == {("2", "AAPL"): ("sobre", 200)}
+
+
+def test_iterar_suscripciones_activas_filtra_en_sql(db_temp):
+    db_temp.agregar_usuario("1", "con_clave")
+    db_temp.guardar_api_key("1", "KEY1")
+    db_temp.agregar_usuario("2", "sin_clave")
+    db_temp.agregar_usuario("3", "sin_productos")
+    db_temp.guardar_api_key("3", "KEY3")
+    for symbol in ["AAPL", "MSFT", "TSLA"]:
+        db_temp.agregar_producto("1", symbol, symbol, 5, 1.0, 2.0)
+    db_temp.agregar_producto("2", "AAPL", "Apple", 5, 1.0, 2.0)
+
+    filas = list(db_temp.iterar_suscripciones_activas(tamano_lote=2))
+
+    assert sorted(filas) == [("1", s, 5, s, 1.0, 2.0, "KEY1") for s in ["AAPL", "MSFT", "TSLA"]]
+
+
+def test_iterar_suscripciones_activas_usa_los_indices(db_temp):
+    with db_temp._conectar() as conn:
+        plan = conn.execute(
+            """
+            EXPLAIN QUERY PLAN
+            SELECT p.chat_id FROM productos_seguidos AS p JOIN usuarios AS u ON u.chat_id = p.chat_id
+            WHERE u.api_key IS NOT NULL AND u.api_key != ''
+            """
+        ).fetchall()
+
+    # La tabla interior del JOIN se busca por índice en lugar de recorrerse por cada fila
+    assert any(fila[-1].startswith("SEARCH") and "INDEX" in fila[-1] for fila in plan)
+
+
+def test_obtener_api_keys_en_bloque(db_temp, monkeypatch):
+    monkeypatch.setattr("bot.db_manager.MAX_VARIABLES", 2)
+    for chat_id in ["1", "2", "3", "4"]:
+        db_temp.agregar_usuario(chat_id, chat_id)
+        if chat_id != "3":
+            db_temp.guardar_api_key(chat_id, f"KEY{chat_id}")
+
+    assert db_temp.obtener_api_keys(["1", "2", "3", "4", "1", "5"]) == {"1": "KEY1", "2": "KEY2", "4": "KEY4"}
+    assert db_temp.obtener_api_keys([]) == {}
+
+
+def sentencias_de(db, operacion):
+    """Ejecuta una operación y devuelve las sentencias SQL que lanza."""
+    with db._conectar() as conn:
+        sentencias = []
+        conn.set_trace_callback(sentencias.append)
+        try:
+            operacion()
+        finally:
+            conn.set_trace_callback(None)
+    return sentencias
+
+
+def test_api_key_y_suscripciones_se_sirven_de_la_cache(db_temp):
+    db_temp.agregar_usuario("1", "user")
+    db_temp.guardar_api_key("1", "KEY")
+    db_temp.agregar_producto("1", "AAPL", "Apple")
+    db_temp.obtener_api_key("1")
+    db_temp.obtener_productos("1")
+
+    def comandos():
+        assert db_temp.obtener_api_key("1") == "KEY"
+        assert db_temp.obtener_simbolos_seguidos("1") == {"AAPL"}
+        assert db_temp.obtener_productos("1") == [("AAPL", 15, "Apple", 0.0, 0.0)]
+        assert db_temp.obtener_api_keys(["1"]) == {"1": "KEY"}
+
+    assert sentencias_de(db_temp, comandos) == []
+    estadisticas = db_temp.estadisticas_cache()
+    assert estadisticas["api_keys"]["aciertos"] == 2
+    assert estadisticas["suscripciones"]["tasa_aciertos"] == pytest.approx(2 / 3)
+
+
+def test_las_escrituras_invalidan_la_cache(db_temp):
+    db_temp.agregar_usuario("1", "user")
+    assert db_temp.obtener_api_key("1") is None
+    assert db_temp.obtener_simbolos_seguidos("1") == frozenset()
+
+    db_temp.guardar_api_key("1", "KEY")
+    db_temp.agregar_producto("1", "AAPL", "Apple")
+    db_temp.agregar_producto("1", "MSFT", "Microsoft")
+    assert db_temp.obtener_api_key("1") == "KEY"
+    assert db_temp.obtener_simbolos_seguidos("1") == {"AAPL", "MSFT"}
+
+    db_temp.agregar_producto("1", "AAPL", "Apple", limite_inf=100.0)
+    assert ("AAPL", 15, "Apple", 100.0, 0.0) in db_temp.obtener_productos("1")
+    db_temp.eliminar_producto("1", "MSFT")
+    assert db_temp.obtener_simbolos_seguidos("1") == {"AAPL"}
+
+
+def test_obtener_api_keys_solo_consulta_las_que_no_estan_en_cache(db_temp):
+    for chat_id in ["1", "2", "3"]:
+        db_temp.agregar_usuario(chat_id, chat_id)
+        db_temp.guardar_api_key(chat_id, f"KEY{chat_id}")
+    db_temp.obtener_api_key("1")
+
+    sentencias = sentencias_de(db_temp, lambda: db_temp.obtener_api_keys(["1", "2", "3"]))
+
+    assert len(sentencias) == 1 and "'1'" not in sentencias[0] and "'2', '3'" in sentencias[0]
+    # Las leídas en bloque quedan en la caché
+    assert sentencias_de(db_temp, lambda: db_temp.obtener_api_keys(["1", "2", "3"])) == []
+
+
+@pytest.fixture
+def db_fichero(tmp_path):
+    dbm = DatabaseManager(db_path=str(tmp_path / "basedatos.db"), lectores=2)
+    yield dbm
+    dbm.cerrar()
+
+
+def test_reutiliza_las_conexiones(db_fichero, monkeypatch):
+    db_fichero.agregar_usuario("1", "uno")
+    db_fichero.obtener_usuarios()
+    aperturas = []
+    abrir = db_fichero._abrir
+    monkeypatch.setattr(db_fichero, "_abrir", lambda: aperturas.append(1) or abrir())
+
+    for i in range(20):
+        db_fichero.guardar_api_key("1", f"KEY{i}")
+        assert db_fichero.obtener_api_key("1") == f"KEY{i}"
+
+    assert aperturas == []
+
+
+def test_las_conexiones_de_lectura_no_escriben(db_fichero):
+    with db_fichero._leer() as conn, pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM usuarios")
+
+
+def test_el_grupo_de_lectores_esta_acotado(db_fichero):
+    with db_fichero._leer() as a, db_fichero._leer() as b, db_fichero._leer() as c:
+        assert len({id(a), id(b), id(c)}) == 3
+
+    # La última en devolverse sobraba y se ha cerrado
+    assert db_fichero._lectores.qsize() == 2
+    with pytest.raises(sqlite3.ProgrammingError):
+        a.execute("SELECT 1")
+
+
+def test_acceso_desde_varios_hilos(db_fichero):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def trabajo(i):
+        db_fichero.agregar_usuario(str(i), f"u{i}")
+        db_fichero.guardar_api_key(str(i), f"KEY{i}")
+        return db_fichero.obtener_api_key(str(i))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        resultados = list(pool.map(trabajo, range(50)))
+
+    assert resultados == [f"KEY{i}" for i in range(50)]
+    assert len(db_fichero.obtener_usuarios()) == 50
+
+
+def test_cerrar_libera_y_permite_reabrir(db_fichero):
+    db_fichero.agregar_usuario("1", "uno")
+    db_fichero.obtener_usuarios()
+
+    db_fichero.cerrar()
+    assert db_fichero._escritor is None
+    assert db_fichero._lectores.qsize() == 0
+
+    assert db_fichero.obtener_usuarios() == ["1"]
+
+
+def test_perfil_rendimiento_aplica_los_pragmas(db_fichero):
+    with db_fichero._leer() as conn:
+        valores = {p: conn.execute(f"PRAGMA {p}").fetchone()[0] for p in ["journal_mode", "synchronous", "temp_store"]}
+        busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+
+    # synchronous NORMAL = 1, temp_store MEMORY = 2
+    assert valores == {"journal_mode": "wal", "synchronous": 1, "temp_store": 2}
+    assert busy_timeout == 5000
+
+
+def test_perfil_desconocido(tmp_path):
+    with pytest.raises(ValueError):
+        DatabaseManager(db_path=str(tmp_path / "a.db"), perfil="turbo")
+    with pytest.raises(ValueError):
+        DatabaseManager(db_path=str(tmp_path / "a.db"), pragmas={"foreign_keys": 1})
+
+
+@pytest.mark.parametrize("perfil, bloquea", [("rendimiento", False), ("seguro", True)])
+def test_lectura_larga_y_escritura_concurrentes(tmp_path, perfil, bloquea):
+    dbm = DatabaseManager(
+        db_path=str(tmp_path / "basedatos.db"), perfil=perfil, pragmas={"busy_timeout": 100}, durabilidad="inmediata"
+    )
+    dbm.agregar_usuario("1", "uno")
+    dbm.guardar_api_key("1", "KEY")
+    for symbol in ["AAPL", "MSFT", "TSLA"]:
+        dbm.agregar_producto("1", symbol, symbol)
+
+    # Una lectura a medias (como una exportación) mantiene abierta su transacción de lectura
+    lectura = dbm.iterar_suscripciones_activas(tamano_lote=1)
+    next(lectura)
+
+    if bloquea:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            dbm.guardar_precio("1", "AAPL", 100.0)
+    else:
+        dbm.guardar_precio("1", "AAPL", 100.0)
+        assert dbm.obtener_historial("1", "AAPL")[0][0] == 100.0
+    assert len(list(lectura)) == 2
+    dbm.cerrar()
+
+
+def planes_de(db_temp, operacion):
+    """Ejecuta una operación y devuelve el plan de cada consulta que lanza."""
+    with db_temp._conectar() as conn:
+        sentencias = []
+        conn.set_trace_callback(sentencias.append)
+        try:
+            operacion()
+        finally:
+            conn.set_trace_callback(None)
+        consultas = [s for s in sentencias if s.lstrip().upper().startswith(("SELECT", "DELETE"))]
+        assert consultas
+        return [" | ".join(fila[-1] for fila in conn.execute(f"EXPLAIN QUERY PLAN {c}")) for c in consultas]
+
+
+@pytest.mark.parametrize(
+    "operacion",
+    [
+        lambda db: db.obtener_historial("1", "AAPL"),
+        lambda db: db.obtener_estadisticas("1", "AAPL"),
+        lambda db: db.reconstruir_estadisticas("1", "AAPL"),
+        lambda db: db.borrar_historial("1", "AAPL"),
+        lambda db: db.obtener_historial_usuario("1"),
+        lambda db: db.obtener_historial_usuario("1", "AAPL"),
+        lambda db: db.obtener_serie("1", "AAPL"),
+        lambda db: list(db.iterar_historial_usuario("1", desde="2000-01-01 00:00:00", tamano_pagina=1)),
+        lambda db: db.aplicar_retencion(),
+        lambda db: db.obtener_productos("1"),
+        lambda db: db.obtener_favoritas_usuario("1"),
+        lambda db: db.obtener_limites("1", "AAPL"),
+        lambda db: db.obtener_api_key("1"),
+    ],
+    ids=[
+        "historial",
+        "estadisticas",
+        "reconstruir_estadisticas",
+        "borrar_historial",
+        "exportar_historial",
+        "exportar_historial_ticker",
+        "serie",
+        "iterar_historial",
+        "retencion",
+        "productos",
+        "favoritas",
+        "limites",
+        "api_key",
+    ],
+)
+def test_las_consultas_frecuentes_usan_indices(db_temp, operacion):
+    db_temp.agregar_usuario("1", "uno")
+    db_temp.agregar_producto("1", "AAPL", "Apple")
+    db_temp.guardar_precio("1", "AAPL", 10.0)
+    db_temp.guardar_precio_mercado("AAPL", 11.0)
+
+    for plan in planes_de(db_temp, lambda: operacion(db_temp)):
+        assert re.search(r"USING .*(INDEX|PRIMARY KEY)", plan), plan
+        # Recorrer el resultado de una subconsulta está bien; recorrer una tabla entera no
+        assert not re.search(r"SCAN (?!\(subquery)", plan), plan
+        # Solo se ordenan los resultados ya acotados de las subconsultas
+        ordenaciones = [m.start() for m in re.finditer("USE TEMP B-TREE", plan)]
+        assert all(re.search(r"SCAN \(subquery-\d+\) \| $", plan[:i]) for i in ordenaciones), plan
+
+
+def filas_historial(dbm):
+    with dbm._conectar() as conn:
+        return conn.execute("SELECT COUNT(*) FROM historial_precios").fetchone()[0]
+
+
+def test_historial_agrupado_vuelca_al_llenar_el_lote(db_fichero):
+    db_fichero.lote_historial = 3
+    db_fichero.espera_historial = 60
+
+    db_fichero.guardar_precio("1", "AAPL", 1.0)
+    db_fichero.guardar_precio("1", "AAPL", 2.0)
+    assert filas_historial(db_fichero) == 0
+
+    db_fichero.guardar_precio("1", "AAPL", 3.0)
+    assert filas_historial(db_fichero) == 3
+
+
+def test_historial_agrupado_vuelca_por_tiempo(db_fichero):
+    db_fichero.espera_historial = 0.05
+
+    db_fichero.guardar_precio("1", "AAPL", 1.0)
+    limite = time.monotonic() + 2
+    while filas_historial(db_fichero) == 0 and time.monotonic() < limite:
+        time.sleep(0.01)
+
+    assert filas_historial(db_fichero) == 1
+    assert db_fichero._temporizador is None
+
+
+def test_las_lecturas_ven_los_precios_pendientes(db_fichero):
+    db_fichero.espera_historial = 60
+    for precio in [1.0, 2.0, 3.0]:
+        db_fichero.guardar_precio("1", "AAPL", precio)
+
+    assert [p for p, _ in db_fichero.obtener_historial("1", "AAPL")] == [3.0, 2.0, 1.0]
+    db_fichero.guardar_precio("1", "AAPL", 4.0)
+    assert db_fichero.obtener_estadisticas("1", "AAPL")[1] == 4.0
+    db_fichero.guardar_precio("1", "AAPL", 5.0)
+    db_fichero.borrar_historial("1", "AAPL")
+    assert db_fichero.obtener_historial_usuario("1") == []
+
+
+def test_cerrar_vuelca_los_precios_pendientes(tmp_path):
+    ruta = str(tmp_path / "basedatos.db")
+    dbm = DatabaseManager(db_path=ruta, espera_historial=60)
+    dbm.guardar_precio("1", "AAPL", 1.0)
+    dbm.cerrar()
+
+    otra = DatabaseManager(db_path=ruta)
+    assert filas_historial(otra) == 1
+    otra.cerrar()
+
+
+def test_un_volcado_fallido_conserva_los_precios(db_fichero, monkeypatch):
+    db_fichero.espera_historial = 60
+    db_fichero.guardar_precio("1", "AAPL", 1.0)
+    monkeypatch.setattr(db_fichero, "_insertar_precios", lambda filas: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        db_fichero.volcar_precios()
+    monkeypatch.undo()
+
+    assert db_fichero.volcar_precios() == 1
+
+
+def test_historial_inmediato_escribe_cada_precio(tmp_path):
+    dbm = DatabaseManager(db_path=str(tmp_path / "basedatos.db"), durabilidad="inmediata")
+    dbm.guardar_precio("1", "AAPL", 1.0)
+
+    assert filas_historial(dbm) == 1
+    assert dbm._precios_pendientes == []
+    with pytest.raises(ValueError):
+        DatabaseManager(db_path=str(tmp_path / "basedatos.db"), durabilidad="nunca")
+    dbm.cerrar()
+
+
+@pytest.fixture
+def reloj_db(monkeypatch):
+    """Fija la fecha que usa el gestor: se cambia con reloj_db[0] = '...'."""
+    fecha = ["2025-01-01 10:00:00"]
+    monkeypatch.setattr("bot.db_manager._ahora", lambda: fecha[0])
+    return fecha
+
+
+def test_precio_de_mercado_compartido_entre_seguidores(db_temp, reloj_db):
+    for chat_id in ["1", "2"]:
+        db_temp.agregar_producto(chat_id, "AAPL", "Apple")
+    db_temp.agregar_producto("3", "MSFT", "Microsoft")
+
+    reloj_db[0] = "2025-01-01 10:05:00"
+    db_temp.guardar_precio_mercado("AAPL", 150.0)
+    db_temp.guardar_precio_mercado("AAPL", 151.0)  # Mismo segundo: se ignora
+
+    assert db_temp.obtener_historial("1", "AAPL") == [(150.0, "2025-01-01 10:05:00")]
+    assert db_temp.obtener_historial("2", "AAPL") == [(150.0, "2025-01-01 10:05:00")]
+    assert db_temp.obtener_historial("3", "AAPL") == []
+    with db_temp._conectar() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM precios_mercado").fetchone()[0] == 1
+
+
+def test_historial_solo_de_los_periodos_seguidos(db_temp, reloj_db):
+    db_temp.guardar_precio_mercado("AAPL", 1.0)  # Antes de seguirlo
+    reloj_db[0] = "2025-01-01 10:01:00"
+    db_temp.agregar_producto("1", "AAPL", "Apple")
+    reloj_db[0] = "2025-01-01 10:02:00"
+    db_temp.guardar_precio_mercado("AAPL", 2.0)
+    reloj_db[0] = "2025-01-01 10:03:00"
+    db_temp.agregar_producto("1", "AAPL", "Apple", limite_inf=1.0)  # Cambiar límites no corta el periodo
+    reloj_db[0] = "2025-01-01 10:04:00"
+    db_temp.guardar_precio_mercado("AAPL", 3.0)
+    reloj_db[0] = "2025-01-01 10:05:00"
+    db_temp.eliminar_producto("1", "AAPL")
+    reloj_db[0] = "2025-01-01 10:06:00"
+    db_temp.guardar_precio_mercado("AAPL", 4.0)  # Ya no lo sigue
+    db_temp.guardar_precio("1", "AAPL", 5.0)  # Captura manual
+    reloj_db[0] = "2025-01-01 10:07:00"
+    db_temp.agregar_producto("1", "AAPL", "Apple")
+    reloj_db[0] = "2025-01-01 10:08:00"
+    db_temp.guardar_precio_mercado("AAPL", 6.0)
+
+    assert [p for p, _ in db_temp.obtener_historial("1", "AAPL")] == [6.0, 5.0, 3.0, 2.0]
+    assert db_temp.obtener_estadisticas("1", "AAPL") == pytest.approx((2.0, 6.0, 4.0, math.sqrt(2.5)))
+    assert [f["Precio"] for f in db_temp.obtener_historial_usuario("1")] == [2.0, 3.0, 5.0, 6.0]
+
+
+def test_borrar_historial_no_toca_los_precios_compartidos(db_temp, reloj_db):
+    for chat_id in ["1", "2"]:
+        db_temp.agregar_producto(chat_id, "AAPL", "Apple")
+    reloj_db[0] = "2025-01-01 10:01:00"
+    db_temp.guardar_precio_mercado("AAPL", 1.0)
+    db_temp.guardar_precio("1", "AAPL", 2.0)
+
+    reloj_db[0] = "2025-01-01 10:02:00"
+    db_temp.borrar_historial("1", "AAPL")
+    reloj_db[0] = "2025-01-01 10:03:00"
+    db_temp.guardar_precio_mercado("AAPL", 3.0)
+
+    assert [p for p, _ in db_temp.obtener_historial("1", "AAPL")] == [3.0]
+    assert [p for p, _ in db_temp.obtener_historial("2", "AAPL")] == [3.0, 1.0]
+
+
+def seguir_con_precios(db, reloj, desde, precios):
+    """Sigue AAPL desde `desde` y guarda un precio de mercado en cada fecha de `precios`."""
+    reloj[0] = desde
+    db.agregar_producto("1", "AAPL", "Apple")
+    for fecha, precio in precios:
+        reloj[0] = fecha
+        db.guardar_precio_mercado("AAPL", precio)
+
+
+def resumen_guardado(db, chat_id="1", symbol="AAPL"):
+    with db._conectar() as conn:
+        return conn.execute(
+            """
+            SELECT num, suma, suma_cuadrados, minimo, maximo, apertura, cierre, primero, ultimo
+            FROM estadisticas_capturas WHERE chat_id = ? AND symbol = ?
+            """,
+            (chat_id, symbol),
+        ).fetchone()
+
+
+def test_estadisticas_combinan_capturas_y_velas(db_temp, reloj_db):
+    precios = [(velas.a_fecha(velas.a_segundos("2025-01-01 10:00:40") + i * 4327), 100.0 + i % 17) for i in range(60)]
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 10:00:35", precios)
+    db_temp.guardar_precio("1", "AAPL", 90.0)
+    reloj_db[0] = "2025-01-04 10:00:00"
+    db_temp.eliminar_producto("1", "AAPL")
+    reloj_db[0] = "2025-01-05 10:00:00"
+    db_temp.guardar_precio_mercado("AAPL", 1.0)  # Fuera del periodo
+
+    planes = planes_de(db_temp, lambda: db_temp.obtener_estadisticas("1", "AAPL"))
+    minimo, maximo, media, desviacion = db_temp.obtener_estadisticas("1", "AAPL")
+
+    with db_temp._conectar() as conn:
+        historial = [
+            fila[0]
+            for fila in conn.execute(
+                "SELECT precio FROM historial_precios WHERE chat_id = '1' AND symbol = 'AAPL' ORDER BY timestamp"
+            )
+        ]
+    assert (minimo, maximo) == (min(historial), max(historial))
+    assert media == pytest.approx(statistics.fmean(historial))
+    assert desviacion == pytest.approx(statistics.pstdev(historial))
+    # Solo las capturas se acumulan por usuario; lo de mercado se lee de las velas
+    assert resumen_guardado(db_temp)[:7] == (1, 90.0, 8100.0, 90.0, 90.0, 90.0, 90.0)
+    assert planes[0] == "SEARCH estadisticas_capturas USING PRIMARY KEY (chat_id=? AND symbol=?)"
+    assert any("velas USING PRIMARY KEY (segundos=? AND symbol=? AND inicio>? AND inicio<?)" in p for p in planes), planes
+    assert not any(re.search(r"SCAN (?!\(subquery)", p) for p in planes), planes
+
+
+def test_un_precio_de_mercado_no_escribe_estadisticas_por_seguidor(db_temp, reloj_db):
+    reloj_db[0] = "2025-01-01 10:00:00"
+    for chat_id in map(str, range(50)):
+        db_temp.agregar_producto(chat_id, "AAPL", "Apple")
+    reloj_db[0] = "2025-01-01 10:01:00"
+
+    with db_temp._conectar() as conn:
+        antes = conn.total_changes
+        db_temp.guardar_precio_mercado("AAPL", 4.0)
+        db_temp.volcar_precios()
+        # El precio y sus tres velas (minuto, hora y día), sean cuantos sean los seguidores
+        assert conn.total_changes - antes == 4
+        assert conn.execute("SELECT COUNT(*) FROM estadisticas_capturas").fetchone()[0] == 0
+    assert db_temp.obtener_estadisticas("7", "AAPL") == (4.0, 4.0, 4.0, 0.0)
+
+
+def test_reconstruir_estadisticas_repara_las_capturas(db_temp, reloj_db):
+    precios = [(velas.a_fecha(velas.a_segundos("2025-01-01 10:00:40") + i * 4327), 100.0 + i % 17) for i in range(60)]
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 10:00:35", precios)
+    reloj_db[0] = "2025-01-04 10:00:00"
+    db_temp.guardar_precio("1", "AAPL", 90.0)
+    db_temp.eliminar_producto("1", "AAPL")
+    db_temp.guardar_precio("2", "MSFT", 10.0)
+    db_temp.volcar_precios()
+    esperado = resumen_guardado(db_temp)
+    with db_temp._conectar() as conn:
+        conn.execute("UPDATE estadisticas_capturas SET num = 3, suma = 0")
+        conn.execute("INSERT INTO estadisticas_capturas VALUES ('3', 'AAPL', 1, 1, 1, 1, 1, 1, 1, '', '')")
+
+    planes = planes_de(db_temp, lambda: db_temp.reconstruir_estadisticas("1", "AAPL"))
+    assert db_temp.reconstruir_estadisticas() == 2
+
+    assert resumen_guardado(db_temp) == pytest.approx(esperado)
+    assert resumen_guardado(db_temp, "2", "MSFT")[:2] == (1, 10.0)
+    # Sin capturas, su fila se borra
+    assert resumen_guardado(db_temp, "3") is None
+    assert not any(re.search(r"SCAN (?!\(subquery)", p) for p in planes), planes
+
+
+def test_borrar_historial_reinicia_las_estadisticas(db_temp, reloj_db):
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 10:00:00", [("2025-01-01 10:01:00", 1.0)])
+    db_temp.guardar_precio("1", "AAPL", 2.0)
+
+    reloj_db[0] = "2025-01-01 10:02:00"
+    db_temp.borrar_historial("1", "AAPL")
+    assert db_temp.obtener_estadisticas("1", "AAPL") is None
+
+    reloj_db[0] = "2025-01-01 10:03:00"
+    db_temp.guardar_precio_mercado("AAPL", 3.0)
+    assert db_temp.obtener_estadisticas("1", "AAPL") == (3.0, 3.0, 3.0, 0.0)
+
+
+def test_crear_el_gestor_rellena_las_estadisticas_de_una_base_anterior(tmp_path):
+    ruta = str(tmp_path / "anterior.db")
+    conn = sqlite3.connect(ruta)
+    migrar(conn, MIGRACIONES[:5])
+    conn.execute("INSERT INTO capturas_manuales (chat_id, symbol, precio) VALUES ('1', 'AAPL', 10.0), ('1', 'AAPL', 20.0)")
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(db_path=ruta)
+
+    assert db.obtener_estadisticas("1", "AAPL") == (10.0, 20.0, 15.0, 5.0)
+    db.cerrar()
+
+
+def test_aplicar_retencion_conserva_las_velas(db_temp, reloj_db):
+    antiguos = [("2025-01-01 10:00:10", 1.0), ("2025-01-01 10:00:40", 3.0), ("2025-01-01 10:05:00", 2.0)]
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 10:00:05", [*antiguos, ("2025-03-01 12:00:00", 5.0)])
+
+    antes = db_temp.obtener_estadisticas("1", "AAPL")
+    assert db_temp.aplicar_retencion() == 3
+
+    with db_temp._conectar() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM precios_mercado").fetchone()[0] == 1
+    assert db_temp.obtener_estadisticas("1", "AAPL")[:3] == (1.0, 5.0, 2.75)
+    # Las velas conservan la suma de cuadrados: la desviación sigue siendo exacta
+    assert db_temp.obtener_estadisticas("1", "AAPL") == pytest.approx(antes)
+    # Lo purgado se exporta como el cierre de cada vela de minuto
+    assert [(f["Precio"], f["Fecha"]) for f in db_temp.obtener_historial_usuario("1")] == [
+        (3.0, "2025-01-01 10:00:40"),
+        (2.0, "2025-01-01 10:05:00"),
+        (5.0, "2025-03-01 12:00:00"),
+    ]
+    assert db_temp.aplicar_retencion() == 0
+
+
+def test_obtener_serie_usa_velas_de_hora_en_periodos_largos(db_temp, reloj_db):
+    inicio = velas.a_segundos("2025-01-01 00:00:00")
+    precios = [(velas.a_fecha(inicio + i * 1800), float(i)) for i in range(240)]
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 00:00:00", precios)
+    reloj_db[0] = "2025-01-05 23:45:00"
+    db_temp.guardar_precio("1", "AAPL", 7.5)
+
+    serie = db_temp.obtener_serie("1", "AAPL", max_puntos=200)
+
+    # Una vela por hora (su cierre, a la media) más la captura manual
+    assert len(serie) == 121
+    assert [p for p, f in serie if f.endswith(":30:00")] == [float(i) for i in range(1, 240, 2)]
+    assert serie == sorted(serie, key=lambda punto: punto[1])
+    assert db_temp.obtener_serie("2", "AAPL") == []
+
+
+def test_obtener_serie_agrupa_las_capturas_por_vela(db_temp, reloj_db):
+    inicio = velas.a_segundos("2025-01-01 00:00:00")
+    for i in range(500):
+        reloj_db[0] = velas.a_fecha(inicio + i * 60)
+        db_temp.guardar_precio("1", "AAPL", float(i))
+
+    sentencias = sentencias_de(db_temp, lambda: db_temp.obtener_serie("1", "AAPL", max_puntos=50))
+    serie = db_temp.obtener_serie("1", "AAPL", max_puntos=50)
+
+    # 500 minutos no caben en 50 velas de minuto: la última captura de cada hora
+    assert serie == [(float(59 + 60 * h), velas.a_fecha(inicio + (59 + 60 * h) * 60)) for h in range(8)] + [
+        (499.0, velas.a_fecha(inicio + 499 * 60))
+    ]
+    assert len(sentencias) < 25
+
+
+def test_retencion_desconocida(tmp_path):
+    with pytest.raises(ValueError):
+        DatabaseManager(db_path=str(tmp_path / "basedatos.db"), retencion={velas.DIA: 30})
+
+
+def test_iterar_historial_usuario_por_paginas(db_temp, reloj_db):
+    precios = [(f"2025-01-01 10:{m:02d}:00", float(m)) for m in range(1, 10)]
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 10:00:00", precios)
+    reloj_db[0] = "2025-01-01 10:00:30"
+    db_temp.agregar_producto("1", "MSFT", "Microsoft")
+    db_temp.guardar_precio_mercado("MSFT", 100.0)
+    for precio in [0.5, 0.6, 0.7]:  # Capturas en el mismo segundo: la paginación sigue por id
+        db_temp.guardar_precio("1", "AAPL", precio)
+    reloj_db[0] = "2025-01-01 10:09:30"
+
+    completo = [(s, p, f) for s, p, f in db_temp.iterar_historial_usuario("1")]
+    assert list(db_temp.iterar_historial_usuario("1", tamano_pagina=2)) == completo
+    assert [p for _, p, _ in completo] == [0.5, 0.6, 0.7, 100.0, *[float(m) for m in range(1, 10)]]
+    assert [f["Precio"] for f in db_temp.obtener_historial_usuario("1", "MSFT")] == [100.0]
+    rango = db_temp.iterar_historial_usuario("1", "AAPL", desde="2025-01-01 10:03:00", hasta="2025-01-01 10:06:00")
+    assert [p for _, p, _ in rango] == [3.0, 4.0, 5.0]
+
+
+def test_iterar_historial_usuario_lee_solo_las_paginas_necesarias(db_temp, reloj_db):
+    precios = [(velas.a_fecha(velas.a_segundos("2025-01-01 10:00:00") + i), float(i)) for i in range(1000)]
+    seguir_con_precios(db_temp, reloj_db, "2025-01-01 10:00:00", precios)
+    db_temp.volcar_precios()
+
+    with db_temp._conectar() as conn:
+        sentencias = []
+        conn.set_trace_callback(sentencias.append)
+        primeros = list(itertools.islice(db_temp.iterar_historial_usuario("1", tamano_pagina=10), 25))
+        conn.set_trace_callback(None)
+
+    assert [p for _, p, _ in primeros] == [float(i) for i in range(25)]
+    # Las 3 primeras páginas de precios de mercado (más periodos y capturas), no las 100
+    assert sum("FROM precios_mercado" in s for s in sentencias) == 3
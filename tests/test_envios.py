@@ -0,0 +1,152 @@
+import asyncio
+import time
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+from bot.envios import MAX_LONGITUD, ColaEnvios
+
+
+async def esperar(condicion, timeout=2.0):
+    async with asyncio.timeout(timeout):
+        while not condicion():
+            await asyncio.sleep(0.005)
+
+
+def bot_falso(side_effect=None):
+    bot = MagicMock()
+    bot.envios = []
+
+    async def send_message(chat_id, text, parse_mode):
+        if side_effect:
+            efecto = side_effect.pop(0)
+            if efecto is not None:
+                raise efecto
+        bot.envios.append((chat_id, text, time.monotonic()))
+
+    bot.send_message = AsyncMock(side_effect=send_message)
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_fusiona_los_mensajes_pendientes_de_un_chat():
+    cola = ColaEnvios()
+    for texto in ["uno", "dos", "tres"]:
+        cola.encolar("1", texto)
+    cola.encolar("2", "otro")
+    bot = bot_falso()
+
+    cola.iniciar(bot)
+    await esperar(lambda: cola.estadisticas()["pendientes"] == 0)
+    await cola.detener()
+
+    assert sorted((chat_id, texto) for chat_id, texto, _ in bot.envios) == [("1", "uno\n\ndos\n\ntres"), ("2", "otro")]
+    estadisticas = cola.estadisticas()
+    assert (estadisticas["enviados"], estadisticas["fusionados"], estadisticas["chats_pendientes"]) == (2, 2, 0)
+    assert estadisticas["latencia_max"] >= estadisticas["latencia_media"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_respeta_el_limite_por_chat():
+    cola = ColaEnvios(por_chat=10)
+    bot = bot_falso()
+    cola.iniciar(bot)
+
+    cola.encolar("1", "primero")
+    await esperar(lambda: len(bot.envios) == 1)
+    cola.encolar("1", "segundo")
+    cola.encolar("2", "otro chat")
+    await esperar(lambda: len(bot.envios) == 3)
+    await cola.detener()
+
+    tiempos = {texto: t for _, texto, t in bot.envios}
+    assert tiempos["segundo"] - tiempos["primero"] >= 0.09
+    # Otro chat no tiene que esperar
+    assert tiempos["otro chat"] < tiempos["segundo"]
+
+
+@pytest.mark.asyncio
+async def test_respeta_el_limite_global():
+    cola = ColaEnvios(trabajadores=8, por_segundo=20)
+    for i in range(25):
+        cola.encolar(str(i), "alerta")
+    bot = bot_falso()
+
+    inicio = time.monotonic()
+    cola.iniciar(bot)
+    await esperar(lambda: len(bot.envios) == 25)
+    await cola.detener()
+
+    # 20 de golpe y los 5 restantes a 20 por segundo
+    assert time.monotonic() - inicio >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pausa_y_reintenta():
+    cola = ColaEnvios()
+    bot = bot_falso([RetryAfter(timedelta(seconds=0.05)), None])
+    cola.iniciar(bot)
+
+    cola.encolar("1", "alerta")
+    await esperar(lambda: len(bot.envios) == 1)
+    await cola.detener()
+
+    assert bot.envios[0][1] == "alerta"
+    assert cola.estadisticas()["reintentos"] == 1
+    assert cola.estadisticas()["descartados"] == 0
+
+
+@pytest.mark.asyncio
+async def test_error_definitivo_descarta_el_mensaje():
+    cola = ColaEnvios()
+    bot = bot_falso([Forbidden("bloqueado por el usuario"), None])
+    cola.iniciar(bot)
+
+    cola.encolar("1", "uno")
+    await esperar(lambda: cola.estadisticas()["pendientes"] == 0)
+    cola.encolar("2", "dos")
+    await esperar(lambda: len(bot.envios) == 1)
+    await cola.detener()
+
+    assert cola.estadisticas()["descartados"] == 1
+    assert bot.envios[0][:2] == ("2", "dos")
+
+
+def test_cola_llena_descarta_los_nuevos():
+    cola = ColaEnvios(max_pendientes=2)
+
+    assert cola.encolar("1", "a")
+    assert cola.encolar("2", "b")
+    assert not cola.encolar("3", "c")
+    assert cola.estadisticas()["descartados"] == 1
+    assert cola.estadisticas()["pendientes"] == 2
+
+
+@pytest.mark.asyncio
+async def test_no_supera_la_longitud_maxima_de_telegram():
+    cola = ColaEnvios(por_chat=100)
+    largo = "x" * (MAX_LONGITUD // 2 + 1)
+    cola.encolar("1", largo)
+    cola.encolar("1", largo)
+    bot = bot_falso()
+
+    cola.iniciar(bot)
+    await esperar(lambda: len(bot.envios) == 2)
+    await cola.detener()
+
+    assert all(len(texto) <= MAX_LONGITUD for _, texto, _ in bot.envios)
+
+
+@pytest.mark.asyncio
+async def test_detener_conserva_los_pendientes():
+    cola = ColaEnvios()
+    cola.iniciar(bot_falso())
+    await cola.detener()
+
+    cola.encolar("1", "alerta")
+    bot = bot_falso()
+    cola.iniciar(bot)
+    await esperar(lambda: len(bot.envios) == 1)
+    await cola.detener()
@@ -0,0 +1,100 @@
+import csv
+import gzip
+import io
+import random
+import tempfile
+
+import pytest
+
+from bot.exportacion import exportar_csv
+
+CABECERA = ("Símbolo", "Precio", "Fecha")
+
+
+def leer(partes, comprimir=False):
+    """Filas de cada parte (sin la cabecera), comprobando que todas empiezan con ella."""
+    filas = []
+    for _, fichero in partes:
+        datos = fichero.read()
+        fichero.close()
+        texto = (gzip.decompress(datos) if comprimir else datos).decode()
+        cabecera, *resto = csv.reader(io.StringIO(texto))
+        assert tuple(cabecera) == CABECERA
+        filas.append(resto)
+    return filas
+
+
+def historial(n):
+    return [("AAPL", str(100 + i / 7), f"2024-05-{1 + i % 28:02d} 12:00:00") for i in range(n)]
+
+
+def test_sin_filas_no_genera_partes():
+    assert exportar_csv(iter([]), CABECERA, "historial") == (0, [])
+
+
+def test_una_parte_con_el_csv_completo():
+    total, partes = exportar_csv(iter([("AAPL", 150.0, "2024-05-23 12:00"), ("TSLA", None, "x,y")]), CABECERA, "historial")
+
+    assert total == 2
+    assert [nombre for nombre, _ in partes] == ["historial.csv"]
+    assert partes[0][1].read() == 'Símbolo,Precio,Fecha\nAAPL,150.0,2024-05-23 12:00\nTSLA,,"x,y"\n'.encode()
+
+
+@pytest.mark.parametrize("comprimir", [False, True])
+def test_reparte_en_partes_que_no_superan_el_limite(comprimir):
+    # Precios aleatorios para que gzip no los comprima casi a nada
+    aleatorio = random.Random(1)
+    filas = [("AAPL", str(aleatorio.random()), "2024-05-23 12:00:00") for _ in range(3000)]
+    limite = 8000
+
+    total, partes = exportar_csv(iter(filas), CABECERA, "historial", comprimir=comprimir, limite=limite)
+
+    extension = ".csv.gz" if comprimir else ".csv"
+    assert total == len(filas)
+    assert len(partes) > 2
+    assert [nombre for nombre, _ in partes] == [f"historial_parte{i}{extension}" for i in range(1, len(partes) + 1)]
+    tamanos = [fichero.seek(0, io.SEEK_END) for _, fichero in partes]
+    for _, fichero in partes:
+        fichero.seek(0)
+    assert max(tamanos) <= limite
+    # Cada parte se llena casi hasta el límite
+    assert min(tamanos[:-1]) > limite * 0.8
+    assert [tuple(f) for parte in leer(partes, comprimir) for f in parte] == filas
+
+
+def test_una_fila_mayor_que_el_limite_va_sola_en_su_parte():
+    filas = [("AAPL", "1", "a"), ("AAPL", "2", "b" * 200), ("AAPL", "3", "c")]
+
+    _, partes = exportar_csv(iter(filas), CABECERA, "historial", limite=100)
+
+    assert [len(parte) for parte in leer(partes)] == [1, 1, 1]
+
+
+def test_pasa_a_disco_al_superar_el_umbral():
+    _, partes = exportar_csv(iter(historial(500)), CABECERA, "historial", umbral_disco=1024)
+    _, en_memoria = exportar_csv(iter(historial(5)), CABECERA, "historial", umbral_disco=1024)
+
+    assert partes[0][1]._rolled
+    assert not en_memoria[0][1]._rolled
+    assert len(leer(partes)[0]) == 500
+
+
+def test_cierra_los_ficheros_si_falla_la_lectura(monkeypatch):
+    creados = []
+    original = tempfile.SpooledTemporaryFile
+
+    def registrar(*args, **kwargs):
+        creados.append(original(*args, **kwargs))
+        return creados[-1]
+
+    monkeypatch.setattr(tempfile, "SpooledTemporaryFile", registrar)
+
+    def filas():
+        yield from historial(50)
+        raise RuntimeError("conexión perdida")
+
+    with pytest.raises(RuntimeError):
+        exportar_csv(filas(), CABECERA, "historial", limite=200)
+
+    assert len(creados) > 1
+    assert all(fichero.closed for fichero in creados)
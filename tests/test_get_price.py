@@ -1,65 +1,317 @@
-from bot.get_price import fetch_stock_price
+from unittest.mock import AsyncMock, MagicMock
 
+import aiohttp
+import pytest
 
-def test_api_respuesta_valida_con_precio_y_nombre(monkeypatch):
-    # Mock de la respuesta de requests.get
-    class MockResponse:
-        def __init__(self):
-            self.status_code = 200
+from bot import get_price
+from bot.get_price import cerrar_sesion, fetch_stock_price, obtener_sesion
+from bot.limitador import CreditosAgotados, LimitadorCreditos
+from bot.resiliencia import CircuitBreaker, ErrorTransitorio
 
-        def raise_for_status(self):
-            pass
 
-        def json(self):
-            return {"close": "152.35", "name": "Apple Inc"}
+@pytest.fixture(autouse=True)
+def limitador_generoso(monkeypatch):
+    # Cada test parte de un limitador nuevo para no depender de los créditos gastados por otros
+    limitador = LimitadorCreditos(por_minuto=1000, por_dia=100_000)
+    monkeypatch.setattr("bot.get_price.limitador_creditos", limitador)
+    return limitador
 
-    monkeypatch.setattr("bot.get_price.requests.get", lambda url, timeout: MockResponse())
-    resultado = fetch_stock_price("AAPL", "fake_api_key")
-    assert resultado == {"precio": 152.35, "nombre": "Apple Inc", "error": None}
 
+@pytest.fixture(autouse=True)
+def circuito_nuevo(monkeypatch):
+    # Circuito cerrado en cada test y reintentos sin esperas reales
+    circuito = CircuitBreaker("TwelveData", umbral_fallos=5, enfriamiento=60)
+    monkeypatch.setattr("bot.get_price.circuito_twelvedata", circuito)
+    monkeypatch.setattr("bot.resiliencia.asyncio.sleep", AsyncMock())
+    return circuito
 
-def test_api_sin_precio_devuelve_error(monkeypatch):
-    class MockResponse:
-        def __init__(self):
-            self.status_code = 200
 
-        def raise_for_status(self):
-            pass
+@pytest.mark.asyncio
+async def test_api_respuesta_valida_con_precio_y_nombre(monkeypatch):
+    monkeypatch.setattr(
+        "bot.get_price._consultar_quote",
+        AsyncMock(return_value={"close": "152.35", "name": "Apple Inc"}),
+    )
+    resultado = await fetch_stock_price("AAPL", "fake_api_key")
+    assert resultado == {"precio": 152.35, "nombre": "Apple Inc", "error": None}
 
-        def json(self):
-            return {"name": "Empresa X"}
 
-    monkeypatch.setattr("bot.get_price.requests.get", lambda url, timeout: MockResponse())
-    resultado = fetch_stock_price("AAPL", "fake_api_key")
+@pytest.mark.asyncio
+async def test_api_sin_precio_devuelve_error(monkeypatch):
+    monkeypatch.setattr("bot.get_price._consultar_quote", AsyncMock(return_value={"name": "Empresa X"}))
+    resultado = await fetch_stock_price("AAPL", "fake_api_key")
     assert resultado["precio"] is None
     assert resultado["nombre"] is None
     assert resultado["error"] is not None
 
 
-def test_api_respuesta_con_mensaje_error(monkeypatch):
-    class MockResponse:
-        def __init__(self):
-            self.status_code = 200
-
-        def raise_for_status(self):
-            pass
+@pytest.mark.asyncio
+async def test_api_respuesta_con_mensaje_error(monkeypatch):
+    monkeypatch.setattr(
+        "bot.get_price._consultar_quote",
+        AsyncMock(return_value={"status": "error", "message": "Invalid API key"}),
+    )
+    resultado = await fetch_stock_price("AAPL", "fake_api_key")
+    assert resultado["precio"] is None
+    assert resultado["nombre"] is None
+    assert resultado["error"] == "Invalid API key"
 
-        def json(self):
-            return {"status": "error", "message": "Invalid API key"}
 
-    monkeypatch.setattr("bot.get_price.requests.get", lambda url, timeout: MockResponse())
-    resultado = fetch_stock_price("AAPL", "fake_api_key")
+@pytest.mark.asyncio
+async def test_api_lanza_timeout(monkeypatch):
+    monkeypatch.setattr("bot.get_price._consultar_quote", AsyncMock(side_effect=TimeoutError()))
+    resultado = await fetch_stock_price("AAPL", "fake_api_key")
     assert resultado["precio"] is None
     assert resultado["nombre"] is None
-    assert resultado["error"] is not None
+    # Aunque la excepción no tenga mensaje, el error nunca debe quedar vacío
+    assert resultado["error"] == "TimeoutError"
+
+
+@pytest.mark.asyncio
+async def test_api_error_de_conexion(monkeypatch):
+    monkeypatch.setattr(
+        "bot.get_price._consultar_quote",
+        AsyncMock(side_effect=aiohttp.ClientConnectionError("Conexión rechazada")),
+    )
+    resultado = await fetch_stock_price("AAPL", "fake_api_key")
+    assert resultado == {"precio": None, "nombre": None, "error": "Conexión rechazada"}
+
+
+@pytest.mark.asyncio
+async def test_consultar_quote_usa_sesion_compartida(monkeypatch):
+    respuesta = MagicMock()
+    respuesta.status = 200
+    respuesta.raise_for_status = MagicMock()
+    respuesta.json = AsyncMock(return_value={"close": "1.0", "name": "X"})
+
+    contexto = MagicMock()
+    contexto.__aenter__ = AsyncMock(return_value=respuesta)
+    contexto.__aexit__ = AsyncMock(return_value=False)
+
+    sesion = MagicMock()
+    sesion.get = MagicMock(return_value=contexto)
+    monkeypatch.setattr("bot.get_price.obtener_sesion", lambda: sesion)
+
+    data = await get_price._consultar_quote({"symbol": "AAPL", "apikey": "k"})
+
+    assert data == {"close": "1.0", "name": "X"}
+    args, kwargs = sesion.get.call_args
+    assert args[0] == get_price.URL_QUOTE
+    assert kwargs["params"] == {"symbol": "AAPL", "apikey": "k"}
+    assert kwargs["timeout"].total == get_price.TIMEOUT_PETICION
+
+
+@pytest.mark.asyncio
+async def test_sesion_reutilizada_y_cerrada():
+    sesion = obtener_sesion()
+    try:
+        assert obtener_sesion() is sesion
+        conector = sesion.connector
+        assert conector is not None
+        assert conector.limit == get_price.MAX_CONEXIONES
+        assert conector.limit_per_host == get_price.MAX_CONEXIONES_HOST
+    finally:
+        await cerrar_sesion()
+
+    assert sesion.closed
+    nueva = obtener_sesion()
+    assert nueva is not sesion
+    await cerrar_sesion()
+
+
+@pytest.mark.asyncio
+async def test_fetch_stock_prices_lote_con_fallo_parcial(monkeypatch):
+    mock_quote = AsyncMock(
+        return_value={
+            "AAPL": {"close": "150.0", "name": "Apple Inc"},
+            "XXXX": {"code": 404, "status": "error", "message": "symbol not found"},
+        }
+    )
+    monkeypatch.setattr("bot.get_price._consultar_quote", mock_quote)
 
+    resultado = await get_price.fetch_stock_prices(["AAPL", "XXXX", "AAPL", "MSFT"], "k")
 
-def test_api_lanza_timeout(monkeypatch):
-    def mock_get(url, timeout):
-        raise TimeoutError("Tiempo de espera agotado")
+    mock_quote.assert_awaited_once_with({"symbol": "AAPL,XXXX,MSFT", "apikey": "k"})
+    assert resultado["AAPL"] == {"precio": 150.0, "nombre": "Apple Inc", "error": None}
+    assert resultado["XXXX"]["error"] == "symbol not found"
+    assert resultado["MSFT"]["precio"] is None
+    assert resultado["MSFT"]["error"] is not None
 
-    monkeypatch.setattr("bot.get_price.requests.get", mock_get)
-    resultado = fetch_stock_price("AAPL", "fake_api_key")
+
+@pytest.mark.asyncio
+async def test_fetch_stock_prices_divide_en_lotes(monkeypatch):
+    monkeypatch.setattr("bot.get_price.MAX_SIMBOLOS_LOTE", 2)
+    peticiones = []
+
+    async def fake_quote(params):
+        symbols = params["symbol"].split(",")
+        peticiones.append(symbols)
+        if len(symbols) == 1:
+            return {"close": "1.0", "name": symbols[0]}
+        return {s: {"close": "1.0", "name": s} for s in symbols}
+
+    monkeypatch.setattr("bot.get_price._consultar_quote", fake_quote)
+
+    resultado = await get_price.fetch_stock_prices(["A", "B", "C", "D", "E"], "k")
+
+    assert peticiones == [["A", "B"], ["C", "D"], ["E"]]
+    assert all(resultado[s]["nombre"] == s for s in "ABCDE")
+
+
+@pytest.mark.asyncio
+async def test_fetch_stock_prices_error_global_afecta_a_todo_el_lote(monkeypatch):
+    monkeypatch.setattr(
+        "bot.get_price._consultar_quote",
+        AsyncMock(return_value={"code": 401, "status": "error", "message": "Invalid API key"}),
+    )
+
+    resultado = await get_price.fetch_stock_prices(["AAPL", "MSFT"], "k")
+
+    assert {s: r["error"] for s, r in resultado.items()} == {"AAPL": "Invalid API key", "MSFT": "Invalid API key"}
+
+
+@pytest.mark.asyncio
+async def test_fetch_stock_prices_fallo_de_red(monkeypatch):
+    monkeypatch.setattr("bot.get_price._consultar_quote", AsyncMock(side_effect=TimeoutError()))
+
+    resultado = await get_price.fetch_stock_prices(["AAPL", "MSFT"], "k")
+
+    assert all(r["error"] == "TimeoutError" for r in resultado.values())
+    assert await get_price.fetch_stock_prices([], "k") == {}
+
+
+@pytest.mark.asyncio
+async def test_api_precio_no_numerico(monkeypatch):
+    monkeypatch.setattr("bot.get_price._consultar_quote", AsyncMock(return_value={"close": "abc", "name": "X"}))
+    resultado = await fetch_stock_price("AAPL", "k")
     assert resultado["precio"] is None
-    assert resultado["nombre"] is None
-    assert resultado["error"] is not None
+    assert resultado["error"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_stock_prices_consume_un_credito_por_simbolo(monkeypatch, limitador_generoso):
+    monkeypatch.setattr(
+        "bot.get_price._consultar_quote",
+        AsyncMock(return_value={"A": {"close": "1", "name": "A"}, "B": {"close": "2", "name": "B"}}),
+    )
+
+    await get_price.fetch_stock_prices(["A", "B"], "clave")
+
+    assert limitador_generoso.restantes("clave") == {"minuto": 998, "dia": 99_998}
+
+
+@pytest.mark.asyncio
+async def test_lotes_no_superan_creditos_por_minuto(monkeypatch):
+    monkeypatch.setattr("bot.get_price.limitador_creditos", LimitadorCreditos(por_minuto=3, por_dia=800))
+    peticiones = []
+
+    async def fake_quote(params):
+        symbols = params["symbol"].split(",")
+        peticiones.append(len(symbols))
+        return {s: {"close": "1.0", "name": s} for s in symbols}
+
+    monkeypatch.setattr("bot.get_price._consultar_quote", fake_quote)
+
+    await get_price.fetch_stock_prices(["A", "B", "C"], "k")
+
+    assert peticiones == [3]
+
+
+@pytest.mark.asyncio
+async def test_creditos_agotados_devuelve_error(monkeypatch):
+    monkeypatch.setattr("bot.get_price.limitador_creditos", LimitadorCreditos(por_minuto=8, por_dia=1, max_espera=0))
+    mock_quote = AsyncMock(return_value={"close": "1.0", "name": "A"})
+    monkeypatch.setattr("bot.get_price._consultar_quote", mock_quote)
+
+    assert (await fetch_stock_price("A", "k"))["error"] is None
+    resultado = await fetch_stock_price("A", "k")
+
+    assert "créditos" in resultado["error"]
+    mock_quote.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_reintenta_errores_transitorios(monkeypatch, circuito_nuevo):
+    mock_quote = AsyncMock(side_effect=[ErrorTransitorio("HTTP 503 de la API"), {"close": "10.0", "name": "X"}])
+    monkeypatch.setattr("bot.get_price._consultar_quote", mock_quote)
+
+    resultado = await fetch_stock_price("X", "k")
+
+    assert resultado == {"precio": 10.0, "nombre": "X", "error": None}
+    assert mock_quote.await_count == 2
+    assert circuito_nuevo.estadisticas()["estado"] == "cerrado"
+
+
+@pytest.mark.asyncio
+async def test_circuito_se_abre_y_falla_rapido(monkeypatch, circuito_nuevo):
+    mock_quote = AsyncMock(side_effect=ErrorTransitorio("HTTP 500 de la API"))
+    monkeypatch.setattr("bot.get_price._consultar_quote", mock_quote)
+
+    primero = await fetch_stock_price("X", "k")
+    segundo = await fetch_stock_price("X", "k")
+
+    assert primero["error"] == "HTTP 500 de la API"
+    assert "no disponible temporalmente" in segundo["error"]
+    # 3 intentos del primero + 2 del segundo hasta alcanzar el umbral de 5 fallos
+    assert mock_quote.await_count == 5
+    assert circuito_nuevo.estadisticas()["estado"] == "abierto"
+    assert circuito_nuevo.estadisticas()["aperturas"] == 1
+
+
+def respuesta_http(status, cuerpo=None, cabeceras=None):
+    respuesta = MagicMock()
+    respuesta.status = status
+    respuesta.headers = cabeceras or {}
+    respuesta.raise_for_status = MagicMock()
+    respuesta.json = AsyncMock(return_value=cuerpo)
+    contexto = MagicMock()
+    contexto.__aenter__ = AsyncMock(return_value=respuesta)
+    contexto.__aexit__ = AsyncMock(return_value=False)
+    sesion = MagicMock()
+    sesion.get = MagicMock(return_value=contexto)
+    return sesion
+
+
+@pytest.mark.asyncio
+async def test_consultar_quote_429_con_retry_after(monkeypatch):
+    sesion = respuesta_http(429, cabeceras={"Retry-After": "3"})
+    monkeypatch.setattr("bot.get_price.obtener_sesion", lambda: sesion)
+
+    with pytest.raises(CreditosAgotados) as excinfo:
+        await get_price._consultar_quote({"symbol": "X", "apikey": "k"})
+
+    assert excinfo.value.espera == 3.0
+
+
+@pytest.mark.asyncio
+async def test_consultar_quote_limite_en_el_cuerpo(monkeypatch):
+    cuerpo = {"code": 429, "status": "error", "message": "You have run out of API credits"}
+    monkeypatch.setattr("bot.get_price.obtener_sesion", lambda: respuesta_http(200, cuerpo))
+
+    with pytest.raises(CreditosAgotados):
+        await get_price._consultar_quote({"symbol": "X", "apikey": "k"})
+
+
+@pytest.mark.asyncio
+async def test_consultar_quote_error_del_servidor_en_el_cuerpo(monkeypatch):
+    cuerpo = {"code": 503, "status": "error", "message": "Service unavailable"}
+    monkeypatch.setattr("bot.get_price.obtener_sesion", lambda: respuesta_http(200, cuerpo))
+
+    with pytest.raises(ErrorTransitorio, match="unavailable"):
+        await get_price._consultar_quote({"symbol": "X", "apikey": "k"})
+
+
+@pytest.mark.asyncio
+async def test_una_clave_sin_creditos_no_abre_el_circuito(monkeypatch, circuito_nuevo):
+    agotada = respuesta_http(429)
+    sana = respuesta_http(200, {"close": "10.0", "name": "X"})
+    monkeypatch.setattr("bot.get_price.obtener_sesion", lambda: agotada)
+
+    for _ in range(circuito_nuevo.umbral_fallos + 1):
+        assert "créditos" in (await fetch_stock_price("X", "AGOTADA"))["error"]
+    monkeypatch.setattr("bot.get_price.obtener_sesion", lambda: sana)
+
+    assert await fetch_stock_price("X", "SANA") == {"precio": 10.0, "nombre": "X", "error": None}
+    # Sin reintentos: una petición por consulta, y el circuito sigue cerrado
+    assert agotada.get.call_count == circuito_nuevo.umbral_fallos + 1
+    assert circuito_nuevo.estadisticas()["estado"] == "cerrado"
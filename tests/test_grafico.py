@@ -13,7 +13,7 @@ def test_generar_grafico_con_datos(monkeypatch):
 
     class MockDB:
         @staticmethod
-        def obtener_historial(chat_id, ticker):
+        def obtener_serie(chat_id, ticker, max_puntos):
             return historial
 
     monkeypatch.setattr("bot.grafico.db", MockDB)
@@ -26,7 +26,7 @@ def test_generar_grafico_con_datos(monkeypatch):
 def test_generar_grafico_sin_datos(monkeypatch):
     class MockDB:
         @staticmethod
-        def obtener_historial(chat_id, ticker):
+        def obtener_serie(chat_id, ticker, max_puntos):
             return []
 
     monkeypatch.setattr("bot.grafico.db", MockDB)
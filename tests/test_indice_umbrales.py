@@ -0,0 +1,89 @@
+from hypothesis import given
+from hypothesis import strategies as st
+
+from bot.indice_umbrales import IndiceUmbrales
+
+
+def test_fuera_de_rango_por_arriba_y_por_abajo():
+    indice = IndiceUmbrales()
+    indice.agregar("1", "AAPL", 100, 200)
+    indice.agregar("2", "AAPL", 150, 300)
+    indice.agregar("3", "MSFT", 0, 10)
+
+    assert indice.fuera_de_rango("AAPL", 120) == {"2"}
+    assert indice.fuera_de_rango("AAPL", 250) == {"1"}
+    assert indice.fuera_de_rango("AAPL", 50) == {"1", "2"}
+    assert indice.fuera_de_rango("AAPL", 175) == set()
+    assert indice.fuera_de_rango("TSLA", 1) == set()
+
+
+def test_los_limites_son_inclusivos():
+    indice = IndiceUmbrales()
+    indice.agregar("1", "AAPL", 100, 200)
+
+    assert indice.fuera_de_rango("AAPL", 100) == set()
+    assert indice.fuera_de_rango("AAPL", 200) == set()
+
+
+def test_agregar_actualiza_y_quitar_elimina():
+    indice = IndiceUmbrales()
+    indice.agregar("1", "AAPL", 100, 200)
+    indice.agregar("1", "AAPL", 10, 20)
+
+    assert len(indice) == 1
+    assert indice.fuera_de_rango("AAPL", 150) == {"1"}
+
+    indice.quitar("1", "AAPL")
+    indice.quitar("1", "NOEXISTE")
+    assert len(indice) == 0
+    assert indice.fuera_de_rango("AAPL", 150) == set()
+
+
+def test_vaciar():
+    indice = IndiceUmbrales()
+    indice.agregar("1", "AAPL", 100, 200)
+    indice.vaciar()
+
+    assert len(indice) == 0
+    assert indice.fuera_de_rango("AAPL", 0) == set()
+
+
+def test_por_evaluar_incluye_las_alertas_activas():
+    indice = IndiceUmbrales()
+    indice.agregar("1", "AAPL", 100, 200)
+    indice.agregar("2", "AAPL", 100, 200)
+    indice.marcar_alerta("2", "AAPL", True)
+    indice.marcar_alerta("3", "AAPL", True)  # No está en el índice
+
+    assert indice.por_evaluar("AAPL", 150) == {"2"}
+    assert indice.por_evaluar("AAPL", 50) == {"1", "2"}
+
+    indice.marcar_alerta("2", "AAPL", False)
+    assert indice.por_evaluar("AAPL", 150) == set()
+
+    # Cambiar los límites o dar de baja reinicia la alerta
+    indice.marcar_alerta("1", "AAPL", True)
+    indice.agregar("1", "AAPL", 10, 300)
+    assert indice.por_evaluar("AAPL", 150) == set()
+
+
+limites = st.tuples(st.integers(-50, 50), st.integers(0, 50)).map(lambda t: (float(t[0]), float(t[0] + t[1])))
+
+
+@given(
+    altas=st.lists(st.tuples(st.sampled_from("abcdefgh"), limites), max_size=30),
+    bajas=st.lists(st.sampled_from("abcdefgh"), max_size=5),
+    precio=st.integers(-60, 110).map(float),
+)
+def test_coincide_con_la_comprobacion_lineal(altas, bajas, precio):
+    indice = IndiceUmbrales()
+    esperado = {}
+    for chat_id, (inf, sup) in altas:
+        indice.agregar(chat_id, "AAPL", inf, sup)
+        esperado[chat_id] = (inf, sup)
+    for chat_id in bajas:
+        indice.quitar(chat_id, "AAPL")
+        esperado.pop(chat_id, None)
+
+    lineal = {chat_id for chat_id, (inf, sup) in esperado.items() if not inf <= precio <= sup}
+    assert indice.fuera_de_rango("AAPL", precio) == lineal
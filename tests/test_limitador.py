@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from bot.limitador import CreditosAgotados, LimitadorCreditos, TokenBucket
+
+
+def test_token_bucket_se_rellena_con_el_tiempo(reloj):
+    bucket = TokenBucket(8, 60, reloj)
+
+    bucket.consumir(8)
+    assert bucket.disponibles() == 0
+    assert bucket.espera(1) == pytest.approx(7.5)
+
+    reloj.t += 15
+    assert bucket.disponibles() == pytest.approx(2)
+
+    reloj.t += 1000
+    assert bucket.disponibles() == 8  # Nunca supera la capacidad
+
+
+def test_restantes_por_clave_independientes(reloj):
+    limitador = LimitadorCreditos(por_minuto=8, por_dia=800, reloj=reloj)
+
+    limitador._cubos_de("a")[0].consumir(3)
+    limitador._cubos_de("a")[1].consumir(3)
+
+    assert limitador.restantes("a") == {"minuto": 5, "dia": 797}
+    assert limitador.restantes("b") == {"minuto": 8, "dia": 800}
+
+
+@pytest.mark.asyncio
+async def test_adquirir_espera_en_lugar_de_fallar(monkeypatch, reloj):
+    limitador = LimitadorCreditos(por_minuto=2, por_dia=800, reloj=reloj)
+    esperas = []
+
+    async def fake_sleep(segundos):
+        esperas.append(segundos)
+        reloj.t += segundos
+
+    monkeypatch.setattr("bot.limitador.asyncio.sleep", fake_sleep)
+
+    await limitador.adquirir("k", coste=2)
+    await limitador.adquirir("k", coste=1)
+
+    assert esperas == [pytest.approx(30)]
+    assert limitador.restantes("k")["dia"] == 797
+
+
+@pytest.mark.asyncio
+async def test_adquirir_respeta_presupuesto_diario(reloj):
+    limitador = LimitadorCreditos(por_minuto=8, por_dia=10, max_espera=120, reloj=reloj)
+
+    await limitador.adquirir("k", coste=8)
+    limitador._cubos_de("k")[0].consumir(-8)  # Rellena el cubo del minuto a mano
+
+    with pytest.raises(CreditosAgotados) as excinfo:
+        await limitador.adquirir("k", coste=8)
+
+    # Faltan 6 créditos diarios: 6 * 86400 / 10 segundos
+    assert excinfo.value.espera == pytest.approx(6 * 8640)
+
+
+@pytest.mark.asyncio
+async def test_coste_mayor_que_capacidad():
+    limitador = LimitadorCreditos(por_minuto=8)
+
+    with pytest.raises(ValueError):
+        await limitador.adquirir("k", coste=9)
+
+
+@pytest.mark.asyncio
+async def test_peticiones_de_una_clave_en_orden(monkeypatch, reloj):
+    limitador = LimitadorCreditos(por_minuto=1, por_dia=800, reloj=reloj)
+    orden = []
+    sleep_real = asyncio.sleep
+
+    async def fake_sleep(segundos):
+        reloj.t += segundos
+        await sleep_real(0)
+
+    monkeypatch.setattr("bot.limitador.asyncio.sleep", fake_sleep)
+
+    async def peticion(n):
+        await limitador.adquirir("k")
+        orden.append(n)
+
+    await asyncio.gather(*(peticion(n) for n in range(4)))
+
+    assert orden == [0, 1, 2, 3]
+    assert reloj.t == pytest.approx(1000 + 180)
+
+
+def test_purgar_olvida_claves_inactivas(reloj):
+    limitador = LimitadorCreditos(por_minuto=8, por_dia=800, reloj=reloj)
+    limitador.restantes("inactiva")
+    limitador._cubos_de("activa")[0].consumir(1)
+
+    assert limitador.purgar() == 1
+    assert set(limitador._cubos) == {"activa"}
+
+    # Cuando los cubos se rellenan del todo, la clave también se olvida
+    reloj.t += 86_400
+    assert limitador.purgar() == 1
+    assert limitador._cubos == {}
+
+
+def test_registro_de_claves_acotado(monkeypatch, reloj):
+    monkeypatch.setattr("bot.limitador.MAX_CLAVES_SIN_PURGAR", 10)
+    limitador = LimitadorCreditos(reloj=reloj)
+
+    for i in range(100):
+        limitador.restantes(f"clave{i}")
+
+    assert len(limitador._cubos) <= 10
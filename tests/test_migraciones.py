@@ -0,0 +1,166 @@
+import sqlite3
+
+import pytest
+
+from bot.migraciones import MIGRACIONES, migrar, version_actual
+
+
+def indices(conn, tabla):
+    return {fila[1] for fila in conn.execute(f"PRAGMA index_list({tabla})")}
+
+
+def test_base_nueva_llega_a_la_ultima_version():
+    conn = sqlite3.connect(":memory:")
+
+    assert migrar(conn) == MIGRACIONES[-1][0]
+    assert [fila[0] for fila in conn.execute("SELECT version FROM schema_version ORDER BY version")] == [
+        m[0] for m in MIGRACIONES
+    ]
+    assert {"idx_capturas_usuario_symbol", "idx_capturas_usuario_fecha"} <= indices(conn, "capturas_manuales")
+
+
+def test_migrar_dos_veces_no_hace_nada():
+    conn = sqlite3.connect(":memory:")
+    migrar(conn)
+    migrar(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(MIGRACIONES)
+
+
+def test_actualiza_una_base_anterior_conservando_los_datos():
+    # Base creada antes de existir las migraciones: tablas sin índices ni schema_version
+    conn = sqlite3.connect(":memory:")
+    for sentencia in MIGRACIONES[0][2]:
+        conn.execute(sentencia)
+    conn.execute("INSERT INTO historial_precios (chat_id, symbol, precio) VALUES ('1', 'AAPL', 10.0)")
+    conn.execute("INSERT INTO productos_seguidos (chat_id, symbol) VALUES ('1', 'AAPL')")
+    conn.commit()
+
+    migrar(conn)
+
+    assert conn.execute("SELECT chat_id, symbol, precio FROM historial_precios").fetchall() == [("1", "AAPL", 10.0)]
+    assert conn.execute("SELECT precio FROM capturas_manuales").fetchall() == [(10.0,)]
+    # Quien ya seguía un símbolo empieza a ver los precios de mercado desde la migración
+    assert conn.execute("SELECT chat_id, symbol, hasta FROM periodos_seguimiento").fetchall() == [("1", "AAPL", None)]
+
+
+def test_la_vista_del_historial_admite_inserciones():
+    conn = sqlite3.connect(":memory:")
+    migrar(conn)
+
+    conn.execute("INSERT INTO historial_precios (chat_id, symbol, precio) VALUES ('1', 'AAPL', 10.0)")
+
+    assert conn.execute("SELECT chat_id, symbol, precio FROM capturas_manuales").fetchall() == [("1", "AAPL", 10.0)]
+
+
+def test_las_velas_se_calculan_con_los_precios_existentes_y_los_nuevos():
+    conn = sqlite3.connect(":memory:")
+    migrar(conn, MIGRACIONES[:3])
+    precios = [("2025-01-01 10:00:40", 3.0), ("2025-01-01 10:00:10", 1.0), ("2025-01-01 10:00:50", 2.0)]
+    conn.executemany(
+        "INSERT INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', ?, ?)", [p[::-1] for p in precios[:2]]
+    )
+    conn.commit()
+
+    migrar(conn)
+    conn.execute("INSERT INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', 2.0, '2025-01-01 10:00:50')")
+    conn.execute(
+        "INSERT OR IGNORE INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', 9.0, '2025-01-01 10:00:50')"
+    )
+
+    velas = conn.execute("SELECT segundos, inicio, apertura, maximo, minimo, cierre, num, suma FROM velas").fetchall()
+    assert velas == [
+        (60, "2025-01-01 10:00:00", 1.0, 3.0, 1.0, 2.0, 3, 6.0),
+        (3600, "2025-01-01 10:00:00", 1.0, 3.0, 1.0, 2.0, 3, 6.0),
+        (86400, "2025-01-01 00:00:00", 1.0, 3.0, 1.0, 2.0, 3, 6.0),
+    ]
+
+
+def test_las_velas_existentes_reciben_la_suma_de_cuadrados():
+    conn = sqlite3.connect(":memory:")
+    migrar(conn, MIGRACIONES[:4])
+    conn.executemany(
+        "INSERT INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', ?, ?)",
+        [(1.0, "2025-01-01 10:00:10"), (3.0, "2025-01-01 10:00:40"), (2.0, "2025-01-01 10:05:00")],
+    )
+    # Precios de la vela de las 10:00 ya purgados
+    conn.execute("DELETE FROM precios_mercado WHERE timestamp < '2025-01-01 10:01:00'")
+    conn.commit()
+
+    migrar(conn)
+    conn.execute("INSERT INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', 4.0, '2025-01-01 10:05:30')")
+
+    velas = conn.execute("SELECT inicio, suma_cuadrados FROM velas WHERE segundos = 60 ORDER BY inicio").fetchall()
+    # Sin sus precios, la vela de las 10:00 se aproxima con su media (2.0) para cada precio
+    assert velas == [("2025-01-01 10:00:00", 8.0), ("2025-01-01 10:05:00", 20.0)]
+
+
+def test_las_estadisticas_se_acumulan_con_cada_captura():
+    conn = sqlite3.connect(":memory:")
+    migrar(conn, MIGRACIONES[:4])
+    conn.execute(
+        "INSERT INTO capturas_manuales (chat_id, symbol, precio, timestamp) VALUES ('1', 'AAPL', 3.0, '2025-01-01 09:00:00')"
+    )
+    conn.commit()
+
+    migrar(conn)
+    conn.execute("INSERT INTO periodos_seguimiento (chat_id, symbol, desde) VALUES ('2', 'AAPL', '2025-01-01 10:00:00')")
+    conn.execute("INSERT INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', 2.0, '2025-01-01 10:00:20')")
+    conn.executemany(
+        "INSERT INTO capturas_manuales (chat_id, symbol, precio, timestamp) VALUES (?, 'AAPL', ?, ?)",
+        [("1", 1.0, "2025-01-01 08:00:00"), ("2", 4.0, "2025-01-01 10:00:30")],
+    )
+
+    estadisticas = conn.execute(
+        """
+        SELECT chat_id, num, suma, suma_cuadrados, minimo, maximo, apertura, cierre, primero, ultimo
+        FROM estadisticas_capturas ORDER BY chat_id
+        """
+    ).fetchall()
+    # La captura anterior a la migración se rellena; los precios de mercado no se acumulan por usuario
+    assert estadisticas == [
+        ("1", 2, 4.0, 10.0, 1.0, 3.0, 1.0, 3.0, "2025-01-01 08:00:00", "2025-01-01 09:00:00"),
+        ("2", 1, 4.0, 16.0, 4.0, 4.0, 4.0, 4.0, "2025-01-01 10:00:30", "2025-01-01 10:00:30"),
+    ]
+
+
+def test_una_base_con_las_estadisticas_por_seguidor_deja_de_repartir_los_precios():
+    conn = sqlite3.connect(":memory:")
+    migrar(conn, MIGRACIONES[:5])
+    conn.execute("INSERT INTO periodos_seguimiento (chat_id, symbol, desde) VALUES ('1', 'AAPL', '2025-01-01 10:00:00')")
+    conn.execute(
+        "INSERT INTO capturas_manuales (chat_id, symbol, precio, timestamp) VALUES ('1', 'AAPL', 3.0, '2025-01-01 09:00:00')"
+    )
+    conn.commit()
+
+    migrar(conn)
+    antes = conn.total_changes
+    conn.execute("INSERT INTO precios_mercado (symbol, precio, timestamp) VALUES ('AAPL', 2.0, '2025-01-01 10:00:20')")
+
+    # El precio y sus tres velas, sin escrituras por seguidor
+    assert conn.total_changes - antes == 4
+    objetos = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master")}
+    assert not {"estadisticas_historial", "precios_mercado_estadisticas", "idx_periodos_symbol"} & objetos
+    assert conn.execute("SELECT chat_id, num, suma FROM estadisticas_capturas").fetchall() == [("1", 1, 3.0)]
+
+
+def test_una_migracion_fallida_se_deshace():
+    conn = sqlite3.connect(":memory:")
+    rota = (
+        MIGRACIONES[-1][0] + 1,
+        "Rota",
+        ("CREATE TABLE nueva (x INTEGER)", "CREATE INDEX idx_rota ON no_existe (x)"),
+    )
+    siguiente = (rota[0] + 1, "Siguiente", ("CREATE TABLE otra (x INTEGER)",))
+
+    with pytest.raises(sqlite3.OperationalError):
+        migrar(conn, [*MIGRACIONES, rota, siguiente])
+
+    assert version_actual(conn) == MIGRACIONES[-1][0]
+    tablas = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert not {"nueva", "otra"} & tablas
+
+
+def test_versiones_ordenadas_y_unicas():
+    versiones = [m[0] for m in MIGRACIONES]
+    assert versiones == sorted(set(versiones))
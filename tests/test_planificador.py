@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from bot.planificador import INTERVALO_MINIMO, Planificador
+
+
+def test_extrae_solo_las_vencidas_en_orden(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("1", "MSFT", 5, "Microsoft", 0, 1, vencimiento=1010)
+    planificador.programar("1", "AAPL", 5, "Apple", 0, 1, vencimiento=1005)
+    planificador.programar("2", "TSLA", 5, "Tesla", 0, 1, vencimiento=2000)
+
+    assert planificador.extraer_vencidas() == []
+    assert planificador.segundos_hasta_siguiente() == 5
+
+    reloj.t = 1010
+    assert [s.symbol for s in planificador.extraer_vencidas()] == ["AAPL", "MSFT"]
+    assert planificador.segundos_hasta_siguiente() == 990
+
+
+def test_programar_sin_vencimiento_vence_ya(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("1", "AAPL", 5, "Apple", 0, 1)
+
+    assert planificador.segundos_hasta_siguiente() == 0
+    assert len(planificador.extraer_vencidas()) == 1
+
+
+def test_cancelar_descarta_la_entrada_del_heap(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("1", "AAPL", 5, "Apple", 0, 1)
+    planificador.cancelar("1", "AAPL")
+    planificador.cancelar("1", "NOEXISTE")
+
+    assert len(planificador) == 0
+    assert planificador.segundos_hasta_siguiente() is None
+    assert planificador.extraer_vencidas() == []
+
+
+def test_volver_a_programar_sustituye_la_anterior(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("1", "AAPL", 5, "Apple", 0, 1, vencimiento=1000)
+    planificador.programar("1", "AAPL", 10, "Apple", 50, 60, vencimiento=1100)
+
+    assert planificador.extraer_vencidas() == []
+    reloj.t = 1100
+    [suscripcion] = planificador.extraer_vencidas()
+    assert (suscripcion.intervalo_min, suscripcion.limite_inf) == (10, 50)
+
+
+def test_reprogramar_usa_el_intervalo_y_respeta_el_minimo(reloj):
+    planificador = Planificador(reloj)
+    cada_5 = planificador.programar("1", "AAPL", 5, "Apple", 0, 1)
+    cada_0 = planificador.programar("1", "MSFT", 0, "Microsoft", 0, 1)
+    planificador.extraer_vencidas()
+
+    planificador.reprogramar(cada_5)
+    planificador.reprogramar(cada_0)
+
+    assert cada_5.vencimiento == 1000 + 300
+    assert cada_0.vencimiento == 1000 + INTERVALO_MINIMO
+    assert planificador.segundos_hasta_siguiente() == INTERVALO_MINIMO
+
+
+def test_reprogramar_no_resucita_una_suscripcion_cancelada(reloj):
+    planificador = Planificador(reloj)
+    suscripcion = planificador.programar("1", "AAPL", 5, "Apple", 0, 1)
+    planificador.extraer_vencidas()
+
+    planificador.cancelar("1", "AAPL")
+    planificador.reprogramar(suscripcion)
+
+    assert planificador.segundos_hasta_siguiente() is None
+
+
+def test_cargar_sustituye_el_contenido(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("1", "VIEJA", 5, "Vieja", 0, 1)
+    otra = Planificador(reloj)
+    nuevas = [otra.programar("2", s, 5, s, 0, 1, vencimiento=1000 + i) for i, s in enumerate(["C", "A", "B"])]
+
+    planificador.cargar(nuevas)
+    reloj.t = 2000
+
+    assert [s.symbol for s in planificador.extraer_vencidas()] == ["C", "A", "B"]
+    assert ("1", "VIEJA") not in planificador
+
+
+@pytest.mark.asyncio
+async def test_esperar_se_despierta_al_programar():
+    planificador = Planificador()
+    planificador.programar("1", "AAPL", 5, "Apple", 0, 1, vencimiento=planificador.ahora() + 3600)
+
+    espera = asyncio.create_task(planificador.esperar(60))
+    await asyncio.sleep(0)
+    assert not espera.done()
+
+    planificador.programar("1", "MSFT", 5, "Microsoft", 0, 1)
+    await asyncio.wait_for(espera, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_esperar_hasta_el_siguiente_vencimiento():
+    planificador = Planificador()
+    planificador.programar("1", "AAPL", 5, "Apple", 0, 1, vencimiento=planificador.ahora() + 0.01)
+
+    await asyncio.wait_for(planificador.esperar(60), timeout=1)
+    assert len(planificador.extraer_vencidas()) == 1
+
+
+@pytest.mark.asyncio
+async def test_esperar_sin_suscripciones_respeta_el_maximo():
+    planificador = Planificador()
+    await asyncio.wait_for(planificador.esperar(0.01), timeout=1)
+
+
+def test_registro_compacto(reloj):
+    planificador = Planificador(reloj)
+    a = planificador.programar("1", "".join(["AA", "PL"]), 5, "Apple", 0, 1, vencimiento=1000.7)
+    b = planificador.programar("2", "".join(["AAP", "L"]), 5, "Apple", 0, 1)
+
+    assert not hasattr(a, "__dict__")
+    assert a.symbol is b.symbol
+    assert a.vencimiento == 1000 and isinstance(a.vencimiento, int)
+
+
+def test_las_bajas_no_hacen_crecer_el_registro(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("fijo", "AAPL", 5, "Apple", 0, 1, vencimiento=5000)
+
+    # Meses de usuarios que se suscriben y se van sin que llegue a vencer nada
+    for i in range(10_000):
+        planificador.programar(str(i), "TSLA", 60, "Tesla", 0, 1, vencimiento=4000)
+        planificador.cancelar(str(i), "TSLA")
+
+    estadisticas = planificador.estadisticas()
+    assert estadisticas["suscripciones"] == 1
+    assert estadisticas["entradas_heap"] <= 2 + 64
+    assert estadisticas["compactaciones"] > 0
+
+    reloj.t = 5000
+    assert [s.chat_id for s in planificador.extraer_vencidas()] == ["fijo"]
+
+
+def test_compactar_conserva_las_suscripciones_en_curso(reloj):
+    planificador = Planificador(reloj)
+    en_curso = planificador.programar("1", "AAPL", 5, "Apple", 0, 1)
+    planificador.extraer_vencidas()
+
+    for i in range(200):
+        planificador.programar(str(i), "TSLA", 60, "Tesla", 0, 1, vencimiento=4000)
+        planificador.cancelar(str(i), "TSLA")
+    planificador.reprogramar(en_curso)
+
+    assert planificador.estadisticas()["suscripciones"] == 1
+    assert planificador.segundos_hasta_siguiente() == 300
+
+
+def test_el_indice_sigue_las_altas_y_bajas(reloj):
+    planificador = Planificador(reloj)
+    planificador.programar("1", "AAPL", 5, "Apple", 100, 200)
+    planificador.programar("2", "AAPL", 5, "Apple", 300, 400)
+    assert planificador.indice.fuera_de_rango("AAPL", 250) == {"1", "2"}
+
+    planificador.cancelar("2", "AAPL")
+    assert planificador.indice.fuera_de_rango("AAPL", 250) == {"1"}
+
+    otra = Planificador(reloj)
+    planificador.cargar([otra.programar("3", "MSFT", 5, "Microsoft", 0, 1)])
+    assert planificador.indice.fuera_de_rango("AAPL", 250) == set()
+    assert planificador.indice.fuera_de_rango("MSFT", 2) == {"3"}
+
+
+def test_el_indice_sigue_los_estados_de_alerta(reloj):
+    planificador = Planificador(reloj)
+    otra = Planificador(reloj)
+    cargada = otra.programar("1", "AAPL", 5, "Apple", 100, 200)
+    cargada.estado_alerta = "sobre"
+    planificador.cargar([cargada, otra.programar("2", "AAPL", 5, "Apple", 100, 200)])
+    assert planificador.indice.por_evaluar("AAPL", 150) == {"1"}
+
+    planificador.cambiar_estado_alerta(cargada, "dentro")
+    assert planificador.indice.por_evaluar("AAPL", 150) == set()
+
+    # Una suscripción sustituida mientras se revisaba no marca a la nueva
+    sustituida = planificador._suscripciones[("2", "AAPL")]
+    planificador.programar("2", "AAPL", 5, "Apple", 100, 200)
+    planificador.cambiar_estado_alerta(sustituida, "bajo")
+    assert (sustituida.estado_alerta, sustituida.ultima_alerta) == ("bajo", None)
+    assert planificador.indice.por_evaluar("AAPL", 150) == set()
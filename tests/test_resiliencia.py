@@ -0,0 +1,92 @@
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from unittest.mock import AsyncMock
+
+import pytest
+
+from bot.resiliencia import (
+    CircuitBreaker,
+    CircuitoAbierto,
+    ErrorTransitorio,
+    interpretar_retry_after,
+    reintentar,
+)
+
+
+def test_interpretar_retry_after():
+    assert interpretar_retry_after(None) is None
+    assert interpretar_retry_after("5") == 5.0
+    assert interpretar_retry_after("basura") is None
+    fecha = format_datetime(datetime.now(UTC) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= interpretar_retry_after(fecha) <= 30
+
+
+def test_circuito_ciclo_completo(reloj):
+    circuito = CircuitBreaker("api", umbral_fallos=2, enfriamiento=10, reloj=reloj)
+
+    circuito.registrar_fallo()
+    assert circuito.estado == "cerrado"
+    circuito.registrar_fallo()
+    assert circuito.estado == "abierto"
+
+    with pytest.raises(CircuitoAbierto):
+        circuito.comprobar()
+
+    reloj.t += 10
+    assert circuito.estado == "semiabierto"
+    circuito.comprobar()
+
+    # Un fallo en semiabierto vuelve a abrir el circuito al momento
+    circuito.registrar_fallo()
+    assert circuito.estado == "abierto"
+
+    reloj.t += 10
+    circuito.registrar_exito()
+    assert circuito.estadisticas() == {
+        "estado": "cerrado",
+        "fallos_consecutivos": 0,
+        "aperturas": 2,
+        "rechazadas": 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_reintentar_backoff_exponencial_con_jitter(monkeypatch):
+    dormir = AsyncMock()
+    monkeypatch.setattr("bot.resiliencia.asyncio.sleep", dormir)
+    monkeypatch.setattr("bot.resiliencia.random.uniform", lambda a, b: b)
+    funcion = AsyncMock(side_effect=[ErrorTransitorio("x"), ErrorTransitorio("x"), ErrorTransitorio("x"), "ok"])
+
+    resultado = await reintentar(funcion, intentos=4, base=1, maximo=3)
+
+    assert resultado == "ok"
+    assert [c.args[0] for c in dormir.await_args_list] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_reintentar_respeta_retry_after(monkeypatch):
+    dormir = AsyncMock()
+    monkeypatch.setattr("bot.resiliencia.asyncio.sleep", dormir)
+    funcion = AsyncMock(side_effect=[ErrorTransitorio("429", retry_after=2.5), "ok"])
+
+    assert await reintentar(funcion, intentos=3, maximo=8) == "ok"
+    dormir.assert_awaited_once_with(2.5)
+
+
+@pytest.mark.asyncio
+async def test_reintentar_no_espera_retry_after_excesivo(monkeypatch):
+    monkeypatch.setattr("bot.resiliencia.asyncio.sleep", AsyncMock())
+    funcion = AsyncMock(side_effect=ErrorTransitorio("429", retry_after=600))
+
+    with pytest.raises(ErrorTransitorio):
+        await reintentar(funcion, intentos=3, maximo=8)
+    assert funcion.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_reintentar_no_reintenta_errores_permanentes():
+    funcion = AsyncMock(side_effect=ValueError("JSON inválido"))
+
+    with pytest.raises(ValueError):
+        await reintentar(funcion, intentos=3)
+    assert funcion.await_count == 1
@@ -1,116 +1,627 @@
 import asyncio
-from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 
 from bot import seguimiento
+from bot.planificador import Planificador
+
+
+@pytest.fixture(autouse=True)
+def planificador(monkeypatch, reloj):
+    nuevo = Planificador(reloj=reloj)
+    monkeypatch.setattr("bot.seguimiento.planificador", nuevo)
+    return nuevo
+
+
+@pytest.fixture(autouse=True)
+def revisiones_guardadas(monkeypatch):
+    guardadas = MagicMock()
+    monkeypatch.setattr("bot.seguimiento.db.guardar_revisiones", guardadas)
+    monkeypatch.setattr("bot.seguimiento.db.obtener_revisiones", lambda: {})
+    monkeypatch.setattr("bot.seguimiento.db.guardar_estados_alerta", MagicMock())
+    monkeypatch.setattr("bot.seguimiento.db.obtener_estados_alerta", lambda: {})
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", MagicMock())
+    monkeypatch.setattr("bot.seguimiento.db.aplicar_retencion", MagicMock(return_value=0))
+    return guardadas
+
+
+@pytest.fixture(autouse=True)
+def cola(monkeypatch):
+    cola = MagicMock()
+    cola.encolar.return_value = True
+    monkeypatch.setattr("bot.seguimiento.cola_envios", cola)
+    return cola
+
+
+def programar(planificador, *productos, chat_id="123"):
+    return [planificador.programar(chat_id, *producto) for producto in productos]
+
+
+def por_chat(suscripciones):
+    return {s.chat_id: s for s in suscripciones}
+
+
+def claves(api_key_de):
+    return lambda chat_ids: {chat_id: clave for chat_id in chat_ids if (clave := api_key_de(chat_id))}
+
+
+def suscripciones_activas(**productos):
+    return lambda: [(chat_id, *producto, "API_KEY") for chat_id, lista in productos.items() for producto in lista]
+
+
+def respuesta(**precios):
+    return AsyncMock(
+        side_effect=lambda symbols, api_key, permitir_obsoleto: {
+            s: {"precio": precios[s], "nombre": s, "error": None} for s in symbols
+        }
+    )
 
 
 @pytest.mark.asyncio
-async def test_procesar_usuario_envia_alerta(monkeypatch):
-    seguimiento.ultima_revision.clear()
-    monkeypatch.setattr("bot.seguimiento.db.obtener_api_key", lambda cid: "API_KEY")
+async def test_procesar_vencidas_envia_alerta(monkeypatch, planificador):
+    suscripciones = programar(planificador, ("AAPL", 0, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
     monkeypatch.setattr(
-        "bot.seguimiento.db.obtener_productos",
-        lambda cid: [("AAPL", 0, "Apple", 100.0, 200.0)],
+        "bot.seguimiento.cache_precios.obtener_varias",
+        AsyncMock(return_value={"AAPL": {"precio": 250.0, "nombre": "Apple", "error": None}}),
     )
-    monkeypatch.setattr("bot.seguimiento.db.guardar_precio", lambda cid, sym, p: None)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+    seguimiento.cola_envios.encolar.assert_called_once()
+    assert suscripciones[0].vencimiento > 1000.0
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_consulta_todos_los_simbolos_en_un_lote(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 0, "Apple", 100.0, 200.0), ("MSFT", 0, "Microsoft", 100.0, 500.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    guardados = []
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: guardados.append((sym, p)))
+    mock_fetch = respuesta(AAPL=150.0, MSFT=400.0)
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", mock_fetch)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    mock_fetch.assert_awaited_once_with(["AAPL", "MSFT"], "API_KEY", permitir_obsoleto=False)
+    assert guardados == [("AAPL", 150.0), ("MSFT", 400.0)]
+    seguimiento.cola_envios.encolar.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_consulta_cada_simbolo_una_vez_para_todos(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0), chat_id="1")
+    programar(planificador, ("AAPL", 1, "Apple", 300.0, 400.0), ("MSFT", 1, "Microsoft", 0.0, 1000.0), chat_id="2")
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: f"KEY{cid}"))
+    guardados = []
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: guardados.append((sym, p)))
+    mock_fetch = respuesta(AAPL=150.0, MSFT=400.0)
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", mock_fetch)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    consultados = [s for c in mock_fetch.await_args_list for s in c.args[0]]
+    assert sorted(consultados) == ["AAPL", "MSFT"]
+    # El precio se guarda una vez por símbolo, no por suscriptor
+    assert sorted(guardados) == [("AAPL", 150.0), ("MSFT", 400.0)]
+    # Cada suscriptor evalúa sus propios límites
+    seguimiento.cola_envios.encolar.assert_called_once()
+    assert seguimiento.cola_envios.encolar.call_args.args[0] == "2"
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_usa_la_api_key_del_servicio(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 1, "Apple", 0.0, 1000.0))
+    monkeypatch.setattr("bot.seguimiento.API_KEY_SERVICIO", "SERVICIO")
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    mock_fetch = respuesta(AAPL=150.0)
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", mock_fetch)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    mock_fetch.assert_awaited_once_with(["AAPL"], "SERVICIO", permitir_obsoleto=False)
+
+
+def test_asignar_claves_usa_otra_clave_si_se_agota(monkeypatch):
+    monkeypatch.setattr("bot.seguimiento.API_KEY_SERVICIO", "SERVICIO")
+    presupuestos = {"SERVICIO": 1, "A": 0, "B": 5}
+    monkeypatch.setattr("bot.seguimiento.limitador_creditos.restantes", lambda key: {"minuto": 8, "dia": presupuestos[key]})
+    planificador = Planificador()
+    por_symbol = {
+        "AAPL": por_chat(programar(planificador, ("AAPL", 1, "Apple", 0.0, 1.0), chat_id="a")),
+        "MSFT": por_chat(
+            programar(planificador, ("MSFT", 1, "Microsoft", 0.0, 1.0), chat_id="a")
+            + programar(planificador, ("MSFT", 1, "Microsoft", 0.0, 1.0), chat_id="b")
+        ),
+        "TSLA": por_chat(programar(planificador, ("TSLA", 1, "Tesla", 0.0, 1.0), chat_id="a")),
+    }
+
+    por_clave, aplazados = seguimiento.asignar_claves(por_symbol, {"a": "A", "b": "B"})
+
+    assert por_clave == {"SERVICIO": ["AAPL"], "B": ["MSFT"]}
+    assert aplazados == ["TSLA"]
+
+
+def test_asignar_claves_reparte_entre_las_claves_con_creditos_por_minuto(monkeypatch):
+    monkeypatch.setattr("bot.seguimiento.API_KEY_SERVICIO", "SERVICIO")
+    presupuestos = {"SERVICIO": {"minuto": 2, "dia": 800}, "A": {"minuto": 1, "dia": 800}, "B": {"minuto": 8, "dia": 0}}
+    monkeypatch.setattr("bot.seguimiento.limitador_creditos.restantes", lambda key: dict(presupuestos[key]))
+    planificador = Planificador()
+    symbols = ["AAPL", "MSFT", "TSLA", "AMZN", "NVDA"]
+    por_symbol = {
+        symbol: por_chat(
+            programar(planificador, (symbol, 1, symbol, 0.0, 1.0), chat_id="a")
+            + programar(planificador, (symbol, 1, symbol, 0.0, 1.0), chat_id="b")
+        )
+        for symbol in symbols
+    }
+
+    por_clave, aplazados = seguimiento.asignar_claves(por_symbol, {"a": "A", "b": "B"})
+
+    # B no tiene créditos diarios; cada símbolo va a la clave con más créditos en el minuto
+    assert por_clave == {"SERVICIO": ["AAPL", "MSFT", "AMZN"], "A": ["TSLA", "NVDA"]}
+    assert aplazados == []
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_ignora_precio_de_respaldo(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 0, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    mock_guardar = MagicMock()
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", mock_guardar)
     monkeypatch.setattr(
-        "bot.seguimiento.fetch_stock_price",
-        lambda s, k: {"precio": 250.0, "nombre": "Apple", "error": None},
+        "bot.seguimiento.cache_precios.obtener_varias",
+        AsyncMock(return_value={"AAPL": {"precio": 250.0, "nombre": "Apple", "error": None, "obsoleto": True}}),
     )
 
-    mock_bot = MagicMock()
-    mock_bot.send_message = AsyncMock()
-    app = MagicMock()
-    app.bot = mock_bot
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
 
-    await seguimiento.procesar_usuario(app, "123")
-    mock_bot.send_message.assert_called_once()
+    mock_guardar.assert_not_called()
+    seguimiento.cola_envios.encolar.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_procesar_usuario_sin_api_key(monkeypatch):
-    monkeypatch.setattr("bot.seguimiento.db.obtener_api_key", lambda cid: None)
+async def test_procesar_vencidas_aplaza_lo_que_no_cabe_en_el_presupuesto(monkeypatch, planificador):
+    aapl, msft = programar(planificador, ("AAPL", 60, "Apple", 0.0, 1000.0), ("MSFT", 60, "Microsoft", 0.0, 1000.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    monkeypatch.setattr("bot.seguimiento.limitador_creditos.restantes", lambda key: {"minuto": 8, "dia": 1})
+    mock_fetch = respuesta(AAPL=150.0)
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", mock_fetch)
 
-    mock_bot = MagicMock()
-    mock_bot.send_message = AsyncMock()
-    app = MagicMock()
-    app.bot = mock_bot
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
 
-    await seguimiento.procesar_usuario(app, "123")
-    mock_bot.send_message.assert_not_called()
+    mock_fetch.assert_awaited_once_with(["AAPL"], "API_KEY", permitir_obsoleto=False)
+    # La revisada espera su intervalo; la aplazada se reintenta cuanto antes
+    assert aapl.vencimiento == 1000.0 + 3600
+    assert msft.vencimiento < aapl.vencimiento
 
 
 @pytest.mark.asyncio
-async def test_procesar_usuario_dentro_de_intervalo(monkeypatch):
-    seguimiento.ultima_revision[("123", "AAPL")] = datetime.now()
+async def test_procesar_vencidas_sin_api_key(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 5, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: None))
+    mock_fetch = AsyncMock()
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", mock_fetch)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+    mock_fetch.assert_not_awaited()
+    seguimiento.cola_envios.encolar.assert_not_called()
+    # Se vuelve a intentar en la siguiente revisión
+    assert planificador.segundos_hasta_siguiente() == 300
 
-    monkeypatch.setattr("bot.seguimiento.db.obtener_api_key", lambda cid: "API_KEY")
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_error_en_api(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 0, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
     monkeypatch.setattr(
-        "bot.seguimiento.db.obtener_productos",
-        lambda cid: [("AAPL", 1, "Apple", 100.0, 200.0)],
+        "bot.seguimiento.cache_precios.obtener_varias",
+        AsyncMock(return_value={"AAPL": {"precio": None, "nombre": "Apple", "error": "Error"}}),
     )
 
-    app = MagicMock()
-    app.bot = MagicMock()
-
-    await seguimiento.procesar_usuario(app, "123")
-    app.bot.send_message.assert_not_called()
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+    seguimiento.cola_envios.encolar.assert_not_called()
 
 
 @pytest.mark.asyncio
-async def test_procesar_usuario_error_en_api(monkeypatch):
-    seguimiento.ultima_revision.clear()
-    monkeypatch.setattr("bot.seguimiento.db.obtener_api_key", lambda cid: "API_KEY")
+async def test_procesar_vencidas_fallo_de_consulta_no_corta_el_resto(monkeypatch, planificador):
+    programar(planificador, ("AAPL", 1, "Apple", 0.0, 1000.0), chat_id="1")
+    programar(planificador, ("MSFT", 1, "Microsoft", 0.0, 1000.0), chat_id="2")
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: f"KEY{cid}"))
+    guardados = []
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: guardados.append(sym))
+
+    async def fake_obtener_varias(symbols, api_key, permitir_obsoleto):
+        if api_key == "KEY1":
+            raise RuntimeError("boom")
+        return {"MSFT": {"precio": 1.0, "nombre": "Microsoft", "error": None}}
+
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", fake_obtener_varias)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    assert guardados == ["MSFT"]
+    assert len(planificador) == 2 and planificador.segundos_hasta_siguiente() == 60
+
+
+def test_repartir_precio_fallo_de_un_suscriptor_no_corta_el_resto(monkeypatch, planificador):
+    suscripciones = programar(planificador, ("AAPL", 1, "Apple", 0.0, 1.0), chat_id="1")
+    suscripciones += programar(planificador, ("AAPL", 1, "Apple", 0.0, 1.0), chat_id="2")
+
+    def encolar(chat_id, mensaje):
+        if chat_id == "1":
+            raise Exception("bloqueada")
+        return True
+
+    seguimiento.cola_envios.encolar.side_effect = encolar
+
+    seguimiento.repartir_precio("AAPL", {"precio": 5.0, "nombre": "Apple", "error": None}, por_chat(suscripciones))
+
+    assert sorted(c.args[0] for c in seguimiento.cola_envios.encolar.call_args_list) == ["1", "2"]
+    assert suscripciones[1].ultima_alerta is not None
+
+
+def test_repartir_precio_error_al_guardar_el_precio_no_corta_las_alertas(monkeypatch, planificador, caplog):
+    suscripciones = programar(planificador, ("AAPL", 1, "Apple", 0.0, 1.0), chat_id="1")
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", MagicMock(side_effect=Exception("bloqueada")))
+
+    seguimiento.repartir_precio("AAPL", {"precio": 5.0, "nombre": "Apple", "error": None}, por_chat(suscripciones))
+
+    assert "Error al guardar el precio de AAPL" in caplog.text
+    seguimiento.cola_envios.encolar.assert_called_once()
+
+
+def test_repartir_precio_no_repite_alertas_hasta_el_enfriamiento(monkeypatch, planificador, reloj):
+    [suscripcion] = programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    monkeypatch.setattr("bot.seguimiento.alertas.ENFRIAMIENTO", 3600)
+    guardar_estados = MagicMock()
+    monkeypatch.setattr("bot.seguimiento.db.guardar_estados_alerta", guardar_estados)
+    cotizacion = {"precio": 50.0, "nombre": "Apple", "error": None}
+
+    for _ in range(10):
+        seguimiento.repartir_precio("AAPL", cotizacion, por_chat([suscripcion]))
+        reloj.t += 60
+
+    assert seguimiento.cola_envios.encolar.call_count == 1
+    guardar_estados.assert_called_once_with([("123", "AAPL", "bajo", 1000)])
+
+    # Pasado el enfriamiento se recuerda que sigue fuera del rango
+    reloj.t = 1000.0 + 3600
+    seguimiento.repartir_precio("AAPL", cotizacion, por_chat([suscripcion]))
+    assert seguimiento.cola_envios.encolar.call_count == 2
+
+
+def test_repartir_precio_alerta_de_nuevo_tras_volver_al_rango(monkeypatch, planificador):
+    [suscripcion] = programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    monkeypatch.setattr("bot.seguimiento.alertas.HISTERESIS", 0.05)
+
+    # Rompe por abajo, oscila dentro de la banda de histéresis, vuelve al rango y rompe por arriba
+    for precio in [99.0, 101.0, 98.0, 103.0, 150.0, 210.0]:
+        seguimiento.repartir_precio("AAPL", {"precio": precio, "nombre": "Apple", "error": None}, por_chat([suscripcion]))
+
+    assert seguimiento.cola_envios.encolar.call_count == 2
+    assert suscripcion.estado_alerta == "sobre"
+
+
+def test_repartir_precio_reintenta_si_la_cola_esta_llena(monkeypatch, planificador):
+    [suscripcion] = programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    seguimiento.cola_envios.encolar.side_effect = [False, True]
+    cotizacion = {"precio": 50.0, "nombre": "Apple", "error": None}
+
+    seguimiento.repartir_precio("AAPL", cotizacion, por_chat([suscripcion]))
+    assert (suscripcion.estado_alerta, suscripcion.ultima_alerta) == ("bajo", None)
+    seguimiento.repartir_precio("AAPL", cotizacion, por_chat([suscripcion]))
+
+    assert seguimiento.cola_envios.encolar.call_count == 2
+    assert suscripcion.ultima_alerta == 1000
+
+
+def test_repartir_precio_solo_evalua_las_que_el_indice_da_fuera(monkeypatch, planificador):
+    suscripciones = [
+        planificador.programar(str(i), "AAPL", 1, "Apple", float(i), float(i + 100)) for i in range(0, 1000, 10)
+    ]
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", MagicMock())
+    clasificar = MagicMock(wraps=seguimiento.alertas.clasificar)
+    monkeypatch.setattr("bot.seguimiento.alertas.clasificar", clasificar)
+
+    seguimiento.repartir_precio("AAPL", {"precio": 55.0, "nombre": "Apple", "error": None}, por_chat(suscripciones))
+
+    # 55 solo queda fuera de los rangos que empiezan por encima de él
+    alertados = {c.args[0] for c in seguimiento.cola_envios.encolar.call_args_list}
+    assert alertados == {s.chat_id for s in suscripciones if s.limite_inf > 55}
+    assert clasificar.call_count == len(alertados)
+    seguimiento.db.guardar_precio_mercado.assert_called_once_with("AAPL", 55.0)
+
+
+def test_repartir_precio_evalua_las_alertas_activas_aunque_vuelvan_al_rango(monkeypatch, planificador):
+    suscripciones = por_chat(
+        programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0), chat_id=str(i))[0] for i in range(50)
+    )
+    clasificar = MagicMock(wraps=seguimiento.alertas.clasificar)
+    monkeypatch.setattr("bot.seguimiento.alertas.clasificar", clasificar)
+    planificador.cambiar_estado_alerta(suscripciones["7"], "bajo")
+
+    seguimiento.repartir_precio("AAPL", {"precio": 150.0, "nombre": "Apple", "error": None}, suscripciones)
+
+    # Solo la que tenía la alerta activa, que vuelve a "dentro" y sale del índice
+    assert clasificar.call_count == 1
+    assert suscripciones["7"].estado_alerta == "dentro"
+    assert planificador.indice.por_evaluar("AAPL", 150.0) == set()
+
+
+def test_cargar_suscripciones_recupera_el_estado_de_alerta(monkeypatch, planificador):
     monkeypatch.setattr(
-        "bot.seguimiento.db.obtener_productos",
-        lambda cid: [("AAPL", 0, "Apple", 100.0, 200.0)],
+        "bot.seguimiento.db.iterar_suscripciones_activas", suscripciones_activas(**{"123": [("AAPL", 5, "Apple", 1.0, 2.0)]})
     )
-    monkeypatch.setattr("bot.seguimiento.db.guardar_precio", lambda cid, sym, p: None)
+    monkeypatch.setattr("bot.seguimiento.db.obtener_estados_alerta", lambda: {("123", "AAPL"): ("sobre", 900)})
+
+    seguimiento.cargar_suscripciones()
+
+    [suscripcion] = planificador.extraer_vencidas(ahora=float("inf"))
+    assert (suscripcion.estado_alerta, suscripcion.ultima_alerta) == ("sobre", 900)
+
+
+def test_repartir_precio_error_al_guardar_estados(monkeypatch, planificador):
+    [suscripcion] = programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    monkeypatch.setattr("bot.seguimiento.db.guardar_estados_alerta", MagicMock(side_effect=Exception("bloqueada")))
+
+    seguimiento.repartir_precio("AAPL", {"precio": 50.0, "nombre": "Apple", "error": None}, por_chat([suscripcion]))
+
+    seguimiento.cola_envios.encolar.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_limita_consultas_concurrentes(monkeypatch, planificador, caplog):
+    for i in range(6):
+        programar(planificador, ("AAPL", 1, "Apple", 0.0, 1000.0), chat_id=str(i))
+    monkeypatch.setattr("bot.seguimiento.MAX_CONSULTAS_CONCURRENTES", 2)
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: f"KEY{cid}"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    monkeypatch.setattr("bot.seguimiento.limitador_creditos.por_minuto", 1)
+    activos = 0
+    maximo = 0
+
+    async def fake_obtener_varias(symbols, api_key, permitir_obsoleto):
+        nonlocal activos, maximo
+        activos += 1
+        maximo = max(maximo, activos)
+        await asyncio.sleep(0.01)
+        activos -= 1
+        return {s: {"precio": 1.0, "nombre": s, "error": None} for s in symbols}
+
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", fake_obtener_varias)
+    for i, symbol in enumerate(["MSFT", "TSLA", "AMZN"]):
+        programar(planificador, (symbol, 1, symbol, 0.0, 1000.0), chat_id=str(i))
+
+    with caplog.at_level("INFO"):
+        await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    assert maximo == 2
+    assert "Revisadas 9 suscripciones de 4 símbolos" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_limita_consultas_por_api_key(monkeypatch, planificador):
+    for i, symbol in enumerate(["AAPL", "MSFT", "TSLA", "AMZN"]):
+        programar(planificador, (symbol, 1, symbol, 0.0, 1000.0), chat_id=f"compartida{i}")
+    programar(planificador, ("NVDA", 1, "Nvidia", 0.0, 1000.0), chat_id="propia")
+    monkeypatch.setattr("bot.seguimiento.MAX_CONSULTAS_POR_API_KEY", 1)
+    monkeypatch.setattr("bot.seguimiento.limitador_creditos.por_minuto", 1)
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: cid if cid == "propia" else "COMPARTIDA"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    en_curso = {"COMPARTIDA": 0, "propia": 0}
+    maximo_por_clave = 0
+    maximo_total = 0
+
+    async def fake_obtener_varias(symbols, api_key, permitir_obsoleto):
+        nonlocal maximo_por_clave, maximo_total
+        en_curso[api_key] += 1
+        maximo_por_clave = max(maximo_por_clave, en_curso[api_key])
+        maximo_total = max(maximo_total, sum(en_curso.values()))
+        await asyncio.sleep(0.01)
+        en_curso[api_key] -= 1
+        return {s: {"precio": 1.0, "nombre": s, "error": None} for s in symbols}
+
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", fake_obtener_varias)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    # Una clave nunca tiene dos consultas a la vez, pero claves distintas sí van en paralelo
+    assert maximo_por_clave == 1
+    assert maximo_total == 2
+
+
+@pytest.mark.asyncio
+async def test_los_lotes_que_esperan_a_su_clave_no_ocupan_plazas_globales(monkeypatch, planificador):
+    for i, symbol in enumerate(["AAPL", "MSFT", "TSLA", "AMZN"]):
+        programar(planificador, (symbol, 1, symbol, 0.0, 1000.0), chat_id=f"compartida{i}")
+    programar(planificador, ("NVDA", 1, "Nvidia", 0.0, 1000.0), chat_id="propia")
+    monkeypatch.setattr("bot.seguimiento.MAX_CONSULTAS_CONCURRENTES", 2)
+    monkeypatch.setattr("bot.seguimiento.MAX_CONSULTAS_POR_API_KEY", 1)
+    monkeypatch.setattr("bot.seguimiento.limitador_creditos.por_minuto", 1)
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: cid if cid == "propia" else "COMPARTIDA"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+    inicios = []
+
+    async def fake_obtener_varias(symbols, api_key, permitir_obsoleto):
+        inicios.append(api_key)
+        await asyncio.sleep(0.01)
+        return {s: {"precio": 1.0, "nombre": s, "error": None} for s in symbols}
+
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", fake_obtener_varias)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    # La otra clave no espera a que la compartida termine sus cuatro lotes
+    assert inicios[:2] == ["COMPARTIDA", "propia"]
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_sin_vencidas_no_hace_nada(monkeypatch):
+    mock_fetch = AsyncMock()
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", mock_fetch)
+
+    await seguimiento.procesar_vencidas([])
+
+    mock_fetch.assert_not_awaited()
+
+
+def test_cargar_suscripciones(monkeypatch, planificador):
+    productos = {"123": [("AAPL", 5, "Apple", 1.0, 2.0)], "456": [("MSFT", 10, "Microsoft", 3.0, 4.0)]}
+    monkeypatch.setattr("bot.seguimiento.db.iterar_suscripciones_activas", suscripciones_activas(**productos))
+
+    seguimiento.cargar_suscripciones()
+
+    assert len(planificador) == 2
+    vencidas = planificador.extraer_vencidas(ahora=float("inf"))
+    assert sorted((s.chat_id, s.symbol) for s in vencidas) == [("123", "AAPL"), ("456", "MSFT")]
+
+
+def test_cargar_suscripciones_respeta_el_estado_guardado(monkeypatch, planificador):
+    productos = [("AAPL", 60, "Apple", 1.0, 2.0), ("MSFT", 60, "Microsoft", 3.0, 4.0), ("TSLA", 1, "Tesla", 0, 1)]
+    monkeypatch.setattr("bot.seguimiento.db.iterar_suscripciones_activas", suscripciones_activas(**{"123": productos}))
+    # AAPL aún no toca; MSFT está atrasada y TSLA no tiene estado
+    revisiones = {("123", "AAPL"): (900.0, 1500.0), ("123", "MSFT"): (100.0, 200.0)}
+    monkeypatch.setattr("bot.seguimiento.db.obtener_revisiones", lambda: revisiones)
+    monkeypatch.setattr("bot.seguimiento.VENTANA_ARRANQUE", 300.0)
+
+    seguimiento.cargar_suscripciones()
+
+    vencimientos = {s.symbol: s.vencimiento for s in planificador.extraer_vencidas(ahora=float("inf"))}
+    assert vencimientos["AAPL"] == 1500.0
+    assert 1000.0 <= vencimientos["MSFT"] <= 1300.0
+    # La ventana nunca supera el intervalo de la suscripción
+    assert 1000.0 <= vencimientos["TSLA"] <= 1060.0
+
+
+def test_vencimiento_al_arrancar_reparte_las_atrasadas(monkeypatch):
+    monkeypatch.setattr("bot.seguimiento.VENTANA_ARRANQUE", 300.0)
+
+    vencimientos = {seguimiento.vencimiento_al_arrancar(None, 60, 1000.0) for _ in range(50)}
+
+    assert all(1000.0 <= v <= 1300.0 for v in vencimientos)
+    assert len(vencimientos) > 1
+
+
+@pytest.mark.asyncio
+async def test_procesar_vencidas_guarda_el_estado(monkeypatch, planificador, revisiones_guardadas):
+    aapl, msft = programar(planificador, ("AAPL", 5, "Apple", 0.0, 1000.0), ("MSFT", 5, "Microsoft", 0.0, 1000.0))
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: "API_KEY"))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_precio_mercado", lambda sym, p: None)
+
+    async def fake_obtener_varias(symbols, api_key, permitir_obsoleto):
+        # El usuario deja de seguir MSFT mientras se consulta
+        planificador.cancelar("123", "MSFT")
+        return {s: {"precio": 1.0, "nombre": s, "error": None} for s in symbols}
+
+    monkeypatch.setattr("bot.seguimiento.cache_precios.obtener_varias", fake_obtener_varias)
+
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+
+    revisiones_guardadas.assert_called_once_with([("123", "AAPL", 1000.0, 1300.0)])
+
+
+def test_guardar_estado_no_propaga_errores(monkeypatch, planificador):
+    suscripciones = programar(planificador, ("AAPL", 5, "Apple", 0.0, 1.0))
+    monkeypatch.setattr("bot.seguimiento.db.guardar_revisiones", MagicMock(side_effect=Exception("bloqueada")))
+
+    seguimiento.guardar_estado(suscripciones, 1000.0)
+
+
+@pytest.mark.asyncio
+async def test_lanzar_seguimiento_y_comprobar_alertas(monkeypatch, planificador):
     monkeypatch.setattr(
-        "bot.seguimiento.fetch_stock_price",
-        lambda s, k: {"precio": None, "nombre": "Apple", "error": "Error"},
+        "bot.seguimiento.db.iterar_suscripciones_activas", suscripciones_activas(**{"123": [("AAPL", 5, "Apple", 1.0, 2.0)]})
     )
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: None))
+    monkeypatch.setattr("bot.seguimiento.VENTANA_ARRANQUE", 0.0)
+    monkeypatch.setattr(planificador, "esperar", AsyncMock(side_effect=asyncio.CancelledError()))
 
-    mock_bot = MagicMock()
-    mock_bot.send_message = AsyncMock()
     app = MagicMock()
-    app.bot = mock_bot
+    tareas = []
+    app.create_task = lambda coro: tareas.append(asyncio.create_task(coro))
+
+    await seguimiento.lanzar_seguimiento(app)
+    with pytest.raises(asyncio.CancelledError):
+        await tareas[0]
 
-    await seguimiento.procesar_usuario(app, "123")
-    mock_bot.send_message.assert_not_called()
+    # Se cargó, se procesó y quedó reprogramada para dentro de su intervalo
+    assert planificador.segundos_hasta_siguiente() == 300
 
 
 @pytest.mark.asyncio
-async def test_lanzar_seguimiento_y_comprobar_alertas(monkeypatch):
-    monkeypatch.setattr("bot.seguimiento.db.obtener_usuarios", lambda: ["123"])
-    monkeypatch.setattr("bot.seguimiento.db.obtener_api_key", lambda cid: None)
+async def test_comprobar_alertas_solo_procesa_vencidas(monkeypatch, planificador, reloj):
+    monkeypatch.setattr("bot.seguimiento.cargar_suscripciones", lambda: None)
+    programar(planificador, ("AAPL", 1, "Apple", 0.0, 1.0))
+    planificador.programar("123", "MSFT", 1, "Microsoft", 0.0, 1.0, vencimiento=reloj.t + 45)
+    procesadas = []
 
-    async def fake_sleep(x):
-        raise asyncio.CancelledError()
+    async def fake_procesar(vencidas):
+        procesadas.append([s.symbol for s in vencidas])
 
-    monkeypatch.setattr("bot.seguimiento.asyncio.sleep", fake_sleep)
+    esperas = []
 
-    app = MagicMock()
-    app.create_task = lambda coro: asyncio.create_task(coro)
+    async def fake_esperar(maximo):
+        esperas.append(planificador.segundos_hasta_siguiente())
+        if len(esperas) == 2:
+            raise asyncio.CancelledError()
+        reloj.t += esperas[-1]
+
+    monkeypatch.setattr("bot.seguimiento.procesar_vencidas", fake_procesar)
+    monkeypatch.setattr(planificador, "esperar", fake_esperar)
+
+    with pytest.raises(asyncio.CancelledError):
+        await seguimiento.comprobar_alertas_periodicamente(MagicMock())
+
+    assert procesadas == [["AAPL"], ["MSFT"]]
+    assert esperas == [45, None]
+
+
+@pytest.mark.asyncio
+async def test_comprobar_alertas_purga_el_historial_cada_intervalo(monkeypatch, planificador, reloj):
+    monkeypatch.setattr("bot.seguimiento.cargar_suscripciones", lambda: None)
+    monkeypatch.setattr("bot.seguimiento.INTERVALO_RETENCION", 100.0)
+    esperas = []
+
+    async def fake_esperar(maximo):
+        esperas.append(reloj.t)
+        if len(esperas) == 4:
+            raise asyncio.CancelledError()
+        reloj.t += 60
+
+    monkeypatch.setattr(planificador, "esperar", fake_esperar)
 
     with pytest.raises(asyncio.CancelledError):
-        await seguimiento.lanzar_seguimiento(app)
-        await asyncio.sleep(0.1)
+        await seguimiento.comprobar_alertas_periodicamente(MagicMock())
+
+    # Al arrancar y otra vez pasados 100 s (a los 120)
+    assert seguimiento.db.aplicar_retencion.call_count == 2
 
 
 @pytest.mark.asyncio
-async def test_comprobar_alertas_error_general(monkeypatch):
-    # Simula un error al obtener usuarios
-    monkeypatch.setattr("bot.seguimiento.db.obtener_usuarios", lambda: 1 / 0)
+async def test_aplicar_retencion_no_propaga_errores(monkeypatch, caplog):
+    monkeypatch.setattr("bot.seguimiento.db.aplicar_retencion", MagicMock(side_effect=Exception("bloqueada")))
 
-    # Sleep forzado para evitar bucle infinito
-    async def fake_sleep(x):
-        raise asyncio.CancelledError()
+    await seguimiento.aplicar_retencion()
 
-    monkeypatch.setattr("bot.seguimiento.asyncio.sleep", fake_sleep)
+    assert "Error al aplicar la retención" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_comprobar_alertas_error_general(monkeypatch, planificador):
+    # Simula un error al leer las suscripciones
+    monkeypatch.setattr("bot.seguimiento.db.iterar_suscripciones_activas", lambda: 1 / 0)
+
+    # Espera forzada para evitar bucle infinito
+    monkeypatch.setattr(planificador, "esperar", AsyncMock(side_effect=asyncio.CancelledError()))
 
     app = MagicMock()
 
@@ -119,15 +630,12 @@ async def test_comprobar_alertas_error_general(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_procesar_usuario_error_general(monkeypatch):
+async def test_procesar_vencidas_error_general(monkeypatch, planificador):
+    suscripciones = programar(planificador, ("AAPL", 1, "Apple", 100.0, 200.0))
     # Fuerza un error al obtener la API key
-    monkeypatch.setattr("bot.seguimiento.db.obtener_api_key", lambda cid: 1 / 0)
-
-    mock_bot = MagicMock()
-    mock_bot.send_message = AsyncMock()
-    app = MagicMock()
-    app.bot = mock_bot
+    monkeypatch.setattr("bot.seguimiento.db.obtener_api_keys", claves(lambda cid: 1 / 0))
 
     # No se debe lanzar error en el test, solo debe ejecutarse el except
-    await seguimiento.procesar_usuario(app, "123")
-    mock_bot.send_message.assert_not_called()
+    await seguimiento.procesar_vencidas(planificador.extraer_vencidas())
+    seguimiento.cola_envios.encolar.assert_not_called()
+    assert suscripciones[0].vencimiento == 1000.0 + 60
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from bot.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_llamadas_concurrentes_comparten_resultado():
+    vuelos = SingleFlight()
+    llamadas = 0
+
+    async def consulta():
+        nonlocal llamadas
+        llamadas += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    resultados = await asyncio.gather(*(vuelos.ejecutar("TSLA", consulta) for _ in range(10)))
+
+    assert resultados == [42] * 10
+    assert llamadas == 1
+    assert vuelos.ejecuciones == 1
+    assert vuelos.coalescidas == 9
+    assert vuelos.en_vuelo() == 0
+
+
+@pytest.mark.asyncio
+async def test_error_se_propaga_a_todos():
+    vuelos = SingleFlight()
+
+    async def consulta():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("API caída")
+
+    resultados = await asyncio.gather(*(vuelos.ejecutar("TSLA", consulta) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in resultados)
+    assert vuelos.en_vuelo() == 0
+
+
+@pytest.mark.asyncio
+async def test_llamadas_secuenciales_no_se_coalescen():
+    vuelos = SingleFlight()
+
+    async def consulta():
+        return 1
+
+    await vuelos.ejecutar("A", consulta)
+    await vuelos.ejecutar("A", consulta)
+
+    assert vuelos.ejecuciones == 2
+    assert vuelos.coalescidas == 0
+
+
+@pytest.mark.asyncio
+async def test_lote_solo_consulta_claves_no_en_vuelo():
+    vuelos = SingleFlight()
+    lotes = []
+
+    async def consulta(claves):
+        lotes.append(list(claves))
+        await asyncio.sleep(0.01)
+        return {c: c.lower() for c in claves}
+
+    primero = asyncio.create_task(vuelos.ejecutar_lote(["A", "B"], consulta))
+    await asyncio.sleep(0)
+    segundo = await vuelos.ejecutar_lote(["B", "C"], consulta)
+
+    assert await primero == {"A": "a", "B": "b"}
+    assert segundo == {"B": "b", "C": "c"}
+    assert lotes == [["A", "B"], ["C"]]
+
+
+@pytest.mark.asyncio
+async def test_clave_ausente_en_resultado_lanza_keyerror():
+    vuelos = SingleFlight()
+
+    async def consulta(claves):
+        return {}
+
+    with pytest.raises(KeyError):
+        await vuelos.ejecutar_lote(["A"], consulta)
+
+
+@pytest.mark.asyncio
+async def test_cancelar_al_iniciador_no_afecta_al_resto():
+    vuelos = SingleFlight()
+
+    async def consulta():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    iniciador = asyncio.create_task(vuelos.ejecutar("A", consulta))
+    await asyncio.sleep(0)
+    seguidor = asyncio.create_task(vuelos.ejecutar("A", consulta))
+    await asyncio.sleep(0)
+    iniciador.cancel()
+
+    assert await seguidor == "ok"
+    with pytest.raises(asyncio.CancelledError):
+        await iniciador
@@ -1,3 +1,5 @@
+import functools
+import gzip
 from io import BytesIO
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -6,6 +8,8 @@ import pytest
 from telegram import Message, Update, User
 
 matplotlib.use("Agg")
+from bot import exportacion
+from bot.planificador import Planificador
 from bot.telegram_bot import (
     PEDIR_API_KEY,
     ayuda,
@@ -171,8 +175,8 @@ async def test_seguir_error_api(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": None, "nombre": None, "error": "No data"},
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"precio": None, "nombre": None, "error": "No data"}),
     )
 
     await seguir(update, context)
@@ -203,15 +207,19 @@ async def test_seguir_valido(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": 100.0, "nombre": "Apple", "error": None},
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"precio": 100.0, "nombre": "Apple", "error": None}),
     )
     mock_agregar = MagicMock()
     monkeypatch.setattr("bot.telegram_bot.db.agregar_producto", mock_agregar)
+    planificador = Planificador()
+    monkeypatch.setattr("bot.telegram_bot.planificador", planificador)
 
     await seguir(update, context)
     update.message.reply_text.assert_called()
     mock_agregar.assert_called_once()
+    assert ("1", "AAPL") in planificador
+    assert planificador.segundos_hasta_siguiente() == 0
 
 
 @pytest.mark.asyncio
@@ -224,8 +232,9 @@ async def test_seguir_completo(monkeypatch):
     context.args = ["AAPL", "30", "100", "200"]
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda *_: "clave")
-    monkeypatch.setattr("bot.telegram_bot.fetch_stock_price", lambda *_: {"error": None, "nombre": "Apple"})
+    monkeypatch.setattr("bot.telegram_bot.cache_precios.obtener", AsyncMock(return_value={"error": None, "nombre": "Apple"}))
     monkeypatch.setattr("bot.telegram_bot.db.agregar_producto", lambda *_: None)
+    monkeypatch.setattr("bot.telegram_bot.planificador", Planificador())
 
     from bot.telegram_bot import seguir
 
@@ -315,7 +324,10 @@ async def test_price_con_error(monkeypatch):
     context.args = ["AAPL"]
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda *_: "clave")
-    monkeypatch.setattr("bot.telegram_bot.fetch_stock_price", lambda *_: {"error": "No válido"})
+    monkeypatch.setattr(
+        "bot.telegram_bot.cache_precios.obtener_varias",
+        AsyncMock(return_value={"AAPL": {"error": "No válido"}}),
+    )
 
     from bot.telegram_bot import price
 
@@ -334,8 +346,8 @@ async def test_price_valido(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": 123.45, "nombre": "Apple Inc.", "error": None},
+        "bot.telegram_bot.cache_precios.obtener_varias",
+        AsyncMock(return_value={"AAPL": {"precio": 123.45, "nombre": "Apple Inc.", "error": None}}),
     )
 
     await price(update, context)
@@ -345,6 +357,56 @@ async def test_price_valido(monkeypatch):
     )
 
 
+@pytest.mark.asyncio
+async def test_price_varios_tickers_en_un_lote(monkeypatch):
+    update = MagicMock(spec=Update)
+    update.message = MagicMock()
+    update.message.reply_text = AsyncMock()
+    update.effective_user = MagicMock()
+    context = MagicMock()
+    context.args = ["aapl", "MSFT", "AAPL", "XXXX"]
+
+    monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
+    mock_fetch = AsyncMock(
+        return_value={
+            "AAPL": {"precio": 123.45, "nombre": "Apple Inc.", "error": None},
+            "MSFT": {"precio": 400.0, "nombre": "Microsoft", "error": None},
+            "XXXX": {"precio": None, "nombre": None, "error": "symbol_not_found"},
+        }
+    )
+    monkeypatch.setattr("bot.telegram_bot.cache_precios.obtener_varias", mock_fetch)
+
+    await price(update, context)
+
+    mock_fetch.assert_awaited_once_with(["AAPL", "MSFT", "XXXX"], "FAKE_API_KEY")
+    texto = update.message.reply_text.call_args.args[0]
+    assert "Apple Inc." in texto
+    assert "Microsoft" in texto
+    assert "symbol\\_not\\_found" in texto
+
+
+@pytest.mark.asyncio
+async def test_price_indica_precio_obsoleto(monkeypatch):
+    update = MagicMock(spec=Update)
+    update.message = MagicMock()
+    update.message.reply_text = AsyncMock()
+    update.effective_user = MagicMock()
+    context = MagicMock()
+    context.args = ["AAPL"]
+
+    monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
+    monkeypatch.setattr(
+        "bot.telegram_bot.cache_precios.obtener_varias",
+        AsyncMock(return_value={"AAPL": {"precio": 120.0, "nombre": "Apple Inc.", "error": None, "obsoleto": True}}),
+    )
+
+    await price(update, context)
+
+    texto = update.message.reply_text.call_args.args[0]
+    assert "120.00$" in texto
+    assert "Último precio conocido" in texto
+
+
 # -------------------------------
 # /historial
 # -------------------------------
@@ -392,8 +454,8 @@ async def test_historial_ticker_invalido(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": None, "nombre": None, "error": "Invalid ticker"},
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"precio": None, "nombre": None, "error": "Invalid ticker"}),
     )
 
     await historial(update, context)
@@ -411,8 +473,8 @@ async def test_historial_vacio(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": 123.45, "nombre": "Apple Inc.", "error": None},
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"precio": 123.45, "nombre": "Apple Inc.", "error": None}),
     )
     monkeypatch.setattr("bot.telegram_bot.db.obtener_historial", lambda chat_id, ticker: [])
 
@@ -431,12 +493,14 @@ async def test_historial_valido(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda symbol, api_key: {
-            "precio": 123.45,
-            "nombre": "Apple Inc.",
-            "error": None,
-        },
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(
+            return_value={
+                "precio": 123.45,
+                "nombre": "Apple Inc.",
+                "error": None,
+            }
+        ),
     )
     monkeypatch.setattr(
         "bot.telegram_bot.db.obtener_historial",
@@ -501,8 +565,8 @@ async def test_guardar_error_precio(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": None, "nombre": "Apple", "error": None},
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"precio": None, "nombre": "Apple", "error": None}),
     )
 
     await guardar(update, context)
@@ -521,8 +585,8 @@ async def test_guardar_correcto(monkeypatch):
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
     monkeypatch.setattr(
-        "bot.telegram_bot.fetch_stock_price",
-        lambda *args: {"precio": 154.32, "nombre": "Apple Inc.", "error": None},
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"precio": 154.32, "nombre": "Apple Inc.", "error": None}),
     )
 
     mock_guardar = MagicMock()
@@ -535,6 +599,28 @@ async def test_guardar_correcto(monkeypatch):
     mock_guardar.assert_called_once_with("1", "AAPL", 154.32)
 
 
+@pytest.mark.asyncio
+async def test_guardar_no_guarda_precio_obsoleto(monkeypatch):
+    update = MagicMock(spec=Update)
+    update.message = MagicMock()
+    update.message.reply_text = AsyncMock()
+    update.effective_user = MagicMock(id=1)
+    context = MagicMock()
+    context.args = ["AAPL"]
+
+    monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda chat_id: "FAKE_API_KEY")
+    mock_obtener = AsyncMock(return_value={"precio": 150.0, "nombre": "Apple Inc.", "error": None, "obsoleto": True})
+    monkeypatch.setattr("bot.telegram_bot.cache_precios.obtener", mock_obtener)
+    mock_guardar = MagicMock()
+    monkeypatch.setattr("bot.telegram_bot.db.guardar_precio", mock_guardar)
+
+    await guardar(update, context)
+
+    mock_obtener.assert_awaited_once_with("AAPL", "FAKE_API_KEY", permitir_obsoleto=False)
+    mock_guardar.assert_not_called()
+    assert "actualizado" in update.message.reply_text.call_args.args[0]
+
+
 @pytest.mark.asyncio
 async def test_guardar_precio_invalido(monkeypatch):
     update = MagicMock(spec=Update)
@@ -545,7 +631,10 @@ async def test_guardar_precio_invalido(monkeypatch):
     context.args = ["AAPL"]
 
     monkeypatch.setattr("bot.telegram_bot.db.obtener_api_key", lambda *_: "clave")
-    monkeypatch.setattr("bot.telegram_bot.fetch_stock_price", lambda *_: {"error": None, "precio": "abc", "nombre": "Apple"})
+    monkeypatch.setattr(
+        "bot.telegram_bot.cache_precios.obtener",
+        AsyncMock(return_value={"error": None, "precio": "abc", "nombre": "Apple"}),
+    )
 
     from bot.telegram_bot import guardar
 
@@ -639,7 +728,7 @@ async def test_dejar_no_seguido(monkeypatch):
     context.args = ["AAPL"]
 
     # Simula que el usuario no sigue nada
-    monkeypatch.setattr("bot.telegram_bot.db.obtener_productos", lambda chat_id: [])
+    monkeypatch.setattr("bot.telegram_bot.db.obtener_simbolos_seguidos", lambda chat_id: frozenset())
 
     await dejar(update, context)
 
@@ -655,14 +744,19 @@ async def test_dejar_ok(monkeypatch):
     context = MagicMock()
     context.args = ["AAPL"]
 
-    productos_seguidos = [("AAPL", 15, "Apple", 100.0, 200.0)]
-    monkeypatch.setattr("bot.telegram_bot.db.obtener_productos", lambda chat_id: productos_seguidos)
+    monkeypatch.setattr("bot.telegram_bot.db.obtener_simbolos_seguidos", lambda chat_id: frozenset({"AAPL"}))
 
     mock_eliminar = MagicMock()
     monkeypatch.setattr("bot.telegram_bot.db.eliminar_producto", mock_eliminar)
+    planificador = Planificador()
+    planificador.programar("1", "AAPL", 15, "Apple", 100.0, 200.0)
+    monkeypatch.setattr("bot.telegram_bot.planificador", planificador)
 
     await dejar(update, context)
 
+    assert ("1", "AAPL") not in planificador
+    assert planificador.extraer_vencidas() == []
+
     update.message.reply_text.assert_called_once_with("🗑️ Has dejado de seguir AAPL.")
     mock_eliminar.assert_called_once_with("1", "AAPL")
 
@@ -740,10 +834,8 @@ async def test_exportar_historial_con_ticker(monkeypatch):
     context.args = ["AAPL"]
 
     monkeypatch.setattr(
-        "bot.telegram_bot.db.obtener_historial_usuario",
-        lambda chat_id, ticker=None: [
-            {"Símbolo": "AAPL", "Precio": 150.0, "Fecha": "2024-05-23 12:00"},
-        ],
+        "bot.telegram_bot.db.iterar_historial_usuario",
+        lambda chat_id, ticker=None: iter([("AAPL", 150.0, "2024-05-23 12:00")]),
     )
 
     from bot.telegram_bot import exportar_historial
@@ -764,7 +856,7 @@ async def test_exportar_historial_sin_datos(monkeypatch):
     context = MagicMock()
     context.args = []
 
-    monkeypatch.setattr("bot.telegram_bot.db.obtener_historial_usuario", lambda chat_id, ticker=None: [])
+    monkeypatch.setattr("bot.telegram_bot.db.iterar_historial_usuario", lambda chat_id, ticker=None: iter([]))
 
     from bot.telegram_bot import exportar_historial
 
@@ -781,7 +873,7 @@ async def test_exportar_historial_sin_datos_con_ticker(monkeypatch):
     context = MagicMock()
     context.args = ["AAPL"]
 
-    monkeypatch.setattr("bot.telegram_bot.db.obtener_historial_usuario", lambda *_: [])
+    monkeypatch.setattr("bot.telegram_bot.db.iterar_historial_usuario", lambda *_: iter([]))
 
     from bot.telegram_bot import exportar_historial
 
@@ -801,13 +893,15 @@ async def test_exportar_historial_ok(monkeypatch):
 
     # Simula historial para el usuario
     historial = [
-        {"Símbolo": "AAPL", "Precio": 150.0, "Fecha": "2024-05-23 12:00"},
-        {"Símbolo": "TSLA", "Precio": 750.0, "Fecha": "2024-05-23 13:00"},
+        ("AAPL", 150.0, "2024-05-23 12:00"),
+        ("TSLA", 750.0, "2024-05-23 13:00"),
     ]
     monkeypatch.setattr(
-        "bot.telegram_bot.db.obtener_historial_usuario",
-        lambda chat_id, ticker=None: historial,
+        "bot.telegram_bot.db.iterar_historial_usuario",
+        lambda chat_id, ticker=None: iter(historial),
     )
+    contenidos = []
+    update.message.reply_document.side_effect = lambda document, **_: contenidos.append(document.input_file_content.read())
 
     from bot.telegram_bot import exportar_historial
 
@@ -816,6 +910,62 @@ async def test_exportar_historial_ok(monkeypatch):
     args, kwargs = update.message.reply_document.call_args
     assert kwargs["filename"] == "historial.csv"
     assert kwargs["caption"] == "Aquí tienes tu historial completo en formato CSV."
+    assert contenidos == ["Símbolo,Precio,Fecha\nAAPL,150.0,2024-05-23 12:00\nTSLA,750.0,2024-05-23 13:00\n".encode()]
+    assert kwargs["document"].input_file_content.closed
+
+
+@pytest.mark.asyncio
+async def test_exportar_historial_comprimido(monkeypatch):
+    update = MagicMock(spec=Update)
+    update.message = MagicMock()
+    update.message.reply_document = AsyncMock()
+    update.effective_user = MagicMock(id=1)
+    context = MagicMock()
+    context.args = ["aapl", "gz"]
+
+    pedidos = []
+
+    def iterar(chat_id, ticker=None):
+        pedidos.append(ticker)
+        return iter([("AAPL", 150.0, "2024-05-23 12:00")])
+
+    monkeypatch.setattr("bot.telegram_bot.db.iterar_historial_usuario", iterar)
+    contenidos = []
+    update.message.reply_document.side_effect = lambda document, **_: contenidos.append(
+        gzip.decompress(document.input_file_content.read())
+    )
+
+    from bot.telegram_bot import exportar_historial
+
+    await exportar_historial(update, context)
+    assert pedidos == ["AAPL"]
+    args, kwargs = update.message.reply_document.call_args
+    assert kwargs["filename"] == "historial_AAPL.csv.gz"
+    assert contenidos == ["Símbolo,Precio,Fecha\nAAPL,150.0,2024-05-23 12:00\n".encode()]
+
+
+@pytest.mark.asyncio
+async def test_exportar_historial_grande_se_envia_en_partes(monkeypatch):
+    update = MagicMock(spec=Update)
+    update.message = MagicMock()
+    update.message.reply_document = AsyncMock()
+    update.effective_user = MagicMock(id=1)
+    context = MagicMock()
+    context.args = []
+
+    historial = [("AAPL", float(i), "2024-05-23 12:00") for i in range(10)]
+    monkeypatch.setattr("bot.telegram_bot.db.iterar_historial_usuario", lambda chat_id, ticker=None: iter(historial))
+    monkeypatch.setattr("bot.telegram_bot.exportar_csv", functools.partial(exportacion.exportar_csv, limite=200))
+
+    from bot.telegram_bot import exportar_historial
+
+    await exportar_historial(update, context)
+    llamadas = update.message.reply_document.call_args_list
+    assert [kwargs["filename"] for _, kwargs in llamadas] == ["historial_parte1.csv", "historial_parte2.csv"]
+    assert [kwargs["caption"] for _, kwargs in llamadas] == [
+        "Aquí tienes tu historial completo en formato CSV. (parte 1 de 2)",
+        "Aquí tienes tu historial completo en formato CSV. (parte 2 de 2)",
+    ]
 
 
 # -------------------------------
@@ -949,7 +1099,7 @@ async def test_recibir_api_key_valida(monkeypatch):
 @pytest.mark.asyncio
 @patch("bot.telegram_bot.db.obtener_estadisticas")
 async def test_media_historial_ok(mock_obtener_estadisticas):
-    mock_obtener_estadisticas.return_value = (100.0, 200.0, 150.0)
+    mock_obtener_estadisticas.return_value = (100.0, 200.0, 150.0, 40.824829)
 
     update = MagicMock(spec=Update)
     update.message = MagicMock()
@@ -960,7 +1110,10 @@ async def test_media_historial_ok(mock_obtener_estadisticas):
 
     await media_historial(update, context)
 
-    expected_msg = "📊 Estadísticas de AAPL en tu historial:\n\n🔻 Mínimo: 100.0 €\n🔺 Máximo: 200.0 €\n📈 Media: 150.0 €"
+    expected_msg = (
+        "📊 Estadísticas de AAPL en tu historial:\n\n🔻 Mínimo: 100.0 €\n🔺 Máximo: 200.0 €\n📈 Media: 150.0 €\n"
+        "📏 Desviación típica: 40.82 €"
+    )
     update.message.reply_text.assert_called_once_with(expected_msg)
 
 
@@ -980,6 +1133,7 @@ async def test_media_historial_sin_datos(mock_obtener_estadisticas):
 
     update.message.reply_text.assert_called_once_with("No tienes historial guardado para AAPL.")
 
+
 @pytest.mark.asyncio
 async def test_media_historial_sin_usuario():
     update = MagicMock(spec=Update)
@@ -989,6 +1143,7 @@ async def test_media_historial_sin_usuario():
 
     await media_historial(update, context)
 
+
 @pytest.mark.asyncio
 async def test_media_historial_args_invalidos():
     update = MagicMock(spec=Update)
@@ -1002,6 +1157,7 @@ async def test_media_historial_args_invalidos():
     await media_historial(update, context)
     update.message.reply_text.assert_called_once_with("Uso correcto: /media <TICKER>\nEjemplo: /media AAPL")
 
+
 @pytest.mark.asyncio
 @patch("bot.telegram_bot.db.obtener_estadisticas", side_effect=Exception("Fallo interno"))
 async def test_media_historial_excepcion(mock_obtener):
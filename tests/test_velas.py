@@ -0,0 +1,92 @@
+from hypothesis import given
+from hypothesis import strategies as st
+
+from bot import velas
+from bot.velas import DIA, HORA, MINUTO, TICKS
+
+
+def cubierto(tramo):
+    """Intervalo de tiempo [desde, hasta) que cubren las filas de un tramo."""
+    nivel, desde, hasta = tramo
+    if nivel == TICKS:
+        return desde, hasta
+    return desde, velas.inicio_vela(hasta - 1, nivel) + nivel
+
+
+def solapan(tramos):
+    intervalos = sorted(cubierto(t) for t in tramos)
+    return any(a[1] > b[0] for a, b in zip(intervalos, intervalos[1:], strict=False))
+
+
+instantes = st.integers(min_value=1_700_000_000, max_value=1_700_000_000 + 10 * DIA)
+
+
+def test_usa_las_velas_mas_gruesas_que_caben():
+    desde = velas.a_segundos("2025-01-01 10:00:30")
+    hasta = velas.a_segundos("2025-01-03 12:30:10")
+
+    assert [(n, velas.a_fecha(d), velas.a_fecha(h)) for n, d, h in velas.tramos([(desde, hasta)])] == [
+        (TICKS, "2025-01-01 10:00:30", "2025-01-01 10:01:00"),
+        (MINUTO, "2025-01-01 10:01:00", "2025-01-01 11:00:00"),
+        (HORA, "2025-01-01 11:00:00", "2025-01-02 00:00:00"),
+        (DIA, "2025-01-02 00:00:00", "2025-01-03 00:00:00"),
+        (HORA, "2025-01-03 00:00:00", "2025-01-03 12:00:00"),
+        (MINUTO, "2025-01-03 12:00:00", "2025-01-03 12:30:00"),
+        (TICKS, "2025-01-03 12:30:00", "2025-01-03 12:30:10"),
+    ]
+
+
+@given(instantes, st.integers(min_value=0, max_value=5 * DIA))
+def test_reparte_el_intervalo_sin_huecos_ni_solapes(desde, duracion):
+    tramos = velas.tramos([(desde, desde + duracion)])
+
+    assert not solapan(tramos)
+    assert sum(h - d for d, h in map(cubierto, tramos)) == duracion
+
+
+@given(instantes, st.integers(min_value=1, max_value=5 * DIA), st.sampled_from([MINUTO, HORA, DIA]))
+def test_con_un_nivel_minimo_los_bordes_usan_la_vela_que_los_contiene(desde, duracion, minima):
+    tramos = velas.tramos([(desde, desde + duracion)], minima=minima)
+
+    assert all(nivel >= minima for nivel, _, _ in tramos)
+    assert not solapan(tramos)
+    assert cubierto(tramos[0])[0] <= desde and cubierto(tramos[-1])[1] >= desde + duracion
+
+
+@given(
+    st.lists(st.tuples(st.integers(0, DIA), st.integers(1, 2 * DIA)), min_size=1, max_size=4),
+    st.floats(min_value=0, max_value=8),
+    st.floats(min_value=0, max_value=8),
+)
+def test_los_tramos_purgados_se_leen_del_nivel_superior(huecos_y_duraciones, dias_ticks, dias_minutos):
+    ahora = 1_700_000_000 + 10 * DIA
+    cortes = velas.cortes_retencion(ahora, {TICKS: dias_ticks, MINUTO: dias_minutos})
+    # Periodos consecutivos sin solapes, como los de seguimiento
+    intervalos, fin = [], 1_700_000_000
+    for hueco, duracion in huecos_y_duraciones:
+        intervalos.append((fin + hueco, fin + hueco + duracion))
+        fin = intervalos[-1][1]
+
+    tramos = velas.tramos(intervalos, cortes=cortes)
+
+    assert not solapan(tramos)
+    assert all(desde >= cortes.get(nivel, desde) for nivel, desde, _ in tramos)
+    for desde, hasta in intervalos:
+        assert any(cubierto(t)[0] <= desde < cubierto(t)[1] for t in tramos)
+        assert any(cubierto(t)[0] < hasta <= cubierto(t)[1] for t in tramos)
+
+
+def test_un_nivel_no_conserva_mas_que_el_superior():
+    ahora = velas.a_segundos("2025-03-01 12:00:00")
+
+    cortes = velas.cortes_retencion(ahora, {TICKS: 30, MINUTO: 10})
+
+    assert velas.a_fecha(cortes[MINUTO]) == "2025-02-19 00:00:00"
+    assert cortes[TICKS] == cortes[MINUTO]
+    assert HORA not in cortes
+
+
+def test_elegir_nivel():
+    assert velas.elegir_nivel(3 * HORA, 200) == MINUTO
+    assert velas.elegir_nivel(5 * DIA, 200) == HORA
+    assert velas.elegir_nivel(365 * DIA, 200) == DIA